@@ -0,0 +1,129 @@
+"""Alarm rules for tracker status and location updates.
+
+`AlarmRules` turns what the ingest path already has in memory into
+`VehicleAlarm` events:
+
+- device alarms decoded from the tracker (`mdata['alarm']`: 'sos',
+  'power_cut', 'shock', 'low_battery', ...);
+- ignition on/off, compared with the vehicle's current `ignition`;
+- overspeed: a fix above `VEHICLE_OVERSPEED_KMH` while `Vehicle.overspeed`
+  is False raises the alarm and sets the flag; a fix back under the limit
+  clears it.
+
+Each (vehicle, kind) is raised at most once per `ALARM_DEDUP_SECONDS`, so a
+tracker repeating an SOS every few seconds produces one event. Events are
+queued on the ingest writer (bulk inserted with the next flush) and
+published as `alarm` casts; vehicles come from the IMEI cache, so raising
+an alarm costs no query.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from vehicles.models import VehicleAlarm
+from .ingest_writer import get_writer
+from .sapi_broadcaster import publish_cast
+
+logger = logging.getLogger(__name__)
+
+
+class AlarmRules:
+    """In-memory rule evaluation with a per-(vehicle, kind) dedup window."""
+
+    def __init__(self, dedup_seconds=300):
+        self.dedup_seconds = dedup_seconds
+        self._last = {}  # (veh_id, kind) -> monotonic time last raised
+        self._lock = threading.Lock()
+        self.stats = {'raised': 0, 'suppressed': 0}
+
+    def on_status(self, veh, mdata):
+        """Evaluate a status update; call before `veh` is updated from `mdata`."""
+        where = {'lat': mdata.get('lat'), 'lon': mdata.get('lon'), 'speed': mdata.get('speed'),
+                 'fix_time': mdata.get('time')}
+        raised = []
+        alarm = mdata.get('alarm')
+        if alarm:
+            raised += self.raise_alarms(veh, [(alarm, VehicleAlarm.Source.DEVICE)],
+                                        code=mdata.get('alarm_code'), **where)
+        ign = mdata.get('ignition')
+        if ign is not None and bool(ign) != bool(veh.ignition):
+            raised += self.raise_alarms(veh, [('ignition_on' if ign else 'ignition_off',
+                                               VehicleAlarm.Source.RULE)], **where)
+        return raised
+
+    def on_location(self, veh, lat, lon, speed, fix_time=None):
+        """Evaluate a fix against the overspeed limit and keep `veh.overspeed` current."""
+        over = float(speed or 0) > getattr(settings, 'VEHICLE_OVERSPEED_KMH', 80)
+        if over == bool(veh.overspeed):
+            return []
+        veh.overspeed = over
+        get_writer().update_vehicle(veh.veh_id, overspeed=over)
+        if not over:
+            return []
+        return self.raise_alarms(veh, [('overspeed', VehicleAlarm.Source.RULE)],
+                                 lat=lat, lon=lon, speed=speed, fix_time=fix_time)
+
+    def raise_alarms(self, veh, kinds, lat=None, lon=None, speed=None, fix_time=None, code=None):
+        """Queue and publish (kind, source) alarms not raised within the dedup window."""
+        now = time.monotonic()
+        raised = []
+        for kind, source in kinds:
+            key = (veh.veh_id, kind)
+            with self._lock:
+                last = self._last.get(key)
+                if last is not None and now - last < self.dedup_seconds:
+                    self.stats['suppressed'] += 1
+                    continue
+                self._last[key] = now
+                self.stats['raised'] += 1
+            data = {'kind': kind, 'source': str(source), 'code': code,
+                    'lat': float(lat) if lat is not None else None,
+                    'lon': float(lon) if lon is not None else None,
+                    'speed': float(speed) if speed is not None else None,
+                    'time': fix_time.isoformat() if fix_time else None}
+            raised.append(data)
+            get_writer().add(VehicleAlarm(vehicle_id=veh.veh_id, kind=kind, source=source, code=code,
+                                          lat=data['lat'], lon=data['lon'], speed=data['speed'],
+                                          time=fix_time))
+            try:
+                publish_cast({'type': 'alarm', 'imei': veh.imei, 'data': data,
+                              'vehicle': veh.veh_id, 'client': veh.client_id_id})
+            except Exception:
+                logger.exception('publish alarm cast failed')
+        return raised
+
+    def forget(self, veh_id=None):
+        """Reset the dedup window of one vehicle (or all)."""
+        with self._lock:
+            if veh_id is None:
+                self._last.clear()
+            else:
+                for key in [k for k in self._last if k[0] == veh_id]:
+                    del self._last[key]
+
+
+alarm_rules = AlarmRules(dedup_seconds=getattr(settings, 'ALARM_DEDUP_SECONDS', 300))
+
+
+def check_status(veh, mdata):
+    """Ingest hook for status updates; never raises."""
+    if veh is None or not getattr(settings, 'ALARMS_ENABLED', True):
+        return []
+    try:
+        return alarm_rules.on_status(veh, mdata)
+    except Exception:
+        logger.exception('alarm rules failed for vehicle %s', veh.veh_id)
+        return []
+
+
+def check_location(veh, lat, lon, speed, fix_time=None):
+    """Ingest hook for fixes (overspeed); never raises."""
+    if veh is None or not getattr(settings, 'ALARMS_ENABLED', True):
+        return []
+    try:
+        return alarm_rules.on_location(veh, lat, lon, speed, fix_time)
+    except Exception:
+        logger.exception('alarm rules failed for vehicle %s', veh.veh_id)
+        return []
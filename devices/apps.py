@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'devices'
+
+    def ready(self):
+        # connect the IMEI cache invalidation and geofence reload signals
+        from . import geofences, imei_cache  # noqa: F401
@@ -0,0 +1,146 @@
+"""Message bus carrying casts from publishers to Socket.IO bridge workers.
+
+With `SAPI_CAST_BACKEND = 'redis'`, `publish_cast()` publishes batches of
+casts to the Redis channel `SAPI_CAST_CHANNEL` and every bridge worker
+(`scripts/flask_ws.py`, on any core or host) subscribes to it and delivers
+to its own browser clients. Messages are JSON arrays of cast dicts.
+
+`InProcessCastBus` has the same interface without a server, for tests and
+single-process setups.
+"""
+import json
+import logging
+import queue
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL = 'sapi:casts'
+
+
+class Subscription:
+    """Handle returned by `subscribe()`; `close()` stops delivery."""
+
+    def __init__(self, thread, stop):
+        self._thread = thread
+        self._stop = stop
+
+    def close(self, timeout=2):
+        self._stop()
+        self._thread.join(timeout)
+
+
+class InProcessCastBus:
+    """Fan casts out to subscriber threads inside this process.
+
+    Each subscriber gets its own queue and thread, like a Redis subscriber
+    gets its own connection, so a slow handler only delays itself.
+    """
+
+    def __init__(self, max_queue=10000):
+        self.max_queue = max_queue
+        self._queues = []
+        self._lock = threading.Lock()
+
+    def publish_many(self, casts):
+        # same wire format as Redis: plain JSON types only
+        casts = json.loads(json.dumps(casts, default=str))
+        with self._lock:
+            queues = list(self._queues)
+        for q in queues:
+            try:
+                q.put_nowait(casts)
+            except queue.Full:
+                logger.warning('in-process cast subscriber is full, dropping %d casts', len(casts))
+        return len(queues)
+
+    def subscribe(self, handler):
+        """Call `handler(casts)` with each published list of casts."""
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._queues.append(q)
+
+        def run():
+            while True:
+                casts = q.get()
+                if casts is None:
+                    return
+                try:
+                    handler(casts)
+                except Exception:
+                    logger.exception('cast subscriber failed')
+
+        def stop():
+            with self._lock:
+                if q in self._queues:
+                    self._queues.remove(q)
+            q.put(None)
+
+        t = threading.Thread(target=run, name='cast-bus-subscriber', daemon=True)
+        t.start()
+        return Subscription(t, stop)
+
+
+class RedisCastBus:
+    """Publish/subscribe cast batches over a Redis pub/sub channel."""
+
+    def __init__(self, url, channel=DEFAULT_CHANNEL):
+        import redis
+        self.channel = channel
+        self._redis = redis.Redis.from_url(url)
+
+    def publish_many(self, casts):
+        """Publish a list of casts; returns the number of receiving workers."""
+        return self._redis.publish(self.channel, json.dumps(casts, default=str))
+
+    def subscribe(self, handler):
+        """Call `handler(casts)` for every message on the channel (own thread)."""
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        stopping = threading.Event()
+
+        def run():
+            while not stopping.is_set():
+                try:
+                    msg = pubsub.get_message(timeout=1.0)
+                except Exception:
+                    logger.exception('redis cast subscription failed')
+                    stopping.wait(1.0)
+                    continue
+                if not msg or msg.get('type') != 'message':
+                    continue
+                try:
+                    casts = json.loads(msg['data'])
+                    handler(casts if isinstance(casts, list) else [casts])
+                except Exception:
+                    logger.exception('cast subscriber failed')
+            pubsub.close()
+
+        t = threading.Thread(target=run, name='cast-bus-subscriber', daemon=True)
+        t.start()
+        return Subscription(t, stopping.set)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_cast_bus():
+    """Return the configured bus, or None when casts go straight to Socket.IO."""
+    global _bus
+    backend = getattr(settings, 'SAPI_CAST_BACKEND', 'socketio')
+    if backend == 'socketio':
+        return None
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                if backend == 'redis':
+                    url = getattr(settings, 'REDIS_URL', '') or 'redis://127.0.0.1:6379/0'
+                    _bus = RedisCastBus(url, getattr(settings, 'SAPI_CAST_CHANNEL', DEFAULT_CHANNEL))
+                elif backend == 'inprocess':
+                    _bus = InProcessCastBus()
+                else:
+                    raise ValueError(f'unknown SAPI_CAST_BACKEND: {backend}')
+    return _bus
@@ -0,0 +1,417 @@
+"""Elasticsearch client and buffered bulk indexing for the ingest path.
+
+`es_client()` returns one `Elasticsearch` client per process (it keeps its
+own connection pool), built from `ELASTICSEARCH_DSN`. `get_indexer()`
+returns the process-wide `BulkIndexer`: `index()` only queues the
+document, and a background thread sends the queue as one `_bulk` request
+every `ES_BULK_SIZE` documents or `ES_FLUSH_INTERVAL` seconds, instead of
+one HTTP round trip per fix.
+
+Failures:
+
+- documents rejected with 429/502/503/504, and whole requests that fail
+  (cluster down, timeouts), are retried up to `ES_MAX_RETRIES` times with
+  exponential backoff from `ES_RETRY_BACKOFF` seconds;
+- documents rejected for good (mapping errors, ...) are not retried;
+- what still fails is appended to `ES_DEAD_LETTER_FILE` (JSON lines of
+  index, document and error) and the cluster is treated as down for
+  `ES_DOWN_SECONDS`, during which batches go straight to the file so the
+  ingest path never waits on a dead cluster. `manage.py setup_elasticsearch
+  --replay` sends the file again.
+
+The templates from `index_templates()` (geo_point location, a slower
+refresh interval) are put once per process before the first bulk request.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    from elasticsearch import Elasticsearch
+    ES_AVAILABLE = True
+except Exception:
+    ES_AVAILABLE = False
+
+LOCATIONS_INDEX = 'veh_locations'
+STATUS_INDEX = 'veh_status'
+RETRY_STATUS = (429, 502, 503, 504)  # per-document statuses worth retrying
+
+FLUSH_SECONDS = metrics.histogram('es_flush_seconds', 'Time to send one bulk batch, retries included')
+QUEUE_DEPTH = metrics.gauge('es_queue_depth', 'Documents waiting for the bulk indexer')
+EVENTS = metrics.counter('es_events_total', 'Bulk indexer totals (BulkIndexer.stats)', ['event'])
+STAT_COUNTERS = ('enqueued', 'dropped', 'indexed', 'failed', 'dead_lettered', 'requests', 'request_errors')
+
+
+def index_templates(refresh_interval='30s', replicas=1):
+    """Composable index templates for the indices the ingest path writes."""
+    index_settings = {'refresh_interval': refresh_interval, 'number_of_replicas': replicas}
+    return {
+        LOCATIONS_INDEX: {
+            'index_patterns': [f'{LOCATIONS_INDEX}*'],
+            'template': {
+                'settings': index_settings,
+                'mappings': {
+                    'dynamic': False,
+                    'properties': {
+                        'veh_id': {'type': 'integer'},
+                        'imei': {'type': 'keyword'},
+                        'location': {'type': 'geo_point'},
+                        'lat': {'type': 'float', 'index': False},
+                        'lon': {'type': 'float', 'index': False},
+                        'speed': {'type': 'float'},
+                        'time': {'type': 'date'},
+                    },
+                },
+            },
+        },
+        STATUS_INDEX: {
+            'index_patterns': [f'{STATUS_INDEX}*'],
+            'template': {
+                'settings': index_settings,
+                'mappings': {
+                    'dynamic': False,
+                    'properties': {
+                        'veh_id': {'type': 'integer'},
+                        'imei': {'type': 'keyword'},
+                        'battery': {'type': 'float'},
+                        'ignition': {'type': 'boolean'},
+                        'gps': {'type': 'boolean'},
+                        'time': {'type': 'date'},
+                    },
+                },
+            },
+        },
+    }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def es_client():
+    """Return the process-wide client, or None when ES is not configured/installed."""
+    global _client
+    dsn = getattr(settings, 'ELASTICSEARCH_DSN', '')
+    if not dsn or not ES_AVAILABLE:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Elasticsearch(
+                    dsn,
+                    request_timeout=getattr(settings, 'ES_REQUEST_TIMEOUT', 10),
+                    # the indexer retries whole batches itself
+                    max_retries=0,
+                    retry_on_timeout=False,
+                )
+    return _client
+
+
+def put_templates(client):
+    """Create or update the index templates; returns their names."""
+    templates = index_templates(getattr(settings, 'ES_REFRESH_INTERVAL', '30s'),
+                                getattr(settings, 'ES_NUMBER_OF_REPLICAS', 1))
+    for name, body in templates.items():
+        client.indices.put_index_template(name=name, priority=100, **body)
+    return list(templates)
+
+
+class BulkIndexer:
+    """Bounded queue of (index, document) flushed with bulk requests by one thread."""
+
+    def __init__(self, client_factory=es_client, batch_size=500, flush_interval=2.0, max_pending=20000,
+                 max_retries=3, backoff=1.0, dead_letter_file='', dead_letter_max_bytes=256 * 1024 * 1024,
+                 down_seconds=30.0, install_templates=True):
+        self.client_factory = client_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dead_letter_file = dead_letter_file
+        self.dead_letter_max_bytes = dead_letter_max_bytes
+        self.down_seconds = down_seconds
+        self.install_templates = install_templates
+        self._templates_done = False
+        self._down_until = 0.0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._dead_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'indexed': 0,
+            'failed': 0,
+            'dead_lettered': 0,
+            'requests': 0,
+            'request_errors': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    @property
+    def enabled(self):
+        return self.client_factory() is not None
+
+    # -- producer side -------------------------------------------------
+
+    def index(self, index, doc):
+        """Queue `doc` for `index`; False if the queue is full and it was dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((index, doc))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] % 1000 == 1:
+                logger.warning('es queue full, dropped %d documents so far', self.stats['dropped'])
+            return False
+        self.stats['enqueued'] += 1
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    # -- flusher side --------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name='es-indexer', daemon=True)
+                t.start()
+                self._thread = t
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(self.flush_interval)
+            if batch:
+                try:
+                    self.send(batch)
+                except Exception:
+                    logger.exception('es flush failed')
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    def _drain(self, wait):
+        batch = []
+        deadline = time.monotonic() + wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """Synchronously send everything queued so far."""
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                break
+            try:
+                self.send(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def send(self, batch):
+        """Bulk index [(index, doc), ...]; returns the number of documents indexed."""
+        client = self.client_factory()
+        if client is None:
+            return 0
+        if time.monotonic() < self._down_until:
+            self.dead_letter(batch, 'cluster marked down')
+            return 0
+        started = time.perf_counter()
+        pending, indexed, error = batch, 0, None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(self.backoff * 2 ** (attempt - 1), 30))
+            try:
+                self._ensure_templates(client)
+                ok, pending = self._bulk(client, pending)
+            except Exception as e:
+                self.stats['request_errors'] += 1
+                logger.warning('es bulk request failed (attempt %d/%d): %s',
+                               attempt + 1, self.max_retries + 1, e)
+                error = str(e)
+                continue
+            indexed += ok
+            error = None
+            if not pending:
+                break
+        if pending:
+            if error is not None:
+                # the requests themselves failed: stop trying for a while
+                self._down_until = time.monotonic() + self.down_seconds
+            self.dead_letter(pending, error or 'retries exhausted')
+        elapsed = time.perf_counter() - started
+        self.stats['last_flush_ms'] = elapsed * 1000
+        FLUSH_SECONDS.observe(elapsed)
+        return indexed
+
+    def _bulk(self, client, batch):
+        """One bulk request; returns (indexed, [(index, doc), ...] to retry).
+
+        Documents rejected for good (mapping errors, ...) are dead-lettered.
+        """
+        operations = []
+        for index, doc in batch:
+            operations.append({'index': {'_index': index}})
+            operations.append(doc)
+        self.stats['requests'] += 1
+        resp = client.bulk(operations=operations)
+        if not resp.get('errors'):
+            self.stats['indexed'] += len(batch)
+            return len(batch), []
+        retry, rejected, errors = [], [], []
+        # bulk response items are in request order
+        for entry, item in zip(batch, resp['items']):
+            info = next(iter(item.values()))
+            status = info.get('status', 500)
+            if status in RETRY_STATUS:
+                retry.append(entry)
+            elif not 200 <= status < 300:
+                rejected.append(entry)
+                errors.append(json.dumps(info.get('error'), default=str))
+        indexed = len(batch) - len(retry) - len(rejected)
+        self.stats['indexed'] += indexed
+        if rejected:
+            self.stats['failed'] += len(rejected)
+            logger.warning('es rejected %d of %d documents', len(rejected), len(batch))
+            self.dead_letter(rejected, errors)
+        return indexed, retry
+
+    def _ensure_templates(self, client):
+        if self.install_templates and not self._templates_done:
+            put_templates(client)
+            self._templates_done = True
+
+    def dead_letter(self, batch, error):
+        """Append documents to the dead-letter file; `error` is one string or one per document."""
+        if not batch:
+            return
+        errors = error if isinstance(error, list) else [error] * len(batch)
+        if not self.dead_letter_file:
+            self.stats['dropped'] += len(batch)
+            return
+        lines = ''.join(json.dumps({'index': index, 'doc': doc, 'error': err}, default=str) + '\n'
+                        for (index, doc), err in zip(batch, errors))
+        with self._dead_lock:
+            try:
+                if os.path.getsize(self.dead_letter_file) + len(lines) > self.dead_letter_max_bytes:
+                    self.stats['dropped'] += len(batch)
+                    logger.error('es dead-letter file %s is full, dropped %d documents',
+                                 self.dead_letter_file, len(batch))
+                    return
+            except OSError:
+                pass  # not created yet
+            try:
+                os.makedirs(os.path.dirname(self.dead_letter_file) or '.', exist_ok=True)
+                with open(self.dead_letter_file, 'a', encoding='utf-8') as fh:
+                    fh.write(lines)
+            except OSError:
+                logger.exception('cannot write es dead-letter file %s', self.dead_letter_file)
+                self.stats['dropped'] += len(batch)
+                return
+        self.stats['dead_lettered'] += len(batch)
+
+    def replay(self, path=None):
+        """Send a dead-letter file again; returns (sent, still failing).
+
+        The file is renamed first, so documents failing again land in a new one.
+        """
+        path = path or self.dead_letter_file
+        replaying = f'{path}.replay'
+        with self._dead_lock:
+            os.replace(path, replaying)
+        self._down_until = 0.0
+        sent = failed = 0
+        batch = []
+        with open(replaying, encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                batch.append((entry['index'], entry['doc']))
+                if len(batch) >= self.batch_size:
+                    n = self.send(batch)
+                    sent, failed, batch = sent + n, failed + len(batch) - n, []
+        if batch:
+            n = self.send(batch)
+            sent, failed = sent + n, failed + len(batch) - n
+        os.remove(replaying)
+        return sent, failed
+
+
+_indexer = None
+_indexer_lock = threading.Lock()
+
+
+def get_indexer():
+    """Return the process-wide `BulkIndexer`, configured from settings."""
+    global _indexer
+    if _indexer is None:
+        with _indexer_lock:
+            if _indexer is None:
+                _indexer = BulkIndexer(
+                    batch_size=getattr(settings, 'ES_BULK_SIZE', 500),
+                    flush_interval=getattr(settings, 'ES_FLUSH_INTERVAL', 2.0),
+                    max_pending=getattr(settings, 'ES_MAX_PENDING', 20000),
+                    max_retries=getattr(settings, 'ES_MAX_RETRIES', 3),
+                    backoff=getattr(settings, 'ES_RETRY_BACKOFF', 1.0),
+                    dead_letter_file=getattr(settings, 'ES_DEAD_LETTER_FILE', ''),
+                    dead_letter_max_bytes=getattr(settings, 'ES_DEAD_LETTER_MAX_BYTES', 256 * 1024 * 1024),
+                    down_seconds=getattr(settings, 'ES_DOWN_SECONDS', 30.0),
+                    install_templates=getattr(settings, 'ES_INSTALL_TEMPLATES', True),
+                )
+                atexit.register(_indexer.stop)
+    return _indexer
+
+
+def index_document(index, doc):
+    """Ingest hook: queue `doc` when Elasticsearch is configured; never raises."""
+    if es_client() is None:
+        return False
+    try:
+        return get_indexer().index(index, doc)
+    except Exception:
+        logger.exception('es queue %s failed', index)
+        return False
+
+
+@metrics.collector
+def _collect_metrics():
+    indexer = _indexer
+    if indexer is not None:
+        QUEUE_DEPTH.set(indexer.pending())
+        metrics.export_stats(EVENTS, indexer.stats, STAT_COUNTERS)
@@ -0,0 +1,197 @@
+"""Append-only raw event log for the GT06 server.
+
+Every parsed packet is appended as one JSON line to the current segment
+file in `GT06_EVENT_LOG_DIR`. A single writer thread owns the files: it
+batches whatever is queued, writes it in one go and fsyncs at most every
+`GT06_EVENT_LOG_FSYNC_INTERVAL` seconds (group commit), so the cost per
+packet is constant. Segments rotate at `GT06_EVENT_LOG_SEGMENT_BYTES` and
+only the newest `GT06_EVENT_LOG_SEGMENTS` are kept.
+
+`EventRing` optionally mirrors the last N events into a fixed-size mmap'd
+file, which is what you want when looking at "what did this tracker just
+send" after a crash.
+"""
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class EventRing:
+    """Fixed-size ring of the last `slots` events in a memory-mapped file.
+
+    Layout: a 16-byte header (magic, slot size, slot count, next sequence
+    number) followed by `slots` records of `slot_size` bytes, each a 2-byte
+    length and the (possibly truncated) JSON line.
+    """
+
+    MAGIC = b'GTR1'
+    HEADER = struct.Struct('>4sHHQ')
+
+    def __init__(self, path, slots=1000, slot_size=512):
+        size = self.HEADER.size + slots * slot_size
+        fresh = not os.path.exists(path) or os.path.getsize(path) != size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fresh:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.slots = slots
+        self.slot_size = slot_size
+        magic, s_size, s_count, seq = self.HEADER.unpack_from(self._mm, 0)
+        if fresh or magic != self.MAGIC or (s_size, s_count) != (slot_size, slots):
+            seq = 0
+            self.HEADER.pack_into(self._mm, 0, self.MAGIC, slot_size, slots, seq)
+        self._seq = seq
+
+    @classmethod
+    def open_readonly(cls, path):
+        """Map an existing ring read-only, with the slot sizes from its header.
+
+        Raises FileNotFoundError if there is no ring at `path` and ValueError
+        if the file is not one; nothing is created or rewritten.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < cls.HEADER.size:
+                raise ValueError(f'{path} is not an event ring')
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slot_size, slots, seq = cls.HEADER.unpack_from(mm, 0)
+        if magic != cls.MAGIC or len(mm) != cls.HEADER.size + slots * slot_size:
+            mm.close()
+            raise ValueError(f'{path} is not an event ring')
+        ring = cls.__new__(cls)
+        ring._mm, ring.slots, ring.slot_size, ring._seq = mm, slots, slot_size, seq
+        return ring
+
+    def append(self, line):
+        line = line[:self.slot_size - 2]
+        pos = self.HEADER.size + (self._seq % self.slots) * self.slot_size
+        struct.pack_into('>H', self._mm, pos, len(line))
+        self._mm[pos + 2:pos + 2 + len(line)] = line
+        self._seq += 1
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.slot_size, self.slots, self._seq)
+
+    def last(self, n=None):
+        """Return up to `n` most recent events (oldest first) as raw JSON bytes."""
+        count = min(self._seq, self.slots, n or self.slots)
+        out = []
+        for seq in range(self._seq - count, self._seq):
+            pos = self.HEADER.size + (seq % self.slots) * self.slot_size
+            (length,) = struct.unpack_from('>H', self._mm, pos)
+            out.append(bytes(self._mm[pos + 2:pos + 2 + length]))
+        return out
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.close()
+
+
+class EventLog:
+    """Segment-rotated NDJSON log with a single writer thread and group commit."""
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, max_segments=20,
+                 fsync_interval=1.0, max_pending=100000, ring=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.fsync_interval = fsync_interval
+        self.ring = ring
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._file = None
+        self._size = 0
+        self._stopping = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='gt06-event-log', daemon=True)
+        self._thread.start()
+
+    def append(self, event):
+        """Queue `event` (a JSON-serialisable dict) without blocking."""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning('event log queue full, dropped %d events so far', self.dropped)
+
+    def _run(self):
+        last_sync = time.monotonic()
+        dirty = False
+        while not (self._stopping.is_set() and self._queue.empty()):
+            timeout = max(self.fsync_interval - (time.monotonic() - last_sync), 0.01)
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            try:
+                while len(batch) < 1000:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self._write(batch)
+                    dirty = True
+                except Exception:
+                    logger.exception('event log write failed')
+
+            if dirty and time.monotonic() - last_sync >= self.fsync_interval:
+                try:
+                    self._sync()
+                except Exception:
+                    logger.exception('event log fsync failed')
+                dirty = False
+                last_sync = time.monotonic()
+        self._sync()
+
+    def close(self):
+        """Write and fsync everything queued, then stop the writer thread."""
+        self._stopping.set()
+        self._thread.join(timeout=self.fsync_interval + 5)
+
+    def _write(self, batch):
+        lines = []
+        for event in batch:
+            line = json.dumps(event, default=str, separators=(',', ':')).encode()
+            lines.append(line)
+            if self.ring is not None:
+                self.ring.append(line)
+        data = b'\n'.join(lines) + b'\n'
+        if self._file is None or self._size + len(data) > self.segment_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def _sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if self.ring is not None:
+            self.ring.flush()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        name = datetime.now().strftime('events-%Y%m%d-%H%M%S-%f.ndjson')
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        self._size = 0
+        segments = sorted(f for f in os.listdir(self.directory)
+                          if f.startswith('events-') and f.endswith('.ndjson'))
+        for old in segments[:-self.max_segments]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                logger.exception('could not remove old event segment %s', old)
@@ -0,0 +1,88 @@
+"""Uniform-grid spatial index for lat/lon bounding boxes.
+
+Boxes are registered in every grid cell they overlap, so a point query only
+looks at the handful of boxes in the point's cell instead of all of them.
+Boxes larger than `max_cells` cells are kept on a short side list that is
+checked linearly (a country-wide viewport should not fill thousands of
+cells).
+
+Used for viewport subscriptions in the Socket.IO bridge.
+"""
+import math
+import threading
+
+
+class GridIndex:
+    """Map keys to (min_lat, min_lon, max_lat, max_lon) boxes on a fixed grid."""
+
+    def __init__(self, cell_deg=0.1, max_cells=4096):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+        self._cells = {}   # (row, col) -> set of keys
+        self._boxes = {}   # key -> bbox
+        self._large = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _cells_for(self, bbox):
+        r0, c0 = self._cell(bbox[0], bbox[1])
+        r1, c1 = self._cell(bbox[2], bbox[3])
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > self.max_cells:
+            return None
+        return [(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+    def insert(self, key, bbox):
+        """Add (or move) `key` with the box `bbox`."""
+        bbox = normalize_bbox(bbox)
+        with self._lock:
+            self._remove(key)
+            self._boxes[key] = bbox
+            cells = self._cells_for(bbox)
+            if cells is None:
+                self._large.add(key)
+                return
+            for cell in cells:
+                self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        bbox = self._boxes.pop(key, None)
+        if bbox is None:
+            return
+        if key in self._large:
+            self._large.discard(key)
+            return
+        for cell in self._cells_for(bbox):
+            keys = self._cells.get(cell)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._cells[cell]
+
+    def query_point(self, lat, lon):
+        """Return the keys whose box contains (lat, lon)."""
+        with self._lock:
+            candidates = set(self._cells.get(self._cell(lat, lon), ()))
+            candidates.update(self._large)
+            return {k for k in candidates if _contains(self._boxes[k], lat, lon)}
+
+    def get(self, key):
+        return self._boxes.get(key)
+
+
+def normalize_bbox(bbox):
+    """Return `bbox` as floats ordered (min_lat, min_lon, max_lat, max_lon)."""
+    a, b, c, d = (float(x) for x in bbox)
+    return min(a, c), min(b, d), max(a, c), max(b, d)
+
+
+def _contains(bbox, lat, lon):
+    return bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]
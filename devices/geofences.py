@@ -0,0 +1,277 @@
+"""Geofence enter/exit detection on the ingest path.
+
+`GeofenceEngine` keeps every active `Geofence` in memory: its bounding box
+in a `GridIndex` (see `geo_index`) and a prepared circle/polygon test. A
+fix is only tested against the fences whose box covers the fix's grid
+cell, so the cost per fix depends on how many fences overlap that spot,
+not on how many fences exist.
+
+Per vehicle the engine remembers which fences it is inside. `process()`
+turns a change into 'enter'/'exit' events, publishes each as a `geofence`
+cast and queues a `GeofenceEvent` row on the ingest writer.
+
+The first time a vehicle is seen in this process its state is seeded from
+its latest stored events, so a restart does not repeat enters. Fences
+saved or deleted in this process are applied at once (`post_save` /
+`post_delete`); other processes poll for changes every
+`GEOFENCE_REFRESH_INTERVAL` seconds.
+"""
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from vehicles.models import Geofence, GeofenceEvent
+from .geo_index import GridIndex
+from .ingest_writer import get_writer
+from .sapi_broadcaster import publish_cast
+
+logger = logging.getLogger(__name__)
+
+EARTH_M_PER_DEG = 111320.0
+SEED_EVENTS = 1000  # latest stored events read to seed a vehicle's state
+
+Fence = namedtuple('Fence', 'id client_id name contains')
+
+
+def circle_test(lat0, lon0, radius_m):
+    """(contains(lat, lon), bbox) for a circle; equirectangular distance around the centre."""
+    kx = EARTH_M_PER_DEG * math.cos(math.radians(lat0))
+    r2 = radius_m * radius_m
+    dlat = radius_m / EARTH_M_PER_DEG
+    dlon = radius_m / kx if kx > 1e-6 else 180.0
+
+    def contains(lat, lon):
+        dy = (lat - lat0) * EARTH_M_PER_DEG
+        dx = (lon - lon0) * kx
+        return dx * dx + dy * dy <= r2
+
+    return contains, (lat0 - dlat, lon0 - dlon, lat0 + dlat, lon0 + dlon)
+
+
+def polygon_test(points):
+    """(contains(lat, lon), bbox) for a polygon given as [(lat, lon), ...] (ray casting)."""
+    ys = [float(p[0]) for p in points]
+    xs = [float(p[1]) for p in points]
+    edges = list(zip(ys, xs, ys[-1:] + ys[:-1], xs[-1:] + xs[:-1]))
+
+    def contains(lat, lon):
+        inside = False
+        for y1, x1, y2, x2 in edges:
+            if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                inside = not inside
+        return inside
+
+    return contains, (min(ys), min(xs), max(ys), max(xs))
+
+
+def prepare(fence):
+    """`Fence` and its bbox for a `Geofence` instance, or (None, None) if its shape is unusable."""
+    try:
+        if fence.kind == Geofence.Kind.POLYGON:
+            if len(fence.points or ()) < 3:
+                return None, None
+            contains, bbox = polygon_test(fence.points)
+        else:
+            if fence.center_lat is None or fence.center_lon is None or not fence.radius_m:
+                return None, None
+            contains, bbox = circle_test(float(fence.center_lat), float(fence.center_lon),
+                                         float(fence.radius_m))
+    except (TypeError, ValueError, IndexError):
+        return None, None
+    return Fence(fence.pk, fence.client_id, fence.name, contains), bbox
+
+
+class GeofenceEngine:
+    """In-memory fence index plus per-vehicle inside state."""
+
+    def __init__(self, cell_deg=0.05, max_cells=4096, refresh_interval=60, seed_state=True):
+        self.index = GridIndex(cell_deg=cell_deg, max_cells=max_cells)
+        self.refresh_interval = refresh_interval
+        self.seed_state = seed_state
+        self._fences = {}  # fence id -> Fence
+        self._inside = {}  # veh_id -> frozenset of fence ids
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded = False
+        self._refreshed_at = None
+        self._next_refresh = 0.0
+        self.stats = {'checks': 0, 'candidates': 0, 'events': 0, 'refreshes': 0}
+
+    def __len__(self):
+        return len(self._fences)
+
+    # -- fences --------------------------------------------------------
+
+    def set_fence(self, fence):
+        """Add or replace a `Geofence`; inactive or malformed fences are removed."""
+        prepared, bbox = prepare(fence) if fence.active else (None, None)
+        if prepared is None:
+            self.remove_fence(fence.pk)
+            return
+        with self._lock:
+            self._fences[prepared.id] = prepared
+        self.index.insert(prepared.id, bbox)
+
+    def remove_fence(self, fence_id):
+        """Forget a fence; vehicles inside it get no exit event."""
+        with self._lock:
+            self._fences.pop(fence_id, None)
+        self.index.remove(fence_id)
+
+    def load(self):
+        """Replace all fences with the active ones in the table."""
+        started = timezone.now()
+        fences = list(Geofence.objects.filter(active=True))
+        for fence_id in list(self._fences):
+            self.remove_fence(fence_id)
+        for fence in fences:
+            self.set_fence(fence)
+        self._loaded = True
+        self._refreshed_at = started
+        logger.info('geofences loaded: %d', len(self._fences))
+        return len(self._fences)
+
+    def refresh(self):
+        """Apply fences changed since the last load/refresh; drop deleted ones."""
+        if not self._loaded:
+            return self.load()
+        started = timezone.now()
+        active = set(Geofence.objects.filter(active=True).values_list('id', flat=True))
+        for fence_id in set(self._fences) - active:
+            self.remove_fence(fence_id)
+        # the overlap absorbs clock skew between app servers; re-applying is harmless
+        since = self._refreshed_at - timedelta(seconds=self.refresh_interval or 60)
+        missing = active - set(self._fences)
+        for fence in Geofence.objects.filter(Q(updated_at__gte=since) | Q(id__in=missing)):
+            self.set_fence(fence)
+        self._refreshed_at = started
+        self.stats['refreshes'] += 1
+        return len(self._fences)
+
+    def _maybe_refresh(self):
+        # None: fences are only fed through set_fence(); 0: load once, never poll
+        if self.refresh_interval is None or (not self.refresh_interval and self._loaded):
+            return
+        now = time.monotonic()
+        if now < self._next_refresh or not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_refresh = now + (self.refresh_interval or 60)
+            self.refresh()
+        except Exception:
+            logger.exception('geofence refresh failed')
+        finally:
+            self._refresh_lock.release()
+
+    # -- fixes ---------------------------------------------------------
+
+    def match(self, client_id, lat, lon):
+        """Ids of the fences of `client_id` (and the shared ones) containing (lat, lon)."""
+        candidates = self.index.query_point(lat, lon)
+        self.stats['candidates'] += len(candidates)
+        fences = self._fences
+        inside = set()
+        for fence_id in candidates:
+            f = fences.get(fence_id)
+            if f is not None and (f.client_id is None or f.client_id == client_id) and f.contains(lat, lon):
+                inside.add(fence_id)
+        return inside
+
+    def check(self, veh_id, client_id, lat, lon):
+        """Update `veh_id`'s state with a fix; returns (entered, exited) lists of `Fence`."""
+        self._maybe_refresh()
+        self.stats['checks'] += 1
+        if not self._fences and veh_id not in self._inside:
+            return [], []
+        prev = self._inside.get(veh_id)
+        if prev is None:
+            prev = self._seed(veh_id)
+        inside = self.match(client_id, lat, lon)
+        fences = self._fences
+        entered = [fences[i] for i in inside - prev if i in fences]
+        exited = [fences[i] for i in prev - inside if i in fences]
+        self._inside[veh_id] = frozenset(inside)
+        return entered, exited
+
+    def _seed(self, veh_id):
+        if not self.seed_state:
+            return frozenset()
+        latest = {}
+        try:
+            rows = (GeofenceEvent.objects.filter(vehicle_id=veh_id)
+                    .order_by('-time', '-id')
+                    .values_list('geofence_id', 'event')[:SEED_EVENTS])
+            for fence_id, event in rows:
+                latest.setdefault(fence_id, event)
+        except Exception:
+            logger.exception('seeding geofence state for vehicle %s failed', veh_id)
+        return frozenset(i for i, ev in latest.items() if ev == GeofenceEvent.Event.ENTER)
+
+    def process(self, veh_id, client_id, lat, lon, fix_time=None, imei=None):
+        """Check a fix, then publish and queue any enter/exit events; returns them as dicts."""
+        lat, lon = float(lat), float(lon)
+        entered, exited = self.check(veh_id, client_id, lat, lon)
+        if not entered and not exited:
+            return []
+        store = getattr(settings, 'GEOFENCE_STORE_EVENTS', True)
+        events = []
+        for event, fences in ((GeofenceEvent.Event.EXIT, exited), (GeofenceEvent.Event.ENTER, entered)):
+            for f in fences:
+                data = {'event': str(event), 'geofence': f.id, 'name': f.name, 'lat': lat, 'lon': lon,
+                        'time': fix_time.isoformat() if fix_time else None}
+                events.append(data)
+                try:
+                    publish_cast({'type': 'geofence', 'imei': imei, 'data': data,
+                                  'vehicle': veh_id, 'client': client_id})
+                except Exception:
+                    logger.exception('publish geofence cast failed')
+                if store:
+                    get_writer().add(GeofenceEvent(vehicle_id=veh_id, geofence_id=f.id, event=event,
+                                                   lat=lat, lon=lon, time=fix_time))
+        self.stats['events'] += len(events)
+        return events
+
+    def forget(self, veh_id=None):
+        """Drop the inside state of one vehicle (or all); it is re-seeded on the next fix."""
+        if veh_id is None:
+            self._inside.clear()
+        else:
+            self._inside.pop(veh_id, None)
+
+
+geofences = GeofenceEngine(
+    cell_deg=getattr(settings, 'GEOFENCE_CELL_DEG', 0.05),
+    refresh_interval=getattr(settings, 'GEOFENCE_REFRESH_INTERVAL', 60),
+)
+
+
+def check_fix(veh, lat, lon, fix_time=None):
+    """Ingest hook: run a vehicle's fix through the engine when geofencing is on."""
+    if not getattr(settings, 'GEOFENCE_ENABLED', True) or veh is None or lat is None or lon is None:
+        return []
+    try:
+        return geofences.process(veh.veh_id, veh.client_id_id, lat, lon, fix_time, imei=veh.imei)
+    except Exception:
+        logger.exception('geofence check failed for vehicle %s', veh.veh_id)
+        return []
+
+
+@receiver(post_save, sender=Geofence, dispatch_uid='geofences_saved')
+def _fence_saved(sender, instance, **kwargs):
+    if geofences._loaded:
+        geofences.set_fence(instance)
+
+
+@receiver(post_delete, sender=Geofence, dispatch_uid='geofences_deleted')
+def _fence_deleted(sender, instance, **kwargs):
+    if geofences._loaded:
+        geofences.remove_fence(instance.pk)
@@ -0,0 +1,174 @@
+"""Process-local IMEI -> (vehicle, device) resolution cache.
+
+Every ingest message needs to know which vehicle an IMEI belongs to. This
+keeps the answer in an LRU with a TTL (`IMEI_CACHE_TTL`), including negative
+entries for unknown IMEIs (`IMEI_CACHE_NEGATIVE_TTL`), so steady-state
+ingest does no lookup queries.
+
+Entries are dropped on `post_save`/`post_delete` of `Device` and `Vehicle`
+in this process; other processes pick up changes when the TTL expires.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from vehicles.models import Vehicle
+from . import metrics
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+CACHE_EVENTS = metrics.counter('cache_events_total', 'Lookup cache hits, misses and evictions', ['cache', 'event'])
+CACHE_ENTRIES = metrics.gauge('cache_entries', 'Entries held by a lookup cache', ['cache'])
+
+# `vehicle` is the instance loaded when the entry was resolved; ingest code
+# updates it in memory as fixes arrive.
+CacheEntry = namedtuple('CacheEntry', 'veh_id device_id vehicle')
+
+
+class ImeiCache:
+    """Thread-safe LRU of IMEI -> `CacheEntry` (or None for unknown IMEIs)."""
+
+    def __init__(self, maxsize=20000, ttl=300, negative_ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()  # imei -> (expires_at, entry or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def lookup(self, imei):
+        """Return the `CacheEntry` for `imei`, or None if no device/vehicle has it."""
+        if not imei:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            cached = self._data.get(imei)
+            if cached is not None and cached[0] > now:
+                self._data.move_to_end(imei)
+                self.hits += 1
+                if cached[1] is None:
+                    self.negative_hits += 1
+                return cached[1]
+            self.misses += 1
+
+        entry = self._load(imei)
+        self._store(imei, entry)
+        return entry
+
+    def lookup_many(self, imeis):
+        """Resolve several IMEIs; cache misses cost two queries in total.
+
+        Returns {imei: CacheEntry or None}.
+        """
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for imei in set(filter(None, imeis)):
+                cached = self._data.get(imei)
+                if cached is not None and cached[0] > now:
+                    self._data.move_to_end(imei)
+                    self.hits += 1
+                    if cached[1] is None:
+                        self.negative_hits += 1
+                    found[imei] = cached[1]
+                else:
+                    self.misses += 1
+                    missing.append(imei)
+
+        if missing:
+            devices = {}
+            for dev in Device.objects.filter(imei__in=missing).select_related('veh').order_by('device_id'):
+                devices.setdefault(dev.imei, dev)
+            vehicles = {v.imei: v for v in Vehicle.objects.filter(imei__in=missing)}
+            for imei in missing:
+                dev = devices.get(imei)
+                veh = dev.veh if dev and dev.veh else vehicles.get(imei)
+                entry = None
+                if dev or veh:
+                    entry = CacheEntry(veh_id=veh.veh_id if veh else None,
+                                       device_id=dev.device_id if dev else None,
+                                       vehicle=veh)
+                self._store(imei, entry)
+                found[imei] = entry
+        return found
+
+    def _load(self, imei):
+        dev = Device.objects.filter(imei=imei).select_related('veh').first()
+        veh = dev.veh if dev and dev.veh else Vehicle.objects.filter(imei=imei).first()
+        if not dev and not veh:
+            return None
+        return CacheEntry(
+            veh_id=veh.veh_id if veh else None,
+            device_id=dev.device_id if dev else None,
+            vehicle=veh,
+        )
+
+    def _store(self, imei, entry):
+        ttl = self.ttl if entry is not None else self.negative_ttl
+        with self._lock:
+            self._data[imei] = (time.monotonic() + ttl, entry)
+            self._data.move_to_end(imei)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, imei=None, veh_id=None, device_id=None):
+        """Drop the entry for `imei` and any entry pointing at `veh_id`/`device_id`."""
+        with self._lock:
+            if imei:
+                self._data.pop(imei, None)
+            if veh_id is None and device_id is None:
+                return
+            stale = [k for k, (_, e) in self._data.items()
+                     if e is not None and ((veh_id is not None and e.veh_id == veh_id)
+                                           or (device_id is not None and e.device_id == device_id))]
+            for k in stale:
+                del self._data[k]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+imei_cache = ImeiCache(
+    maxsize=getattr(settings, 'IMEI_CACHE_SIZE', 20000),
+    ttl=getattr(settings, 'IMEI_CACHE_TTL', 300),
+    negative_ttl=getattr(settings, 'IMEI_CACHE_NEGATIVE_TTL', 60),
+)
+
+
+@receiver([post_save, post_delete], sender=Device, dispatch_uid='imei_cache_device')
+def _device_changed(sender, instance, **kwargs):
+    imei_cache.invalidate(instance.imei, device_id=instance.device_id, veh_id=instance.veh_id)
+
+
+@receiver([post_save, post_delete], sender=Vehicle, dispatch_uid='imei_cache_vehicle')
+def _vehicle_changed(sender, instance, **kwargs):
+    imei_cache.invalidate(instance.imei, veh_id=instance.veh_id)
+
+
+@metrics.collector
+def _collect_metrics():
+    CACHE_ENTRIES.labels('imei').set(len(imei_cache._data))
+    for event in ('hits', 'misses', 'negative_hits', 'evictions'):
+        CACHE_EVENTS.labels('imei', event).set(getattr(imei_cache, event))
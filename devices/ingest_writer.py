@@ -0,0 +1,436 @@
+"""Write-behind persistence shared by the GT06 server and the SAPI handlers.
+
+Ingest paths hand fixes to `get_writer()` instead of doing their own ORM
+round trips. A background thread drains a bounded queue and flushes it
+every `INGEST_BATCH_SIZE` items or `INGEST_FLUSH_INTERVAL` seconds:
+
+- history rows go out in one `bulk_create` (or a COPY on PostgreSQL with
+  psycopg 3 when `INGEST_USE_COPY` is set) and/or to the columnar store
+  (`vehicles.history_store`, see `HISTORY_BACKEND`), and the newest fix per vehicle
+  is upserted into `VehicleLatestPosition` and its mirror
+  (`vehicles.latest_positions`);
+- latest-position updates are coalesced per vehicle and written with one
+  `bulk_update` per distinct field set;
+- any other unsaved model instance passed to `add()` is bulk created.
+
+Each flush is one transaction; the columnar store and the mirror are
+only written after it commits, so retrying a failed flush never stores a
+fix twice. A batch that still fails is written half by half, so only the
+rows that cannot be written are dropped.
+
+Request handlers that receive many fixes at once collect them in a
+`WriteBatch` and queue them with one `add_locations()` / `update_vehicles()`
+call each instead of one item per fix.
+
+When the database is slow the queue fills up, producers block for at most
+`INGEST_PUT_TIMEOUT` seconds and then the item is dropped and counted, so
+memory stays bounded. Set `INGEST_WRITE_BEHIND = False` to write
+synchronously instead (handy in a shell or when debugging).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from vehicles import history_store
+from vehicles.latest_positions import latest_positions, is_newer
+from vehicles.models import Vehicle, VehicleLatestPosition, VehicleLocation
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_LOC, _VEH, _OBJ, _LOCS, _VEHS = 0, 1, 2, 3, 4
+
+FLUSH_SECONDS = metrics.histogram('ingest_flush_seconds', 'Time to write one ingest batch')
+QUEUE_DEPTH = metrics.gauge('ingest_queue_depth', 'Items waiting in the ingest write-behind queue')
+EVENTS = metrics.counter('ingest_events_total', 'Ingest writer totals (IngestWriter.stats)', ['event'])
+STAT_COUNTERS = ('enqueued', 'dropped', 'locations_written', 'positions_upserted', 'vehicles_updated',
+                 'objects_written', 'flushes', 'flush_errors')
+
+
+class IngestWriter:
+    """Bounded write-behind queue with a single flusher thread."""
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_pending=50000,
+                 put_timeout=0.5, use_copy=False, enabled=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.use_copy = use_copy
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'locations_written': 0,
+            'positions_upserted': 0,
+            'vehicles_updated': 0,
+            'objects_written': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    # -- producer side -------------------------------------------------
+
+    def add_location(self, veh_id, lat, lon, speed=0, sat=0, time=None):
+        """Queue one `VehicleLocation` row."""
+        return self._put((_LOC, (veh_id, lat, lon, speed or 0, sat or 0, time)))
+
+    def update_vehicle(self, veh_id, **fields):
+        """Queue a partial `Vehicle` update; later updates win within a flush."""
+        if not fields:
+            return True
+        return self._put((_VEH, (veh_id, fields)))
+
+    def add(self, obj):
+        """Queue an unsaved model instance to be bulk created."""
+        return self._put((_OBJ, obj))
+
+    def add_locations(self, rows):
+        """Queue (veh_id, lat, lon, speed, sat, time) rows, `batch_size` rows per queue item."""
+        rows = [(v, lat, lon, speed or 0, sat or 0, t) for v, lat, lon, speed, sat, t in rows]
+        ok = True
+        for i in range(0, len(rows), self.batch_size):
+            ok = self._put((_LOCS, rows[i:i + self.batch_size])) and ok
+        return ok
+
+    def update_vehicles(self, updates):
+        """Queue {veh_id: fields} partial `Vehicle` updates as one item."""
+        updates = {veh_id: fields for veh_id, fields in updates.items() if fields}
+        if not updates:
+            return True
+        return self._put((_VEHS, updates))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _put(self, item):
+        if not self.enabled:
+            self._write([item])
+            return True
+        self._ensure_started()
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            dropped = self.stats['dropped']
+            self.stats['dropped'] += _size(item)
+            if dropped // 1000 != self.stats['dropped'] // 1000 or not dropped:
+                logger.warning('ingest queue full, dropped %d items so far', self.stats['dropped'])
+            return False
+        self.stats['enqueued'] += _size(item)
+        return True
+
+    # -- flusher side --------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                t.start()
+                self._thread = t
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(self.flush_interval)
+            if batch:
+                self._write_with_retry(batch)
+                self._done(batch)
+
+    def _drain(self, wait):
+        """Collect up to `batch_size` rows, waiting at most `wait` seconds."""
+        batch = []
+        size = 0
+        deadline = time.monotonic() + wait
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += _size(item)
+        return batch
+
+    def _done(self, batch):
+        for _ in batch:
+            self._queue.task_done()
+
+    def flush(self):
+        """Synchronously write everything queued so far.
+
+        Also waits for the batch the flusher thread may be holding.
+        """
+        while True:
+            batch = []
+            size = 0
+            try:
+                while size < self.batch_size:
+                    item = self._queue.get_nowait()
+                    batch.append(item)
+                    size += _size(item)
+            except queue.Empty:
+                pass
+            if not batch:
+                break
+            self._write_with_retry(batch)
+            self._done(batch)
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _write_with_retry(self, batch, attempts=3):
+        for attempt in range(attempts):
+            try:
+                self._write(batch)
+                return True
+            except Exception:
+                self.stats['flush_errors'] += 1
+                logger.exception('ingest flush failed (attempt %d/%d)', attempt + 1, attempts)
+                close_old_connections()
+                time.sleep(min(2 ** attempt, 5))
+        # a bad row should not cost the rest of the batch its place
+        dropped = self._write_halves(batch)
+        if dropped:
+            logger.error('dropping %d ingest items after %d failed flushes', dropped, attempts)
+            self.stats['dropped'] += dropped
+        return not dropped
+
+    def _write_halves(self, batch):
+        """Write a failing batch half by half, down to single rows; returns the rows dropped."""
+        halves = _halves(batch)
+        if halves is None:
+            return sum(_size(item) for item in batch)
+        dropped = 0
+        for half in halves:
+            try:
+                self._write(half)
+            except Exception:
+                close_old_connections()
+                dropped += self._write_halves(half)
+        return dropped
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        locations = []
+        vehicles = {}
+        objects = defaultdict(list)
+        for kind, payload in batch:
+            if kind == _LOC:
+                locations.append(payload)
+            elif kind == _LOCS:
+                locations.extend(payload)
+            elif kind == _VEH:
+                veh_id, fields = payload
+                vehicles.setdefault(veh_id, {}).update(fields)
+            elif kind == _VEHS:
+                for veh_id, fields in payload.items():
+                    vehicles.setdefault(veh_id, {}).update(fields)
+            else:
+                objects[type(payload)].append(payload)
+
+        with self._flush_lock:
+            backend = history_store.backend()
+            # all or nothing, so a retry never inserts committed rows again
+            with transaction.atomic():
+                if locations:
+                    if backend != 'columnar':
+                        self._write_locations(locations)
+                    newest = self._write_latest(locations)
+                if vehicles:
+                    self._write_vehicles(vehicles)
+                for model, objs in objects.items():
+                    model.objects.bulk_create(objs, batch_size=self.batch_size)
+                    self.stats['objects_written'] += len(objs)
+            if locations:
+                latest_positions.update(newest.values())
+                if backend != 'db':
+                    self._append_history(locations)
+
+        elapsed = time.perf_counter() - started
+        self.stats['flushes'] += 1
+        self.stats['last_flush_ms'] = elapsed * 1000
+        FLUSH_SECONDS.observe(elapsed)
+
+    def _append_history(self, rows, attempts=3):
+        """Append to the columnar store after the commit; failures never retry the database writes."""
+        for attempt in range(attempts):
+            try:
+                history_store.get_store().append(rows)
+                if history_store.backend() == 'columnar':
+                    self.stats['locations_written'] += len(rows)
+                return
+            except Exception:
+                logger.exception('columnar history append failed (attempt %d/%d)', attempt + 1, attempts)
+        logger.error('dropping %d fixes from the columnar history store', len(rows))
+        self.stats['dropped'] += len(rows)
+
+    def _write_locations(self, rows):
+        if self.use_copy and connection.vendor == 'postgresql':
+            try:
+                # a savepoint, so a failed COPY does not abort the flush transaction
+                with transaction.atomic():
+                    self._copy_locations(rows)
+                self.stats['locations_written'] += len(rows)
+                return
+            except Exception:
+                logger.exception('COPY into %s failed, falling back to bulk_create',
+                                 VehicleLocation._meta.db_table)
+        VehicleLocation.objects.bulk_create(
+            [VehicleLocation(vehicle_id=v, lat=lat, lon=lon, speed=speed, sat=sat, time=t)
+             for v, lat, lon, speed, sat, t in rows],
+            batch_size=self.batch_size,
+        )
+        self.stats['locations_written'] += len(rows)
+
+    def _copy_locations(self, rows):
+        now = timezone.now()
+        sql = (f'COPY {connection.ops.quote_name(VehicleLocation._meta.db_table)} '
+               '(vehicle_id, lat, lon, speed, sat, time, created_at) FROM STDIN')
+        with connection.cursor() as cur:
+            # psycopg 3 cursors expose copy(); psycopg2 does not
+            with cur.cursor.copy(sql) as copy:
+                for v, lat, lon, speed, sat, t in rows:
+                    copy.write_row((v, lat, lon, speed, sat, t, now))
+
+    def _write_latest(self, rows):
+        """Upsert the newest fix of each vehicle (older fixes never win); returns them by vehicle."""
+        newest = {}
+        for row in rows:
+            cur = newest.get(row[0])
+            if cur is None or is_newer(row[5], cur[5]):
+                newest[row[0]] = row
+        qn = connection.ops.quote_name
+        table = qn(VehicleLatestPosition._meta.db_table)
+        # ON CONFLICT ... WHERE works on both PostgreSQL and SQLite
+        sql = (f'INSERT INTO {table} (vehicle_id, lat, lon, speed, sat, {qn("time")}, updated_at) '
+               f'VALUES (%s, %s, %s, %s, %s, %s, %s) '
+               f'ON CONFLICT (vehicle_id) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, '
+               f'speed = excluded.speed, sat = excluded.sat, {qn("time")} = excluded.{qn("time")}, '
+               f'updated_at = excluded.updated_at '
+               f'WHERE excluded.{qn("time")} IS NULL OR {table}.{qn("time")} IS NULL '
+               f'OR excluded.{qn("time")} >= {table}.{qn("time")}')
+        now = timezone.now()
+        with connection.cursor() as cur:
+            cur.executemany(sql, [(v, lat, lon, speed, sat, t, now)
+                                  for v, lat, lon, speed, sat, t in newest.values()])
+        self.stats['positions_upserted'] += len(newest)
+        return newest
+
+    def _write_vehicles(self, vehicles):
+        by_fields = defaultdict(list)
+        for veh_id, fields in vehicles.items():
+            by_fields[tuple(sorted(fields))].append(Vehicle(veh_id=veh_id, **fields))
+        for fields, objs in by_fields.items():
+            Vehicle.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+            self.stats['vehicles_updated'] += len(objs)
+
+
+def _size(item):
+    """Rows (or updates) carried by a queue item."""
+    kind, payload = item
+    return len(payload) if kind in (_LOCS, _VEHS) else 1
+
+
+def _halves(batch):
+    """Split a batch of queue items in two, splitting multi-row items too; None for a single row."""
+    if len(batch) > 1:
+        return batch[:len(batch) // 2], batch[len(batch) // 2:]
+    kind, payload = batch[0]
+    if kind == _LOCS and len(payload) > 1:
+        half = len(payload) // 2
+        return [(kind, payload[:half])], [(kind, payload[half:])]
+    if kind == _VEHS and len(payload) > 1:
+        items = list(payload.items())
+        half = len(items) // 2
+        return [(kind, dict(items[:half]))], [(kind, dict(items[half:]))]
+    return None
+
+
+class WriteBatch:
+    """Collects the writes of one request and hands them to the writer together.
+
+    Has the producer methods of `IngestWriter`, so ingest helpers can take
+    either. Vehicle updates are merged per vehicle; `commit()` queues the
+    fixes with one `add_locations()` and the updates with one
+    `update_vehicles()` call.
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.locations = []
+        self.vehicles = {}
+        self.objects = []
+
+    def add_location(self, veh_id, lat, lon, speed=0, sat=0, time=None):
+        self.locations.append((veh_id, lat, lon, speed, sat, time))
+        return True
+
+    def update_vehicle(self, veh_id, **fields):
+        if fields:
+            self.vehicles.setdefault(veh_id, {}).update(fields)
+        return True
+
+    def add(self, obj):
+        self.objects.append(obj)
+        return True
+
+    def commit(self):
+        """Queue everything collected so far; False if the writer dropped any of it."""
+        writer = self.writer or get_writer()
+        ok = writer.add_locations(self.locations)
+        ok = writer.update_vehicles(self.vehicles) and ok
+        for obj in self.objects:
+            ok = writer.add(obj) and ok
+        self.locations, self.vehicles, self.objects = [], {}, []
+        return ok
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide `IngestWriter`, configured from settings."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = IngestWriter(
+                    batch_size=getattr(settings, 'INGEST_BATCH_SIZE', 500),
+                    flush_interval=getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0),
+                    max_pending=getattr(settings, 'INGEST_MAX_PENDING', 50000),
+                    put_timeout=getattr(settings, 'INGEST_PUT_TIMEOUT', 0.5),
+                    use_copy=getattr(settings, 'INGEST_USE_COPY', False),
+                    enabled=getattr(settings, 'INGEST_WRITE_BEHIND', True),
+                )
+                atexit.register(_writer.stop)
+    return _writer
+
+
+@metrics.collector
+def _collect_metrics():
+    writer = _writer
+    if writer is not None:
+        QUEUE_DEPTH.set(writer.pending())
+        metrics.export_stats(EVENTS, writer.stats, STAT_COUNTERS)
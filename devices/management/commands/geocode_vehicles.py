@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from devices.reverse_geocoder import reverse_geocoder
+from vehicles.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = 'Fill geocode_txt/last_place of every vehicle from its latest position (offline geocoder)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='only vehicles without geocode_txt')
+
+    def handle(self, *args, **options):
+        if not reverse_geocoder.enabled:
+            raise CommandError('GEOCODER_PLACES_FILE is not set')
+        qs = Vehicle.objects.filter(latest_position__isnull=False)
+        if options['missing']:
+            qs = qs.filter(geocode_txt='')
+        now = timezone.now()
+        changed = []
+        for veh in qs.select_related('latest_position').only(
+                'veh_id', 'geocode', 'geocode_txt', 'geocode_time', 'last_place',
+                'latest_position__lat', 'latest_position__lon').iterator(chunk_size=2000):
+            pos = veh.latest_position
+            text = reverse_geocoder.lookup(pos.lat, pos.lon)
+            if text == veh.geocode_txt:
+                continue
+            veh.geocode, veh.geocode_txt, veh.geocode_time = bool(text), text, now
+            if text:
+                veh.last_place = text
+            changed.append(veh)
+        Vehicle.objects.bulk_update(changed, ['geocode', 'geocode_txt', 'geocode_time', 'last_place'],
+                                    batch_size=1000)
+        stats = reverse_geocoder.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(changed)} vehicles updated ({stats['lookups']} lookups, {stats['hits']} cache hits)"))
@@ -44,6 +44,7 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS(f'Starting Socket.IO bridge on {host}:{port}'))
         try:
+            fw.start_cast_subscription()
             # fw.socketio and fw.app are defined in scripts/flask_ws.py
             fw.socketio.run(fw.app, host=host, port=port)
         except KeyboardInterrupt:
@@ -0,0 +1,30 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.es_indexer import es_client, get_indexer, put_templates
+
+
+class Command(BaseCommand):
+    help = 'Put the veh_locations/veh_status index templates; optionally re-send the dead-letter file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replay', action='store_true', help='send ES_DEAD_LETTER_FILE again')
+        parser.add_argument('--file', default='', help='dead-letter file to replay instead')
+
+    def handle(self, *args, **options):
+        client = es_client()
+        if client is None:
+            raise CommandError('ELASTICSEARCH_DSN is not set or the elasticsearch package is missing')
+        names = put_templates(client)
+        self.stdout.write(self.style.SUCCESS(f"index templates put: {', '.join(names)}"))
+        if not options['replay']:
+            return
+        indexer = get_indexer()
+        path = options['file'] or indexer.dead_letter_file
+        if not path or not os.path.exists(path):
+            self.stdout.write('no dead-letter file to replay')
+            return
+        sent, failed = indexer.replay(path)
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f'{sent} documents re-sent, {failed} failed again'))
@@ -0,0 +1,315 @@
+"""Process-wide counters, gauges and histograms in the Prometheus text format.
+
+Hot paths update module-level metrics (an attribute increment and, for
+histograms, a bisect), and `render()` formats everything for a scrape:
+
+    FRAMES = metrics.counter('gt06_frames_total', 'GT06 frames received', ['protocol'])
+    FRAMES.labels('0x22').inc()
+
+Components that already keep a `stats` dict or a queue export them from a
+collector registered with `@metrics.collector`, which runs only at scrape
+time. Every process (GT06 server, each Django worker, each Socket.IO
+bridge) has its own registry and serves it on its own `/metrics`; Django
+through `devices.views.prometheus_metrics`, the others through `serve()`
+or a route of their own. With `METRICS_TOKEN` set, scrapes must send
+`Authorization: Bearer <token>`.
+
+Like the component `stats` dicts, updates take no lock: an increment racing
+with another thread can (rarely) be lost, which is fine for monitoring.
+
+`LogSampler` is for per-packet and per-connection log lines: one in
+`every` goes out at INFO, the rest only at DEBUG.
+"""
+import bisect
+import hmac
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'neotrack_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# seconds, from sub-millisecond packet handling up to slow database flushes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        # counters: only for mirroring a total kept elsewhere (see export_stats)
+        self.value = value
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('target', 'started')
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.started)
+
+
+class Metric:
+    """A named metric family; `labels(*values)` returns (and caches) one series."""
+
+    kind = None
+    value_class = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_value(self):
+        return self.value_class()
+
+    def labels(self, *values):
+        """The series for these label values (strings, in `labelnames` order)."""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {values}')
+            with self._lock:
+                series = self._series.setdefault(values, self._new_value())
+        return series
+
+    def samples(self):
+        """Yield (suffix, label values, extra label, value) for `render()`."""
+        for values, series in list(self._series.items()):
+            yield '', values, None, series.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+    value_class = _CounterValue
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    value_class = _GaugeValue
+
+    def set(self, value):
+        self._default.value = value
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def dec(self, amount=1):
+        self._default.value -= amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def samples(self):
+        for values, series in list(self._series.items()):
+            total = 0
+            for bound, count in zip(self.bounds + (math.inf,), series.counts):
+                total += count
+                yield '_bucket', values, ('le', _format_value(float(bound))), total
+            yield '_sum', values, None, series.sum
+            yield '_count', values, None, total
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add `metric`, or return the one already registered under its name."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'metric {metric.name} already registered differently')
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def collector(self, fn):
+        """Call `fn()` before every scrape (to refresh gauges from stats dicts or queues)."""
+        with self._lock:
+            if fn not in self._collectors:
+                self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        for fn in list(self._collectors):
+            try:
+                fn()
+            except Exception:
+                logger.exception('metrics collector %r failed', fn)
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for suffix, values, extra, value in metric.samples():
+                lines.append(f'{name}{suffix}{_format_labels(metric.labelnames, values, extra)} '
+                             f'{_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def collector(fn):
+    return REGISTRY.collector(fn)
+
+
+def render():
+    """All metrics of this process in the Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+def export_stats(metric, stats, keys=None):
+    """Copy a component's `stats` dict into `metric` (labelled by `key`)."""
+    for key in keys or stats:
+        metric.labels(key).set(stats.get(key, 0))
+
+
+def authorized(header):
+    """True when the Authorization header value satisfies METRICS_TOKEN (if any)."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        return True
+    return hmac.compare_digest((header or '').encode(), f'Bearer {token}'.encode())
+
+
+def serve(host='0.0.0.0', port=9108):
+    """Serve `/metrics` from a daemon thread (for processes without a web framework)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            if not authorized(self.headers.get('Authorization')):
+                self.send_error(401)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info('metrics on http://%s:%d/metrics', host, server.server_port)
+    return server
+
+
+class LogSampler:
+    """Log one in `every` messages at `level` and the rest at DEBUG.
+
+    `every` = 1 logs everything at `level`, 0 nothing (DEBUG still sees all).
+    """
+
+    def __init__(self, log, every, level=logging.INFO):
+        self.log = log
+        self.every = every
+        self.level = level
+        self.count = 0
+
+    def __call__(self, msg, *args):
+        self.count += 1
+        level = self.level if self.every and (self.count - 1) % self.every == 0 else logging.DEBUG
+        if self.log.isEnabledFor(level):
+            self.log.log(level, msg, *args)
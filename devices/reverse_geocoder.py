@@ -0,0 +1,231 @@
+"""Offline reverse geocoding for `Vehicle.geocode_txt` / `last_place`.
+
+Places are read once from a local file (`GEOCODER_PLACES_FILE`) into a
+point grid whose cells are `GEOCODER_MAX_DISTANCE_M` wide. The nearest
+place is found by searching the fix's cell and the cells around it, so
+the cost of a lookup does not grow with the size of the dataset. Supported
+files:
+
+- a GeoNames dump (``cities500.txt``, ``BD.txt``, ...; tab separated, no
+  header), used when the name ends in ``.txt``;
+- a CSV with a header containing ``name``, ``lat``, ``lon`` and optionally
+  ``area`` (district, city, ...).
+
+Lookups go through an LRU keyed by the coordinates rounded to
+`GEOCODER_CACHE_PRECISION` decimals, so vehicles parked in the same spot,
+or passing through it, share the answer. `refresh_place()` is the ingest
+hook: it re-geocodes a vehicle only after it has moved more than
+`GEOCODER_REFRESH_DISTANCE_M` from where it was last geocoded, and queues
+the vehicle columns on the ingest writer only when the text changes.
+"""
+import csv
+import logging
+import math
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .ingest_writer import get_writer
+
+logger = logging.getLogger(__name__)
+
+CACHE_EVENTS = metrics.counter('cache_events_total', 'Lookup cache hits, misses and evictions', ['cache', 'event'])
+CACHE_ENTRIES = metrics.gauge('cache_entries', 'Entries held by a lookup cache', ['cache'])
+
+EARTH_M_PER_DEG = 111320.0
+NEAR_M = 300  # closer than this the place name is used without a distance
+
+Place = namedtuple('Place', 'name area lat lon')
+_BEARINGS = ('N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW')
+
+
+def read_places(path):
+    """Yield `Place` tuples from a GeoNames dump or a name/lat/lon CSV."""
+    with open(path, encoding='utf-8', newline='') as fh:
+        if path.endswith('.txt'):
+            # geonameid, name, asciiname, alternatenames, latitude, longitude, ...
+            for row in csv.reader(fh, delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(row) < 6:
+                    continue
+                try:
+                    yield Place(row[2] or row[1], '', float(row[4]), float(row[5]))
+                except ValueError:
+                    continue
+        else:
+            for row in csv.DictReader(fh):
+                try:
+                    yield Place(row['name'], row.get('area') or '', float(row['lat']), float(row['lon']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+
+def describe(place, distance_m, bearing):
+    """Human-readable text such as 'Mirpur, Dhaka' or '2.1 km NE of Mirpur, Dhaka'."""
+    name = f'{place.name}, {place.area}' if place.area else place.name
+    if distance_m < NEAR_M:
+        return name
+    return f'{distance_m / 1000:.1f} km {_BEARINGS[round(bearing / 45) % 8]} of {name}'
+
+
+class PlaceIndex:
+    """Nearest-place search over a uniform grid of points."""
+
+    def __init__(self, places=(), max_distance_m=5000):
+        self.max_distance_m = max_distance_m
+        self.cell_deg = max_distance_m / EARTH_M_PER_DEG
+        self._cells = {}  # (row, col) -> list of Place
+        self.size = 0
+        for place in places:
+            self.add(place)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def add(self, place):
+        self._cells.setdefault(self._cell(place.lat, place.lon), []).append(place)
+        self.size += 1
+
+    def nearest(self, lat, lon):
+        """(place, distance_m, bearing_deg) of the closest place within `max_distance_m`, or None."""
+        row, col = self._cell(lat, lon)
+        kx = EARTH_M_PER_DEG * math.cos(math.radians(lat))
+        best, best_d2 = None, self.max_distance_m ** 2
+        # a cell is max_distance_m tall, so neighbours cover the radius in latitude;
+        # near the poles a degree of longitude shrinks and more columns are needed
+        span = max(1, math.ceil(EARTH_M_PER_DEG / max(kx, 1.0)))
+        for r in (row - 1, row, row + 1):
+            for c in range(col - span, col + span + 1):
+                for p in self._cells.get((r, c), ()):
+                    dy = (p.lat - lat) * EARTH_M_PER_DEG
+                    dx = (p.lon - lon) * kx
+                    d2 = dx * dx + dy * dy
+                    if d2 <= best_d2:
+                        best, best_d2 = (p, dx, dy), d2
+        if best is None:
+            return None
+        p, dx, dy = best
+        # bearing from the place to the fix
+        return p, math.sqrt(best_d2), math.degrees(math.atan2(-dx, -dy)) % 360
+
+
+class ReverseGeocoder:
+    """`PlaceIndex` behind a quantized-coordinate LRU, plus per-vehicle refresh state."""
+
+    def __init__(self, path='', max_distance_m=5000, cache_size=50000, precision=3,
+                 refresh_distance_m=250):
+        self.path = path
+        self.max_distance_m = max_distance_m
+        self.cache_size = cache_size
+        self.precision = precision
+        self.refresh_distance_m = refresh_distance_m
+        self._index = None
+        self._load_lock = threading.Lock()
+        self._cache = OrderedDict()  # (lat, lon) rounded -> text or ''
+        self._lock = threading.Lock()
+        self._last = {}  # veh_id -> (lat, lon, text) of the last geocode
+        self.stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'refreshes': 0, 'skipped': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.path) or self._index is not None
+
+    def index(self):
+        """The place index, loaded from `path` on first use."""
+        if self._index is None:
+            with self._load_lock:
+                if self._index is None:
+                    index = PlaceIndex(max_distance_m=self.max_distance_m)
+                    try:
+                        for place in read_places(self.path):
+                            index.add(place)
+                    except OSError:
+                        logger.exception('cannot read geocoder places from %s', self.path)
+                    logger.info('reverse geocoder loaded %d places from %s', index.size, self.path)
+                    self._index = index
+        return self._index
+
+    def set_index(self, index):
+        """Use an already built `PlaceIndex` (and drop cached answers)."""
+        self._index = index
+        with self._lock:
+            self._cache.clear()
+
+    def lookup(self, lat, lon):
+        """Place text for (lat, lon), or '' when nothing is within `max_distance_m`."""
+        key = (round(float(lat), self.precision), round(float(lon), self.precision))
+        with self._lock:
+            self.stats['lookups'] += 1
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return text
+            self.stats['misses'] += 1
+        # answer for the cell centre, so every fix in the cell gets the same text
+        found = self.index().nearest(*key)
+        text = describe(*found) if found else ''
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    def needs_refresh(self, veh_id, lat, lon):
+        last = self._last.get(veh_id)
+        if last is None:
+            return True
+        dy = (lat - last[0]) * EARTH_M_PER_DEG
+        dx = (lon - last[1]) * EARTH_M_PER_DEG * math.cos(math.radians(lat))
+        return dx * dx + dy * dy > self.refresh_distance_m ** 2
+
+    def refresh(self, veh, lat, lon):
+        """Geocode `veh` at (lat, lon) if it moved far enough; returns the new text or None."""
+        lat, lon = float(lat), float(lon)
+        if not self.needs_refresh(veh.veh_id, lat, lon):
+            self.stats['skipped'] += 1
+            return None
+        text = self.lookup(lat, lon)
+        last = self._last.get(veh.veh_id)
+        self._last[veh.veh_id] = (lat, lon, text)
+        if text == (last[2] if last else veh.geocode_txt):
+            return None
+        self.stats['refreshes'] += 1
+        now = timezone.now()
+        veh.geocode, veh.geocode_txt, veh.geocode_time = bool(text), text, now
+        if text:
+            veh.last_place = text
+        fields = {'geocode': veh.geocode, 'geocode_txt': text, 'geocode_time': now}
+        if text:
+            fields['last_place'] = text
+        get_writer().update_vehicle(veh.veh_id, **fields)
+        return text
+
+
+reverse_geocoder = ReverseGeocoder(
+    path=getattr(settings, 'GEOCODER_PLACES_FILE', ''),
+    max_distance_m=getattr(settings, 'GEOCODER_MAX_DISTANCE_M', 5000),
+    cache_size=getattr(settings, 'GEOCODER_CACHE_SIZE', 50000),
+    precision=getattr(settings, 'GEOCODER_CACHE_PRECISION', 3),
+    refresh_distance_m=getattr(settings, 'GEOCODER_REFRESH_DISTANCE_M', 250),
+)
+
+
+def refresh_place(veh, lat, lon):
+    """Ingest hook: keep a vehicle's place text current when a places file is configured."""
+    if veh is None or lat is None or lon is None or not reverse_geocoder.enabled:
+        return None
+    try:
+        return reverse_geocoder.refresh(veh, lat, lon)
+    except Exception:
+        logger.exception('reverse geocoding failed for vehicle %s', veh.veh_id)
+        return None
+
+
+@metrics.collector
+def _collect_metrics():
+    CACHE_ENTRIES.labels('geocoder').set(len(reverse_geocoder._cache))
+    for event in ('hits', 'misses', 'refreshes', 'skipped'):
+        CACHE_EVENTS.labels('geocoder', event).set(reverse_geocoder.stats[event])
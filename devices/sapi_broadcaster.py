@@ -1,45 +1,199 @@
-"""Publish `cast` objects to a Flask-SocketIO bridge.
+"""Publish `cast` objects to the Flask-SocketIO bridge.
 
 This project has been consolidated to use a Socket.IO bridge. The Django
-handler calls `publish_cast()` which will connect to the configured
-`SAPI_SOCKETIO_URL` (default: http://127.0.0.1:6791) and emit a `cast` event.
+handler calls `publish_cast()`, which only queues the cast; a background
+sender thread delivers queued casts in batches through the backend chosen
+by `SAPI_CAST_BACKEND`:
+
+- 'socketio' (default): one long-lived connection to `SAPI_SOCKETIO_URL`
+  (default: http://127.0.0.1:6791), reconnected when it drops; casts are
+  emitted as `cast_batch` events (or a plain `cast` when only one is waiting).
+- 'redis' / 'inprocess': published on the cast bus (see `cast_bus`), which
+  every bridge worker subscribes to.
+
+The outbound queue is bounded by `SAPI_CAST_QUEUE_SIZE`; when the backend is
+unreachable for long enough to fill it, new casts are dropped and counted.
+
+Casts are stamped with their publish time (`ts`, Unix seconds), so the
+time spent queued here and the end-to-end lag at the bridge can be
+measured (see `devices.metrics`).
 
 Requires `python-socketio` to be installed in the Django environment.
 """
+import abc
 import json
 import logging
+import queue
+import threading
+import time
 from django.conf import settings
+from . import metrics
+from .cast_bus import get_cast_bus
 
 logger = logging.getLogger(__name__)
 
+CAST_QUEUE_SECONDS = metrics.histogram('cast_queue_seconds', 'Time casts waited in the publisher queue')
+CAST_QUEUE_DEPTH = metrics.gauge('cast_queue_depth', 'Casts waiting in the publisher queue')
+CAST_EVENTS = metrics.counter('cast_events_total', 'Cast publisher totals (QueuedPublisher.stats)', ['event'])
 
-def _publish_socketio(msg: str) -> bool:
-    try:
-        import socketio
-        url = getattr(settings, 'SAPI_SOCKETIO_URL', '') or 'http://127.0.0.1:6791'
-        sio = socketio.Client()
-        # short-lived connect/emit/disconnect pattern keeps implementation simple
-        sio.connect(url, wait=True, transports=['websocket'])
-        sio.emit('cast', json.loads(msg))
-        sio.disconnect()
+
+class QueuedPublisher(abc.ABC):
+    """Bounded cast queue drained in batches by a sender thread.
+
+    Subclasses implement `_send(batch)`; a failing send is retried with
+    backoff while new casts keep queueing up to the bound.
+    """
+
+    def __init__(self, max_queue=10000, batch_size=200, batch_wait=0.02):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'dropped': 0, 'emitted': 0, 'batches': 0, 'reconnects': 0}
+
+    def publish(self, cast: dict) -> bool:
+        """Queue `cast` for sending; never blocks. Returns False if dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(cast)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] % 1000 == 1:
+                logger.warning('cast queue full, dropped %d casts so far', self.stats['dropped'])
+            return False
+        self.stats['queued'] += 1
         return True
-    except Exception:
-        logger.exception('socketio publish failed')
-        return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name='cast-publisher', daemon=True)
+                t.start()
+                self._thread = t
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        delay = 0.5
+        batch = None
+        while True:
+            if batch is None:
+                batch = self._next_batch()
+            try:
+                self._send(batch)
+                ts = batch[0].get('ts') if isinstance(batch[0], dict) else None
+                if ts:
+                    CAST_QUEUE_SECONDS.observe(max(time.time() - ts, 0))
+                self.stats['emitted'] += len(batch)
+                self.stats['batches'] += 1
+                batch = None
+                delay = 0.5
+            except Exception:
+                logger.exception('cast publish failed, retrying in %.1fs', delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    @abc.abstractmethod
+    def _send(self, batch):
+        """Deliver one batch of casts; raise to have it retried."""
+
+
+class SocketIOPublisher(QueuedPublisher):
+    """Long-lived Socket.IO client connection to the bridge."""
+
+    def __init__(self, url, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self._client = None
+
+    def _connect(self):
+        import socketio
+        if self._client is None:
+            # the sender loop reconnects (with backoff) when a send fails, so
+            # the client's own background reconnection stays off
+            self._client = socketio.Client(reconnection=False, handle_sigint=False)
+        if not self._client.connected:
+            self._client.connect(self.url, wait=True, transports=['websocket'])
+            self.stats['reconnects'] += 1
+        return self._client
+
+    def _send(self, batch):
+        client = self._connect()
+        # round-trip through JSON so Decimals/datetimes arrive as strings
+        payload = json.loads(json.dumps(batch, default=str))
+        if len(payload) == 1:
+            client.emit('cast', payload[0])
+        else:
+            client.emit('cast_batch', payload)
+
+
+class BusPublisher(QueuedPublisher):
+    """Publishes cast batches on a `cast_bus` (Redis or in-process)."""
+
+    def __init__(self, bus, **kwargs):
+        super().__init__(**kwargs)
+        self.bus = bus
+
+    def _send(self, batch):
+        self.bus.publish_many(batch)
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> QueuedPublisher:
+    """Return the process-wide publisher for the configured backend."""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                kwargs = {
+                    'max_queue': getattr(settings, 'SAPI_CAST_QUEUE_SIZE', 10000),
+                    'batch_size': getattr(settings, 'SAPI_CAST_BATCH_SIZE', 200),
+                }
+                bus = get_cast_bus()
+                if bus is not None:
+                    _publisher = BusPublisher(bus, **kwargs)
+                else:
+                    url = getattr(settings, 'SAPI_SOCKETIO_URL', '') or 'http://127.0.0.1:6791'
+                    _publisher = SocketIOPublisher(url, **kwargs)
+    return _publisher
 
 
 def publish_cast(cast: dict) -> bool:
-    """Publish the `cast` dict to the Socket.IO bridge.
+    """Queue the `cast` dict for the Socket.IO bridge(s).
 
-    Returns True if the publish succeeded.
+    Returns True if the cast was queued (it is sent asynchronously). The
+    queued cast is a copy stamped with `ts`; the caller's dict is not changed.
     """
-    try:
-        msg = json.dumps(cast, default=str)
-    except Exception:
-        logger.exception('failed to json encode cast')
-        return False
-
-    ok = _publish_socketio(msg)
+    cast = dict(cast)
+    cast.setdefault('ts', time.time())
+    ok = get_publisher().publish(cast)
     if not ok:
-        logger.debug('cast not published via Socket.IO')
+        logger.debug('cast not queued for Socket.IO')
     return ok
+
+
+@metrics.collector
+def _collect_metrics():
+    publisher = _publisher
+    if publisher is not None:
+        CAST_QUEUE_DEPTH.set(publisher.pending())
+        metrics.export_stats(CAST_EVENTS, publisher.stats)
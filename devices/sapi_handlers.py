@@ -1,10 +1,17 @@
 import logging
+import time
 from django.conf import settings
+from . import metrics
+from .imei_cache import imei_cache
+from .ingest_writer import WriteBatch
 from .sapi_helpers import vech_imei, writelocation, writestatus, getstatus
 from .sapi_broadcaster import publish_cast
 
 logger = logging.getLogger(__name__)
 
+SAPI_SECONDS = metrics.histogram('sapi_request_seconds', 'Time to handle one SAPI write request', ['api'])
+SAPI_ITEMS = metrics.counter('sapi_items_total', 'Device messages received over SAPI', ['api', 'result'])
+
 
 def handle_write(auth, ptype, data, request=None):
     """Main router for device writes. Returns array of per-item results similar to PHP script.
@@ -13,11 +20,9 @@ def handle_write(auth, ptype, data, request=None):
     - ptype: protocol type (e.g., 'gt06')
     - data: parsed JSON array of device messages
     """
-    # simple auth check
-    allowed = getattr(settings, 'SAPI_AUTH_KEYS', [])
-    if auth not in allowed:
-        raise Exception('unauthorized')
+    _check_auth(auth)
 
+    started = time.perf_counter()
     results = []
     if ptype.lower() == 'gt06':
         for d in data:
@@ -30,20 +35,148 @@ def handle_write(auth, ptype, data, request=None):
     else:
         raise Exception(f'unsupported protocol: {ptype}')
 
+    stored = sum(1 for r in results if r.get('ok'))
+    SAPI_ITEMS.labels('v1', 'stored').inc(stored)
+    SAPI_ITEMS.labels('v1', 'rejected').inc(len(results) - stored)
+    SAPI_SECONDS.labels('v1').observe(time.perf_counter() - started)
     return results
 
 
-def _handle_gt06_item(d):
+class AuthError(Exception):
+    """Missing (HTTP 401) or unknown (HTTP 403) SAPI auth key."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def _check_auth(auth):
+    # simple auth check
+    if not auth:
+        raise AuthError('missing auth', 401)
+    allowed = getattr(settings, 'SAPI_AUTH_KEYS', [])
+    if auth not in allowed:
+        raise AuthError('unauthorized', 403)
+
+
+MAX_REPORTED_ERRORS = 1000
+
+
+def handle_bulk_write(auth, ptype, items, chunk_size=1000):
+    """Router for the v2 bulk endpoint.
+
+    - items: iterable of message dicts (anything else counts as an invalid item),
+      consumed lazily so a streamed body is never held in memory as a whole
+
+    Items are processed in chunks whose IMEIs are resolved together. Each
+    chunk queues its fixes and its (per vehicle merged) vehicle updates on
+    the ingest writer at once, and publishes one cast per vehicle: its
+    latest location, or its latest status if it sent no fix. Returns a
+    compact summary instead of per-item casts: {'n': items seen, 'stored': items accepted,
+    'errors': [[index, message], ...]} (at most MAX_REPORTED_ERRORS errors).
+
+    If the body stops decoding partway (bad gzip, msgpack or NDJSON
+    stream), the items before it are still stored and the summary gets
+    'stopped_at': [index, message], so a client can resend from there.
+    """
+    _check_auth(auth)
+    if ptype.lower() != 'gt06':
+        raise Exception(f'unsupported protocol: {ptype}')
+
+    started = time.perf_counter()
+    summary = {'n': 0, 'stored': 0, 'errors': []}
+    chunk = []
+    items = iter(items)
+    while True:
+        try:
+            item = next(items)
+        except StopIteration:
+            break
+        except (ValueError, OSError, EOFError) as e:
+            # earlier chunks are already queued: say how far the body got
+            summary['stopped_at'] = [summary['n'] + len(chunk), str(e)]
+            break
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            _handle_gt06_chunk(chunk, summary)
+            chunk = []
+    if chunk:
+        _handle_gt06_chunk(chunk, summary)
+    SAPI_ITEMS.labels('v2', 'stored').inc(summary['stored'])
+    SAPI_ITEMS.labels('v2', 'rejected').inc(summary['n'] - summary['stored'])
+    SAPI_SECONDS.labels('v2').observe(time.perf_counter() - started)
+    return summary
+
+
+def _handle_gt06_chunk(chunk, summary):
+    def error(idx, msg):
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append([idx, msg])
+
+    entries = imei_cache.lookup_many(
+        d.get('imei') or d.get('deviceid') for d in chunk if isinstance(d, dict))
+    base = summary['n']
+    summary['n'] += len(chunk)
+    batch = WriteBatch()
+    casts = {}  # veh_id -> (vehicle, cast to publish)
+    for i, d in enumerate(chunk, base):
+        if not isinstance(d, dict):
+            error(i, 'invalid item')
+            continue
+        imei = d.get('imei') or d.get('deviceid')
+        if not imei:
+            error(i, 'missing imei')
+            continue
+        entry = entries.get(imei)
+        if not entry:
+            error(i, 'unknown imei')
+            continue
+        if entry.vehicle is None:
+            error(i, 'no vehicle for imei')
+            continue
+        try:
+            r = _handle_gt06_item(d, entry.vehicle, batch, publish=False)
+        except Exception as e:
+            logger.exception('gt06 item error')
+            r = {'ok': False, 'error': str(e)}
+        if not r.get('ok'):
+            error(i, r.get('error') or 'not stored')
+            continue
+        summary['stored'] += 1
+        cast = r['cast']
+        prev = casts.get(entry.veh_id)
+        if prev is None or cast['type'] == 'location' or prev[1]['type'] != 'location':
+            casts[entry.veh_id] = (entry.vehicle, cast)
+
+    batch.commit()
+    for veh, cast in casts.values():
+        # the vehicle has taken every message of the chunk by now
+        cast['status'] = getstatus(veh)
+        _publish(cast)
+
+
+def _publish(cast):
+    try:
+        publish_cast(cast)
+    except Exception:
+        logger.exception('publish cast failed')
+
+
+def _handle_gt06_item(d, veh=None, writer=None, publish=True):
     """Process a single GT06-style message dict.
 
     Expected fields (examples): imei, event ('location'|'status'), lat, lon, satCnt,
     fixTimestamp, speed, terminalInfo (for status)
+
+    `veh` is the vehicle if already resolved (otherwise looked up by IMEI),
+    writes go to `writer` (see `writelocation()`), and with `publish` False
+    the cast is only returned.
     """
     imei = d.get('imei') or d.get('deviceid')
     if not imei:
         return {'ok': False, 'error': 'missing imei'}
 
-    veh = vech_imei(imei)
+    veh = veh or vech_imei(imei)
 
     ev = d.get('event', '').lower()
     if ev == 'location' or 'lat' in d and 'lon' in d:
@@ -56,19 +189,18 @@ def _handle_gt06_item(d):
             'bearing': d.get('bearing'),
             'odometer': d.get('odometer')
         }
-        ok = writelocation(veh, mdata)
+        ok = writelocation(veh, mdata, writer)
         cast = {
             'type': 'location',
             'imei': imei,
             'data': mdata,
             'vehicle': veh.veh_id if veh else None,
+            'client': veh.client_id_id if veh else None,
             'status': getstatus(veh) if veh else 'unknown'
         }
         # publish cast to configured broadcaster (redis/http)
-        try:
-            publish_cast(cast)
-        except Exception:
-            logger.exception('publish cast failed')
+        if publish:
+            _publish(cast)
         return {'ok': ok, 'cast': cast}
 
     elif ev == 'status' or 'terminalInfo' in d or 'voltageLevel' in d:
@@ -80,18 +212,17 @@ def _handle_gt06_item(d):
             'gsm': d.get('gsmSigStrength') or d.get('slevel'),
             'charging': term.get('charging') if isinstance(term, dict) else d.get('charging')
         }
-        ok = writestatus(veh, mdata)
+        ok = writestatus(veh, mdata, writer)
         cast = {
             'type': 'status',
             'imei': imei,
             'data': mdata,
             'vehicle': veh.veh_id if veh else None,
+            'client': veh.client_id_id if veh else None,
             'status': getstatus(veh) if veh else 'unknown'
         }
-        try:
-            publish_cast(cast)
-        except Exception:
-            logger.exception('publish cast failed')
+        if publish:
+            _publish(cast)
         return {'ok': ok, 'cast': cast}
 
     else:
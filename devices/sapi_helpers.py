@@ -1,28 +1,28 @@
 from django.conf import settings
-from .models import Device
 from vehicles.models import Vehicle
 from django.utils import timezone
-from vehicles.models import VehicleLocation
+from datetime import timezone as dt_timezone
+from .alarms import check_location, check_status
+from .es_indexer import LOCATIONS_INDEX, STATUS_INDEX, es_client, index_document
+from .geofences import check_fix
+from .imei_cache import imei_cache
+from .reverse_geocoder import refresh_place
+from .ingest_writer import get_writer
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
-try:
-    from elasticsearch import Elasticsearch
-    ES_AVAILABLE = True
-except Exception:
-    ES_AVAILABLE = False
-
 
 def vech_imei(imei):
-    """Return Vehicle instance for an IMEI (or None)."""
+    """Return Vehicle instance for an IMEI (or None).
+
+    Resolved through the process-local IMEI cache; the device's vehicle wins
+    over a vehicle with the same imei.
+    """
     try:
-        dev = Device.objects.filter(imei=imei).select_related('veh').first()
-        if dev and dev.veh:
-            return dev.veh
-        # fallback: try vehicle with same imei
-        return Vehicle.objects.filter(imei=imei).first()
+        entry = imei_cache.lookup(imei)
+        return entry.vehicle if entry else None
     except Exception:
         logger.exception('vech_imei error')
         return None
@@ -49,17 +49,15 @@ def getstatus(vehicle: Vehicle):
         return 'unknown'
 
 
-def _es_client():
-    dsn = getattr(settings, 'ELASTICSEARCH_DSN', '')
-    if not dsn or not ES_AVAILABLE:
-        return None
-    return Elasticsearch([dsn])
+LOCATION_FIELDS = ('lat', 'longi', 'speed', 'sat', 'bearing', 'stime', 'odometer', 'last_date', 'last_time')
 
 
-def writelocation(veh: Vehicle, mdata: dict):
+def writelocation(veh: Vehicle, mdata: dict, writer=None):
     """Update Vehicle object and optionally write to Elasticsearch index `veh_locations`.
 
-    mdata expected keys: lat, lon, speed, satCnt, fixTimestamp, bearing, odometer
+    mdata expected keys: lat, lon, speed, satCnt, fixTimestamp, bearing, odometer.
+    Writes go to `writer` (an `IngestWriter` or a `WriteBatch`; default: the
+    process-wide writer).
     """
     try:
         if not veh:
@@ -76,52 +74,53 @@ def writelocation(veh: Vehicle, mdata: dict):
             try:
                 # assume ISO or unix ms
                 if isinstance(ts, (int, float)):
-                    veh.stime = timezone.datetime.fromtimestamp(float(ts) / 1000, tz=timezone.utc)
+                    veh.stime = timezone.datetime.fromtimestamp(float(ts) / 1000, tz=dt_timezone.utc)
                 else:
                     veh.stime = timezone.datetime.fromisoformat(ts)
+                    if timezone.is_naive(veh.stime):
+                        # a fixTimestamp without an offset is UTC, like the GT06 times
+                        veh.stime = timezone.make_aware(veh.stime, dt_timezone.utc)
             except Exception:
                 pass
 
-        od = mdata.get('odometer')
+        # with ODOMETER_SOURCE = 'computed' the trip engine owns the odometer
+        od = mdata.get('odometer') if getattr(settings, 'ODOMETER_SOURCE', 'computed') == 'device' else None
         if od is not None:
             try:
                 veh.odometer = od
             except Exception:
                 pass
 
-        veh.last_time = timezone.now().date()
-        veh.save()
-
-        # persist history to DB as fallback (and for track history)
-        try:
-            if veh:
-                # store as VehicleLocation
-                VehicleLocation.objects.create(
-                    vehicle=veh,
-                    lat=veh.lat,
-                    lon=veh.longi,
-                    speed=veh.speed or 0,
-                    sat=veh.sat or 0,
-                    time=veh.stime
-                )
-        except Exception:
-            logger.exception('store VehicleLocation failed')
-
-        # write to ES
-        es = _es_client()
-        if es:
-            doc = {
+        now = timezone.now()
+        veh.last_date = now.date()
+        veh.last_time = now.time()
+
+        # latest position (coalesced per vehicle) and history row are written
+        # in batches by the ingest writer
+        writer = writer or get_writer()
+        fields = {f: getattr(veh, f) for f in LOCATION_FIELDS}
+        if od is None:
+            del fields['odometer']
+        writer.update_vehicle(veh.veh_id, **fields)
+        if veh.lat is not None and veh.longi is not None:
+            writer.add_location(veh.veh_id, veh.lat, veh.longi, veh.speed, veh.sat, veh.stime)
+            check_fix(veh, veh.lat, veh.longi, veh.stime)
+            check_location(veh, veh.lat, veh.longi, veh.speed, veh.stime)
+            refresh_place(veh, veh.lat, veh.longi)
+
+        # queued for the bulk indexer (no-op unless ELASTICSEARCH_DSN is set)
+        if es_client() is not None:
+            lat = float(veh.lat) if veh.lat is not None else None
+            lon = float(veh.longi) if veh.longi is not None else None
+            index_document(LOCATIONS_INDEX, {
                 'veh_id': veh.veh_id,
                 'imei': veh.imei,
-                'lat': float(veh.lat) if veh.lat is not None else None,
-                'lon': float(veh.longi) if veh.longi is not None else None,
+                'location': {'lat': lat, 'lon': lon} if lat is not None and lon is not None else None,
+                'lat': lat,
+                'lon': lon,
                 'speed': float(veh.speed or 0),
-                'time': veh.stime.isoformat() if veh.stime else timezone.now().isoformat(),
-            }
-            try:
-                es.index(index='veh_locations', body=doc)
-            except Exception:
-                logger.exception('es index veh_locations failed')
+                'time': veh.stime.isoformat() if veh.stime else now.isoformat(),
+            })
 
         return True
     except Exception:
@@ -129,16 +128,24 @@ def writelocation(veh: Vehicle, mdata: dict):
         return False
 
 
-def writestatus(veh: Vehicle, mdata: dict):
+STATUS_FIELDS = ('battery', 'blevel', 'ignition', 'gps', 'slevel', 'charging', 'last_date', 'last_time')
+
+
+def writestatus(veh: Vehicle, mdata: dict, writer=None):
     """Update status-related vehicle fields and optionally write to ES `veh_status`.
 
-    mdata expected keys: battery, ignition, gps, gsm, charging
+    mdata expected keys: battery, ignition, gps, gsm, charging; optional: blevel
+    (percent), alarm (name of a tracker alarm), alarm_code, lat, lon, speed, time.
+    `writer` as for `writelocation()`.
     """
     try:
         if not veh:
             logger.warning('writestatus called without vehicle')
             return False
 
+        # alarm rules compare against the values before this update
+        check_status(veh, mdata)
+
         b = mdata.get('battery')
         if b is not None:
             try:
@@ -154,25 +161,28 @@ def writestatus(veh: Vehicle, mdata: dict):
         if gps is not None:
             veh.gps = bool(gps)
 
+        bl = mdata.get('blevel')
+        if bl is not None:
+            veh.blevel = int(bl)
+
         veh.slevel = mdata.get('gsm') or veh.slevel
         veh.charging = bool(mdata.get('charging', veh.charging))
-        veh.last_time = timezone.now().date()
-        veh.save()
-
-        es = _es_client()
-        if es:
-            doc = {
+        now = timezone.now()
+        veh.last_date = now.date()
+        veh.last_time = now.time()
+        # partial, batched update: a full save() would also fire post_save and
+        # evict this vehicle from the IMEI cache on every status message
+        (writer or get_writer()).update_vehicle(veh.veh_id, **{f: getattr(veh, f) for f in STATUS_FIELDS})
+
+        if es_client() is not None:
+            index_document(STATUS_INDEX, {
                 'veh_id': veh.veh_id,
                 'imei': veh.imei,
                 'battery': veh.battery,
                 'ignition': veh.ignition,
                 'gps': veh.gps,
-                'time': timezone.now().isoformat(),
-            }
-            try:
-                es.index(index='veh_status', body=doc)
-            except Exception:
-                logger.exception('es index veh_status failed')
+                'time': now.isoformat(),
+            })
 
         return True
     except Exception:
@@ -189,22 +199,19 @@ def get_gps_info_by_imei(imei: str):
         if not imei:
             return None
 
-        # try to find device and related vehicle
-        dev = Device.objects.filter(imei=imei).select_related('veh').first()
-        veh = None
-        if dev and getattr(dev, 'veh', None):
-            veh = dev.veh
-        else:
-            # fallback: vehicle with same imei
-            veh = Vehicle.objects.filter(imei=imei).first()
-
-        if not dev and not veh:
+        # resolve device/vehicle ids through the IMEI cache
+        entry = imei_cache.lookup(imei)
+        if not entry:
             return None
 
+        # the cached instance only tracks writes made by this process, so
+        # read the current row for the reply
+        veh = Vehicle.objects.filter(pk=entry.veh_id).first() if entry.veh_id else None
+
         info = {'imei': imei}
-        if dev:
+        if entry.device_id:
             info.update({
-                'device_id': getattr(dev, 'id', None),
+                'device_id': entry.device_id,
                 'device_obj': None,  # placeholder, avoid serializing model instances
             })
 
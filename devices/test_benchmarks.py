@@ -0,0 +1,110 @@
+"""Benchmarks of the GT06 parsers and the ingest persistence paths (pytest-benchmark).
+
+They run once, untimed, with the rest of the suite; to time them:
+
+    python -m pytest --benchmark-enable devices/test_benchmarks.py vehicles/test_benchmarks.py
+
+The database is the test settings' SQLite, so absolute numbers only
+compare runs on the same machine; for PostgreSQL and sockets use
+scripts/load_gt06.py.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+import pytest
+
+import gt06_server
+from devices import ingest_writer
+from devices.imei_cache import imei_cache
+from devices.ingest_writer import IngestWriter
+from devices.sapi_helpers import writelocation
+from scripts.load_gt06 import alarm_frame, heartbeat_frame, location_frame, login_frame
+from vehicles.models import Vehicle, VehicleLocation
+
+IMEI = '359710049095095'
+T0 = datetime(2024, 5, 1, 6, 0, tzinfo=dt_timezone.utc).timestamp()
+FIXES = 200
+
+FRAMES = {
+    'login': login_frame(IMEI, 1),
+    'location': location_frame(2, T0, 23.8, 90.4, 30, 90),
+    'heartbeat': heartbeat_frame(3),
+    'alarm': alarm_frame(4, T0, 23.8, 90.4, 30, 90),
+}
+
+
+@pytest.fixture
+def vehicle(db):
+    imei_cache.clear()
+    return Vehicle.objects.create(user_id=0, imei=IMEI, reg_no='BENCH-1', type='car')
+
+
+@pytest.fixture
+def writer(monkeypatch, request):
+    """A process-wide writer: synchronous, or write-behind flushed by the test itself."""
+    enabled = request.param == 'write-behind'
+    w = IngestWriter(batch_size=500, max_pending=FIXES * 1000, enabled=enabled)
+    # no flusher thread: it would need its own connection to the test database
+    monkeypatch.setattr(w, '_ensure_started', lambda: None)
+    monkeypatch.setattr(ingest_writer, '_writer', w)
+    return w
+
+
+def assert_stored(vehicle, writer):
+    # every round (one when benchmarks are disabled) stores all of its fixes
+    rows = VehicleLocation.objects.filter(vehicle=vehicle).count()
+    assert rows and rows % FIXES == 0
+    assert writer.stats['dropped'] == 0
+
+
+@pytest.mark.parametrize('kind', sorted(FRAMES))
+def test_parse(benchmark, kind):
+    data = memoryview(FRAMES[kind])
+    packet = benchmark(gt06_server.parse_gt06_packet, data)
+    assert packet['type'] == kind
+
+
+def test_framer(benchmark):
+    stream = b''.join(location_frame(i, T0 + i, 23.8, 90.4, 30, 90) for i in range(FIXES))
+
+    def split():
+        framer = gt06_server.GT06Framer()
+        framer.feed(stream)
+        return sum(1 for _ in framer.frames())
+
+    assert benchmark(split) == FIXES
+
+
+def test_crc(benchmark):
+    data = FRAMES['location']
+    assert benchmark(gt06_server.frame_crc_ok, data)
+
+
+@pytest.mark.parametrize('writer', ['sync', 'write-behind'], indirect=True)
+def test_handle_packet(benchmark, vehicle, writer):
+    session = gt06_server.DeviceSession('127.0.0.1', 5023)
+    gt06_server.handle_packet(memoryview(FRAMES['login']), session)
+    frames = [memoryview(location_frame(i + 2, T0 + i * 10, 23.8 + i * 1e-4, 90.4, 30, 90)) for i in range(FIXES)]
+
+    def run():
+        for data in frames:
+            gt06_server.handle_packet(data, session)
+        writer.flush()
+
+    benchmark.pedantic(run, rounds=3)
+    gt06_server.sessions.unbind(session)
+    assert_stored(vehicle, writer)
+
+
+@pytest.mark.parametrize('writer', ['sync', 'write-behind'], indirect=True)
+def test_writelocation(benchmark, vehicle, writer):
+    fixes = [{'lat': 23.8 + i * 1e-4, 'lon': 90.4, 'speed': 30, 'satCnt': 9,
+              'fixTimestamp': datetime.fromtimestamp(T0 + i * 10, dt_timezone.utc).isoformat()}
+             for i in range(FIXES)]
+
+    def run():
+        for mdata in fixes:
+            writelocation(vehicle, mdata)
+        writer.flush()
+
+    benchmark.pedantic(run, rounds=3)
+    assert_stored(vehicle, writer)
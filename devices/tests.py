@@ -1,3 +1,759 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import http.server
+import importlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+import gt06_server
+from devices import es_indexer, ingest_writer, metrics
+from devices.alarms import AlarmRules, alarm_rules
+from devices.cast_bus import InProcessCastBus
+from devices.event_log import EventRing
+from devices.geofences import GeofenceEngine
+from devices.imei_cache import ImeiCache, imei_cache
+from devices.ingest_writer import IngestWriter
+from devices.models import Device
+from devices.sapi_broadcaster import BusPublisher, QueuedPublisher, publish_cast
+from devices.sapi_helpers import writelocation
+from scripts.load_gt06 import alarm_frame, frame, location_frame, login_frame
+from vehicles.models import (Geofence, Vehicle, VehicleAlarm, VehicleLatestPosition,
+                             VehicleLocation)
+
+IMEI = '359710049095095'
+T0_DATETIME = datetime(2024, 5, 1, 6, 0, tzinfo=dt_timezone.utc)
+T0 = T0_DATETIME.timestamp()
+
+
+def make_vehicle(imei=IMEI, **fields):
+    return Vehicle.objects.create(user_id=0, imei=imei, reg_no=f'TEST-{imei}', type='car', **fields)
+
+
+class SynchronousWriterMixin:
+    """Install a synchronous process-wide ingest writer for the test."""
+
+    def setUp(self):
+        super().setUp()
+        previous, ingest_writer._writer = ingest_writer._writer, IngestWriter(enabled=False)
+        self.addCleanup(setattr, ingest_writer, '_writer', previous)
+
+
+class GT06FramerTests(SimpleTestCase):
+    def frames(self, framer):
+        return [bytes(f) for f in framer.frames()]
+
+    def test_coalesced_frames_are_all_delivered(self):
+        a, b = login_frame(IMEI, 1), location_frame(2, T0, 23.8, 90.4, 30, 90)
+        framer = gt06_server.GT06Framer()
+        framer.feed(a + b)
+        self.assertEqual(self.frames(framer), [a, b])
+
+    def test_split_frame_waits_for_the_rest(self):
+        data = location_frame(1, T0, 23.8, 90.4, 30, 90)
+        framer = gt06_server.GT06Framer()
+        framer.feed(data[:7])
+        self.assertEqual(self.frames(framer), [])
+        framer.feed(data[7:])
+        self.assertEqual(self.frames(framer), [data])
+
+    def test_long_frame(self):
+        body = b'\x00\x09\x94\x00' + b'\x01\x02\x03' + b'\x00\x07'
+        data = b'\x79\x79' + body + gt06_server.crc_itu(body).to_bytes(2, 'big') + b'\r\n'
+        framer = gt06_server.GT06Framer()
+        framer.feed(data)
+        self.assertEqual(self.frames(framer), [data])
+
+    def test_garbage_before_a_frame_is_dropped(self):
+        data = login_frame(IMEI, 1)
+        framer = gt06_server.GT06Framer()
+        framer.feed(b'\x00\x13\x37' + data)
+        self.assertEqual(self.frames(framer), [data])
+        self.assertEqual(framer.dropped_bytes, 3)
+
+    def test_resync_after_bad_stop_bits(self):
+        bad = bytearray(login_frame(IMEI, 1))
+        bad[-1] = 0x00
+        good = login_frame(IMEI, 2)
+        framer = gt06_server.GT06Framer()
+        framer.feed(bytes(bad) + good)
+        self.assertEqual(self.frames(framer), [good])
+
+    def test_stray_start_byte_before_a_frame(self):
+        data = login_frame(IMEI, 1)
+        framer = gt06_server.GT06Framer()
+        # 78 78 78 0d ...: read from the stray byte the length would be 0x78
+        framer.feed(b'\x78' + data)
+        self.assertEqual(self.frames(framer), [data])
+        self.assertEqual(framer.dropped_bytes, 1)
+
+    def test_stray_start_byte_before_a_split_frame(self):
+        data = login_frame(IMEI, 1)
+        framer = gt06_server.GT06Framer()
+        framer.feed(b'\x78' + data[:10])
+        self.assertEqual(self.frames(framer), [])
+        framer.feed(data[10:])
+        self.assertEqual(self.frames(framer), [data])
+
+    def test_truncated_frame_before_a_frame(self):
+        data = location_frame(2, T0, 23.8, 90.4, 30, 90)
+        framer = gt06_server.GT06Framer()
+        framer.feed(login_frame(IMEI, 1)[:6] + data)
+        self.assertEqual(self.frames(framer), [data])
+
+    def test_unframed_bytes_are_logged_sampled(self):
+        data = login_frame(IMEI, 1)
+        framer = gt06_server.GT06Framer()
+        framer.feed((b'\x00' + data) * 200)
+        sampler = metrics.LogSampler(gt06_server.log, 100, logging.WARNING)
+        with mock.patch.object(gt06_server, 'log_unframed', sampler), \
+                self.assertLogs(gt06_server.log, logging.WARNING) as logs:
+            self.assertEqual(len(self.frames(framer)), 200)
+        self.assertEqual(len(logs.records), 2)
+
+    def test_buffer_grows_for_large_input(self):
+        data = b''.join(location_frame(i, T0 + i, 23.8, 90.4, 30, 90) for i in range(200))
+        framer = gt06_server.GT06Framer(size=64)
+        framer.feed(data)
+        self.assertEqual(len(self.frames(framer)), 200)
+
+
+class GT06ProtocolTests(SimpleTestCase):
+    def test_crc_itu_check_value(self):
+        # CRC-16/X.25 check value
+        self.assertEqual(gt06_server.crc_itu(b'123456789'), 0x906E)
+
+    def test_login_acknowledgement_bytes(self):
+        # the login response from the GT06 protocol document
+        self.assertEqual(gt06_server.build_acknowledgment(0x01, b'\x00\x05'),
+                         bytes.fromhex('7878050100059ff80d0a'))
+
+    def test_acknowledgement_echoes_serial(self):
+        ack = gt06_server.build_acknowledgment(0x22, b'\x12\x34')
+        self.assertEqual(ack[:6], b'\x78\x78\x05\x22\x12\x34')
+        self.assertTrue(gt06_server.frame_crc_ok(ack))
+
+    def test_unacknowledged_protocol(self):
+        self.assertIsNone(gt06_server.build_acknowledgment(0x15))
+
+    def test_frame_crc_ok(self):
+        data = bytearray(login_frame(IMEI, 1))
+        self.assertTrue(gt06_server.frame_crc_ok(data))
+        data[5] ^= 0xFF
+        self.assertFalse(gt06_server.frame_crc_ok(data))
+
+    def test_parse_login_and_location(self):
+        login = gt06_server.parse_gt06_packet(memoryview(login_frame(IMEI, 1)))
+        self.assertEqual((login['type'], login['imei']), ('login', IMEI))
+        fix = gt06_server.parse_gt06_packet(memoryview(location_frame(2, T0, 23.867976, 90.390219, 42, 90)))
+        self.assertEqual(fix['type'], 'location')
+        self.assertAlmostEqual(fix['lat'], 23.867976, places=5)
+        self.assertAlmostEqual(fix['lon'], 90.390219, places=5)
+        self.assertEqual(fix['speed'], 42)
+
+    def test_unknown_protocol_is_not_parsed(self):
+        self.assertIsNone(gt06_server.parse_gt06_packet(memoryview(frame(0x7F, b'\x00' * 4, 1))))
+
+
+class HandlePacketTests(SynchronousWriterMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        imei_cache.clear()
+        self.session = gt06_server.DeviceSession('127.0.0.1', 5023)
+        self.addCleanup(gt06_server.sessions.unbind, self.session)
+
+    def test_login_is_acknowledged_with_its_serial(self):
+        reply = gt06_server.handle_packet(memoryview(login_frame(IMEI, 7)), self.session)
+        self.assertEqual(reply, gt06_server.build_acknowledgment(0x01, b'\x00\x07'))
+        self.assertEqual(self.session.imei, IMEI)
+
+    def test_login_is_acknowledged_when_the_lookup_fails(self):
+        with mock.patch.object(imei_cache, 'lookup', side_effect=RuntimeError('database is down')), \
+                self.assertLogs(gt06_server.log, logging.ERROR):
+            reply = gt06_server.handle_packet(memoryview(login_frame(IMEI, 7)), self.session)
+        self.assertEqual(reply, gt06_server.build_acknowledgment(0x01, b'\x00\x07'))
+        self.assertEqual((self.session.imei, self.session.veh_id), (IMEI, None))
+
+    def test_alarm_times_are_utc(self):
+        veh = make_vehicle()
+        self.addCleanup(alarm_rules.forget, veh.veh_id)
+        gt06_server.handle_packet(memoryview(login_frame(IMEI, 1)), self.session)
+        with mock.patch('devices.alarms.publish_cast') as publish:
+            gt06_server.handle_packet(memoryview(alarm_frame(2, T0, 23.8, 90.4, 30, 90)), self.session)
+        self.assertEqual(VehicleAlarm.objects.get(vehicle=veh, kind='sos').time, T0_DATETIME)
+        self.assertEqual(publish.call_args.args[0]['data']['time'], T0_DATETIME.isoformat())
+
+    def test_bad_crc_is_not_acknowledged(self):
+        data = bytearray(login_frame(IMEI, 7))
+        data[-3] ^= 0xFF
+        self.assertIsNone(gt06_server.handle_packet(memoryview(data), self.session))
+        self.assertEqual(self.session.crc_errors, 1)
+
+    def test_location_after_login_is_stored(self):
+        veh = make_vehicle()
+        gt06_server.handle_packet(memoryview(login_frame(IMEI, 1)), self.session)
+        self.assertEqual(self.session.veh_id, veh.veh_id)
+        reply = gt06_server.handle_packet(memoryview(location_frame(2, T0, 23.8, 90.4, 30, 90)), self.session)
+        self.assertEqual(reply, gt06_server.build_acknowledgment(0x22, b'\x00\x02'))
+        row = VehicleLocation.objects.get(vehicle=veh)
+        self.assertEqual(row.time.timestamp(), T0)
+        self.assertAlmostEqual(float(row.lat), 23.8, places=5)
+
+
+class AsyncConnectionTests(SimpleTestCase):
+    class Writer:
+        def __init__(self):
+            self.sent = []
+
+        def get_extra_info(self, name):
+            return ('127.0.0.1', 5023)
+
+        def write(self, data):
+            self.sent.append(bytes(data))
+
+        async def drain(self):
+            pass
+
+        def close(self):
+            pass
+
+    def test_frames_are_acknowledged_before_they_are_stored(self):
+        data = [login_frame(IMEI, 1), location_frame(2, T0, 23.8, 90.4, 30, 90)]
+        writer, acked_before_store = self.Writer(), []
+
+        def store(packet, session):
+            acked_before_store.append(len(writer.sent))
+
+        async def connect():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b''.join(data))
+            reader.feed_eof()
+            await gt06_server.handle_client_connection_async(reader, writer)
+
+        with mock.patch.object(gt06_server, 'store_packet', side_effect=store):
+            asyncio.run(connect())
+        self.assertEqual(writer.sent, [gt06_server.build_acknowledgment(0x01, b'\x00\x01'),
+                                       gt06_server.build_acknowledgment(0x22, b'\x00\x02')])
+        self.assertEqual(acked_before_store, [1, 2])
+
+
+class EventRingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'last_events.ring')
+
+    def test_read_only_ring_uses_the_header_sizes(self):
+        ring = EventRing(self.path, slots=4, slot_size=64)
+        for i in range(6):
+            ring.append(b'{"n": %d}' % i)
+        ring.close()
+        with open(self.path, 'rb') as f:
+            before = f.read()
+        reader = EventRing.open_readonly(self.path)
+        self.assertEqual((reader.slots, reader.slot_size), (4, 64))
+        self.assertEqual(reader.last(2), [b'{"n": 4}', b'{"n": 5}'])
+        reader.close()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_missing_ring_is_not_created(self):
+        with self.assertRaises(FileNotFoundError):
+            EventRing.open_readonly(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a ring')
+        with self.assertRaises(ValueError):
+            EventRing.open_readonly(self.path)
+
+
+class OpenEventLogTests(SimpleTestCase):
+    def test_concurrent_first_packets_open_one_log(self):
+        def slow_log(*args, **kwargs):
+            time.sleep(0.05)
+            return mock.Mock()
+
+        with mock.patch.object(gt06_server, 'event_log', None), \
+                mock.patch.object(gt06_server, 'EventLog', side_effect=slow_log) as event_log, \
+                mock.patch.object(gt06_server, 'EventRing'), mock.patch.object(gt06_server.atexit, 'register'):
+            opened = []
+            threads = [threading.Thread(target=lambda: opened.append(gt06_server.open_event_log()))
+                       for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(event_log.call_count, 1)
+        self.assertEqual(len({id(log) for log in opened}), 1)
+
+
+class ImeiCacheTests(TestCase):
+    def test_positive_and_negative_ttl(self):
+        cache = ImeiCache(ttl=300, negative_ttl=60)
+        with mock.patch('devices.imei_cache.time') as clock:
+            clock.monotonic.return_value = 1000.0
+            self.assertIsNone(cache.lookup(IMEI))
+            veh = make_vehicle()
+            # the unknown IMEI stays cached until the negative TTL runs out
+            clock.monotonic.return_value = 1059.0
+            self.assertIsNone(cache.lookup(IMEI))
+            clock.monotonic.return_value = 1061.0
+            self.assertEqual(cache.lookup(IMEI).veh_id, veh.veh_id)
+            with self.assertNumQueries(0):
+                clock.monotonic.return_value = 1360.0
+                self.assertEqual(cache.lookup(IMEI).veh_id, veh.veh_id)
+            with self.assertNumQueries(2):
+                # Device, then Vehicle
+                clock.monotonic.return_value = 1362.0
+                cache.lookup(IMEI)
+        self.assertEqual(cache.stats()['negative_hits'], 1)
+
+    def test_lru_eviction(self):
+        cache = ImeiCache(maxsize=2)
+        for imei in ('1', '2', '3'):
+            cache.lookup(imei)
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_vehicle_delete_invalidates(self):
+        imei_cache.clear()
+        veh = make_vehicle()
+        self.assertEqual(imei_cache.lookup(IMEI).veh_id, veh.veh_id)
+        veh.delete()
+        self.assertIsNone(imei_cache.lookup(IMEI))
+
+    def test_device_save_invalidates(self):
+        imei_cache.clear()
+        own = make_vehicle()
+        other = make_vehicle('359710049095096')
+        self.assertEqual(imei_cache.lookup(IMEI).veh_id, own.veh_id)
+        # a device row for the IMEI takes precedence over Vehicle.imei
+        Device.objects.create(user_id=0, veh=other, imei=IMEI, number='1', sim='', type='gt06', password='',
+                              date=T0_DATETIME.date(), time=T0_DATETIME.time(),
+                              disabled=Device.DisabledStatus.NO, status=Device.Status.YES)
+        self.assertEqual(imei_cache.lookup(IMEI).veh_id, other.veh_id)
+
+
+@mock.patch.object(IngestWriter, '_ensure_started')
+class IngestWriterTests(TestCase):
+    def test_vehicle_updates_are_coalesced(self, _):
+        veh = make_vehicle()
+        writer = IngestWriter(batch_size=100)
+        writer.update_vehicle(veh.veh_id, speed=10, sat=4)
+        writer.update_vehicle(veh.veh_id, speed=20)
+        with CaptureQueriesContext(connection) as queries:
+            writer.flush()
+        # the flush's transaction is a savepoint inside the test's
+        self.assertEqual(len([q for q in queries if 'SAVEPOINT' not in q['sql']]), 1)
+        veh.refresh_from_db()
+        self.assertEqual((veh.speed, veh.sat), (20, 4))
+        self.assertEqual(writer.stats['vehicles_updated'], 1)
+
+    def test_locations_and_latest_position(self, _):
+        veh = make_vehicle()
+        writer = IngestWriter(batch_size=100)
+        times = [datetime.fromtimestamp(T0 + dt, dt_timezone.utc) for dt in (20, 0, 10)]
+        for i, t in enumerate(times):
+            writer.add_location(veh.veh_id, 23.8 + i * 1e-3, 90.4, 30, 9, t)
+        self.assertEqual(writer.pending(), 3)
+        writer.flush()
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 3)
+        # the newest fix wins, not the last one queued
+        self.assertEqual(VehicleLatestPosition.objects.get(vehicle=veh).time, max(times))
+
+    def test_bulk_items(self, _):
+        veh = make_vehicle()
+        writer = IngestWriter(batch_size=2)
+        t = datetime.fromtimestamp(T0, dt_timezone.utc)
+        writer.add_locations([(veh.veh_id, 23.8, 90.4, 30, 9, t)] * 5)
+        writer.update_vehicles({veh.veh_id: {'speed': 30}})
+        self.assertEqual((writer.pending(), writer.stats['enqueued']), (4, 6))
+        writer.flush()
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 5)
+        self.assertEqual(writer.stats['vehicles_updated'], 1)
+
+    def test_full_queue_drops(self, _):
+        writer = IngestWriter(max_pending=2, put_timeout=0)
+        results = [writer.add_location(1, 23.8, 90.4) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(writer.stats['dropped'], 1)
+        self.assertEqual(writer.pending(), 2)
+
+    def test_synchronous_mode_writes_immediately(self, ensure_started):
+        veh = make_vehicle()
+        writer = IngestWriter(enabled=False)
+        writer.add_location(veh.veh_id, 23.8, 90.4, 30, 9, datetime.fromtimestamp(T0, dt_timezone.utc))
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 1)
+        ensure_started.assert_not_called()
+
+    @mock.patch('devices.ingest_writer.time.sleep')
+    def test_failed_flush_writes_nothing_twice(self, sleep, _):
+        veh = make_vehicle()
+        writer = IngestWriter(batch_size=100)
+        for i in range(2):
+            writer.add_location(veh.veh_id, 23.8, 90.4, 30, 9, datetime.fromtimestamp(T0 + i, dt_timezone.utc))
+        with mock.patch.object(writer, '_write_latest', side_effect=RuntimeError('boom')), \
+                self.assertLogs('devices.ingest_writer', logging.ERROR):
+            writer.flush()
+        # the history rows were rolled back with the failed upsert
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 0)
+        self.assertEqual((writer.stats['dropped'], writer.stats['flush_errors']), (2, 3))
+
+    @mock.patch('devices.ingest_writer.time.sleep')
+    def test_one_bad_row_does_not_drop_the_batch(self, sleep, _):
+        veh, bad = make_vehicle(), make_vehicle('359710049095096')
+        writer = IngestWriter(batch_size=100)
+        t = datetime.fromtimestamp(T0, dt_timezone.utc)
+        writer.add_locations([(veh.veh_id, 23.8, 90.4, 30, 9, t)] * 3 + [(bad.veh_id, 23.8, 90.4, 30, 9, t)])
+        writer.update_vehicle(veh.veh_id, speed=30)
+        write_latest = writer._write_latest
+
+        def fail_on_bad(rows):
+            if any(row[0] == bad.veh_id for row in rows):
+                raise ValueError('bad row')
+            return write_latest(rows)
+
+        with mock.patch.object(writer, '_write_latest', side_effect=fail_on_bad), \
+                self.assertLogs('devices.ingest_writer', logging.ERROR):
+            writer.flush()
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 3)
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=bad).count(), 0)
+        self.assertEqual(writer.stats['dropped'], 1)
+        veh.refresh_from_db()
+        self.assertEqual(veh.speed, 30)
+
+
+class StubElasticsearch(http.server.ThreadingHTTPServer):
+    """Answers `_bulk` requests from a script of replies and records what it got.
+
+    A reply is an HTTP status for the whole request or a list of per-document
+    statuses; once the script runs out every document is accepted.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+            docs = lines[1::2]
+            self.server.requests.append(docs)
+            reply = self.server.replies.pop(0) if self.server.replies else [201] * len(docs)
+            if isinstance(reply, int):
+                self.reply(reply, {'error': {'type': 'unavailable'}, 'status': reply})
+                return
+            items = [{'index': {'status': status, 'error': None if status < 300 else {'type': 'rejected'}}}
+                     for status in reply]
+            self.reply(200, {'took': 1, 'errors': any(status >= 300 for status in reply), 'items': items})
+
+        do_PUT = do_POST
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self, replies=()):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.replies, self.requests = list(replies), []
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+@unittest.skipUnless(es_indexer.ES_AVAILABLE, 'elasticsearch is not installed')
+class BulkIndexerTests(SimpleTestCase):
+    def indexer(self, replies=(), **options):
+        server = StubElasticsearch(replies)
+        self.addCleanup(server.close)
+        client = es_indexer.Elasticsearch(f'http://127.0.0.1:{server.server_address[1]}', max_retries=0,
+                                          request_timeout=5)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        options = dict({'batch_size': 3, 'max_retries': 2, 'backoff': 0, 'install_templates': False,
+                        'dead_letter_file': os.path.join(directory.name, 'dead.jsonl')}, **options)
+        indexer = es_indexer.BulkIndexer(client_factory=lambda: client, **options)
+        # flushed by the test, no background thread
+        indexer._ensure_started = lambda: None
+        return indexer, server
+
+    def dead_letters(self, indexer):
+        if not os.path.exists(indexer.dead_letter_file):
+            return []
+        with open(indexer.dead_letter_file, encoding='utf-8') as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_documents_are_sent_in_batches(self):
+        indexer, server = self.indexer()
+        for i in range(7):
+            indexer.index(es_indexer.LOCATIONS_INDEX, {'n': i})
+        indexer.flush()
+        self.assertEqual([[d['n'] for d in docs] for docs in server.requests], [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual((indexer.stats['indexed'], indexer.stats['requests']), (7, 3))
+
+    def test_throttled_documents_are_retried_alone(self):
+        indexer, server = self.indexer([[201, 429, 201]])
+        self.assertEqual(indexer.send([(es_indexer.LOCATIONS_INDEX, {'n': i}) for i in range(3)]), 3)
+        self.assertEqual(server.requests[1], [{'n': 1}])
+        self.assertEqual(self.dead_letters(indexer), [])
+
+    def test_failed_requests_are_retried(self):
+        indexer, server = self.indexer([503])
+        with self.assertLogs('devices.es_indexer', logging.WARNING):
+            self.assertEqual(indexer.send([(es_indexer.STATUS_INDEX, {'n': 0})]), 1)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(indexer.stats['request_errors'], 1)
+
+    def test_rejected_documents_are_dead_lettered(self):
+        indexer, server = self.indexer([[201, 400]])
+        with self.assertLogs('devices.es_indexer', logging.WARNING):
+            indexer.send([(es_indexer.LOCATIONS_INDEX, {'n': 0}), (es_indexer.LOCATIONS_INDEX, {'n': 1})])
+        self.assertEqual(len(server.requests), 1)
+        [entry] = self.dead_letters(indexer)
+        self.assertEqual((entry['index'], entry['doc']), (es_indexer.LOCATIONS_INDEX, {'n': 1}))
+        self.assertIn('rejected', entry['error'])
+
+    def test_down_cluster_is_dead_lettered_without_requests(self):
+        indexer, server = self.indexer([503, 503, 503])
+        with self.assertLogs('devices.es_indexer', logging.WARNING):
+            indexer.send([(es_indexer.LOCATIONS_INDEX, {'n': 0})])
+        self.assertEqual(len(server.requests), 3)
+        indexer.send([(es_indexer.LOCATIONS_INDEX, {'n': 1})])
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual([e['doc'] for e in self.dead_letters(indexer)], [{'n': 0}, {'n': 1}])
+        self.assertEqual(indexer.stats['dead_lettered'], 2)
+
+
+class GeofenceTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = GeofenceEngine(refresh_interval=None, seed_state=False)
+        self.depot = Geofence(id=1, name='Depot', kind=Geofence.Kind.CIRCLE,
+                              center_lat=23.8, center_lon=90.4, radius_m=500)
+        self.engine.set_fence(self.depot)
+
+    def test_enter_and_exit(self):
+        check = self.engine.check
+        self.assertEqual(check(1, None, 23.9, 90.4), ([], []))
+        entered, exited = check(1, None, 23.801, 90.4)
+        self.assertEqual(([f.name for f in entered], exited), (['Depot'], []))
+        self.assertEqual(check(1, None, 23.802, 90.401), ([], []))
+        entered, exited = check(1, None, 23.9, 90.4)
+        self.assertEqual((entered, [f.name for f in exited]), ([], ['Depot']))
+
+    def test_polygon_and_client_scope(self):
+        yard = Geofence(id=2, client_id=5, name='Yard', kind=Geofence.Kind.POLYGON,
+                        points=[[23.0, 90.0], [23.0, 90.1], [23.1, 90.1], [23.1, 90.0]])
+        self.engine.set_fence(yard)
+        self.assertEqual(self.engine.match(5, 23.05, 90.05), {2})
+        self.assertEqual(self.engine.match(6, 23.05, 90.05), set())
+
+    def test_inactive_fence_is_removed(self):
+        self.depot.active = False
+        self.engine.set_fence(self.depot)
+        self.assertEqual(self.engine.check(1, None, 23.8, 90.4), ([], []))
+
+
+class AlarmDedupTests(SynchronousWriterMixin, TestCase):
+    def test_same_alarm_is_raised_once_per_window(self):
+        veh = make_vehicle()
+        rules = AlarmRules(dedup_seconds=300)
+        sos = [('sos', VehicleAlarm.Source.DEVICE)]
+        with mock.patch('devices.alarms.time') as clock:
+            clock.monotonic.return_value = 1000.0
+            self.assertEqual(len(rules.raise_alarms(veh, sos)), 1)
+            clock.monotonic.return_value = 1200.0
+            self.assertEqual(rules.raise_alarms(veh, sos), [])
+            # other kinds have their own window
+            self.assertEqual(len(rules.raise_alarms(veh, [('shock', VehicleAlarm.Source.DEVICE)])), 1)
+            clock.monotonic.return_value = 1301.0
+            self.assertEqual(len(rules.raise_alarms(veh, sos)), 1)
+        self.assertEqual(rules.stats, {'raised': 3, 'suppressed': 1})
+        self.assertEqual(VehicleAlarm.objects.filter(vehicle=veh, kind='sos').count(), 2)
+
+    def test_forget_resets_the_window(self):
+        veh = make_vehicle()
+        rules = AlarmRules(dedup_seconds=300)
+        sos = [('sos', VehicleAlarm.Source.DEVICE)]
+        rules.raise_alarms(veh, sos)
+        rules.forget(veh.veh_id)
+        self.assertEqual(len(rules.raise_alarms(veh, sos)), 1)
+
+
+class WriteLocationTests(SynchronousWriterMixin, TestCase):
+    def test_timestamps_without_an_offset_are_utc(self):
+        veh = make_vehicle()
+        VehicleLatestPosition.objects.create(vehicle=veh, lat=23.8, lon=90.4, time=T0_DATETIME)
+        writelocation(veh, {'lat': 23.81, 'lon': 90.4, 'fixTimestamp': '2024-05-01T06:05:00'})
+        position = VehicleLatestPosition.objects.get(vehicle=veh)
+        self.assertEqual(position.time, T0_DATETIME + timedelta(minutes=5))
+
+    def test_unix_millisecond_timestamps(self):
+        veh = make_vehicle()
+        writelocation(veh, {'lat': 23.81, 'lon': 90.4, 'fixTimestamp': T0 * 1000})
+        self.assertEqual(VehicleLocation.objects.get(vehicle=veh).time, T0_DATETIME)
+
+
+class SapiBulkWriteTests(SynchronousWriterMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        imei_cache.clear()
+
+    def post(self, items, auth='SAUTH'):
+        body = '\n'.join(json.dumps(d) for d in items)
+        headers = {'HTTP_X_SAPI_AUTH': auth} if auth else {}
+        return self.client.post('/devices/sapi_v2_write/', body, content_type='application/x-ndjson', **headers)
+
+    def test_chunk_is_written_and_cast_once_per_vehicle(self):
+        veh = make_vehicle()
+        other = make_vehicle('359710049095096')
+        fixes = [{'imei': IMEI, 'lat': 23.8 + i * 1e-3, 'lon': 90.4, 'speed': 30, 'satCnt': 9,
+                  'fixTimestamp': datetime.fromtimestamp(T0 + i * 10, dt_timezone.utc).isoformat()}
+                 for i in range(5)]
+        items = fixes + [{'imei': IMEI, 'event': 'status', 'voltageLevel': 4},
+                         {'imei': other.imei, 'event': 'status', 'voltageLevel': 3},
+                         {'imei': '000000000000000', 'lat': 1, 'lon': 2}, 'not a message']
+        with mock.patch('devices.sapi_handlers.publish_cast') as publish, \
+                mock.patch.object(IngestWriter, '_put', autospec=True, side_effect=IngestWriter._put) as put:
+            response = self.post(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['result'], {'n': 9, 'stored': 7,
+                                                     'errors': [[7, 'unknown imei'], [8, 'invalid item']]})
+        # one item with the fixes and one with the merged vehicle updates
+        self.assertEqual([call.args[1][0] for call in put.call_args_list],
+                         [ingest_writer._LOCS, ingest_writer._VEHS])
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 5)
+        veh.refresh_from_db()
+        self.assertAlmostEqual(float(veh.lat), 23.804, places=5)
+        self.assertEqual(float(veh.battery), 4)
+        casts = {c.args[0]['vehicle']: c.args[0] for c in publish.call_args_list}
+        self.assertEqual(publish.call_count, 2)
+        self.assertEqual(casts[veh.veh_id]['type'], 'location')
+        self.assertAlmostEqual(casts[veh.veh_id]['data']['lat'], 23.804)
+        self.assertEqual(casts[other.veh_id]['type'], 'status')
+
+    def test_body_that_stops_decoding_reports_what_was_stored(self):
+        veh = make_vehicle()
+        fixes = [{'imei': IMEI, 'lat': 23.8, 'lon': 90.4 + i * 1e-3, 'speed': 30,
+                  'fixTimestamp': datetime.fromtimestamp(T0 + i, dt_timezone.utc).isoformat()}
+                 for i in range(3)]
+        lines = ''.join(json.dumps(d) + '\n' for d in fixes).encode()
+        # a second gzip member that is not gzip
+        body = gzip.compress(lines) + b'not gzip'
+        with mock.patch('devices.sapi_handlers.publish_cast'):
+            response = self.client.post('/devices/sapi_v2_write/', body, content_type='application/x-ndjson',
+                                        HTTP_CONTENT_ENCODING='gzip', HTTP_X_SAPI_AUTH='SAUTH')
+        self.assertEqual(response.status_code, 400)
+        result = response.json()['result']
+        self.assertEqual((result['n'], result['stored'], result['stopped_at'][0]), (3, 3, 3))
+        self.assertEqual(VehicleLocation.objects.filter(vehicle=veh).count(), 3)
+
+    def test_auth(self):
+        self.assertEqual(self.post([], auth=None).status_code, 401)
+        self.assertEqual(self.post([], auth='wrong').status_code, 403)
+        response = self.client.post('/devices/sapi_v1_write/', {'auth': 'wrong', 'type': 'gt06', 'data': '[]'})
+        self.assertEqual(response.status_code, 403)
+
+
+class InProcessCastBusTests(SimpleTestCase):
+    def subscribe(self, bus):
+        received = queue.Queue()
+        sub = bus.subscribe(received.put)
+        self.addCleanup(sub.close)
+        return sub, received
+
+    def test_every_subscriber_gets_each_batch(self):
+        bus = InProcessCastBus()
+        (_, first), (_, second) = self.subscribe(bus), self.subscribe(bus)
+        self.assertEqual(bus.publish_many([{'type': 'location', 'vehicle': 1}]), 2)
+        for received in (first, second):
+            self.assertEqual(received.get(timeout=2), [{'type': 'location', 'vehicle': 1}])
+
+    def test_casts_are_plain_json(self):
+        bus = InProcessCastBus()
+        _, received = self.subscribe(bus)
+        bus.publish_many([{'speed': Decimal('12.50'), 'time': T0_DATETIME}])
+        self.assertEqual(received.get(timeout=2), [{'speed': '12.50', 'time': str(T0_DATETIME)}])
+
+    def test_closed_subscription_gets_nothing(self):
+        bus = InProcessCastBus()
+        sub, received = self.subscribe(bus)
+        sub.close()
+        self.assertEqual(bus.publish_many([{'type': 'status'}]), 0)
+        self.assertTrue(received.empty())
+
+    def test_full_subscriber_drops(self):
+        bus = InProcessCastBus(max_queue=1)
+        release = threading.Event()
+        sub = bus.subscribe(lambda casts: release.wait(2))
+        self.addCleanup(sub.close)
+        self.addCleanup(release.set)
+        with self.assertLogs('devices.cast_bus', logging.WARNING):
+            for i in range(3):
+                bus.publish_many([{'n': i}])
+
+    def test_bus_publisher_delivers_in_batches(self):
+        bus = InProcessCastBus()
+        _, received = self.subscribe(bus)
+        publisher = BusPublisher(bus, batch_size=10, batch_wait=0.2)
+        for i in range(5):
+            publisher.publish({'n': i})
+        delivered = []
+        while len(delivered) < 5:
+            delivered += received.get(timeout=2)
+        self.assertEqual(delivered, [{'n': i} for i in range(5)])
+        self.assertEqual(publisher.stats['emitted'], 5)
+
+    def test_publish_cast_does_not_change_the_callers_dict(self):
+        cast = {'type': 'location', 'vehicle': 1}
+        with mock.patch('devices.sapi_broadcaster.get_publisher') as get_publisher:
+            publish_cast(cast)
+        self.assertEqual(cast, {'type': 'location', 'vehicle': 1})
+        self.assertIn('ts', get_publisher.return_value.publish.call_args.args[0])
+
+    def test_publisher_needs_a_send(self):
+        with self.assertRaises(TypeError):
+            QueuedPublisher()
+
+
+class SocketIOBridgeTests(SimpleTestCase):
+    def setUp(self):
+        try:
+            self.ws = importlib.import_module('scripts.flask_ws')
+        except ImportError:
+            self.skipTest('flask-socketio is not installed')
+        self.client = self.ws.socketio.test_client(self.ws.app)
+        self.addCleanup(self.client.disconnect)
+
+    def casts(self):
+        return [m['args'][0] for m in self.client.get_received() if m['name'] == 'cast']
+
+    def test_unsubscribe_leaves_the_room_subscribe_joined(self):
+        # ids are normalised the same way on the way in and out
+        self.client.emit('subscribe', {'vehicles': [7]})
+        self.ws.deliver_cast({'type': 'location', 'vehicle': 7})
+        self.assertEqual(len(self.casts()), 1)
+        self.client.emit('unsubscribe', {'vehicles': ['07']})
+        self.ws.deliver_cast({'type': 'location', 'vehicle': 7})
+        self.assertEqual(self.casts(), [])
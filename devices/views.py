@@ -4,11 +4,19 @@ from clients.models import Admin
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
+import gzip
 import json
-from . import sapi_handlers
+from . import metrics, sapi_handlers
+from .imei_cache import imei_cache
 from django.views.decorators.http import require_POST
 from vehicles.models import Vehicle
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except Exception:
+    MSGPACK_AVAILABLE = False
+
 
 @csrf_exempt
 @require_POST
@@ -31,8 +39,13 @@ def assign_device(request):
         return JsonResponse({'ok': False, 'error': 'vehicle not found'}, status=404)
 
     # Update Vehicle.imei directly (the vehicles table already has IMEI)
+    old_imei = v.imei
     v.imei = imei
     v.save()
+    # post_save already evicts this process's entries; be explicit about
+    # both IMEIs since ingest may be holding either of them
+    imei_cache.invalidate(old_imei, veh_id=v.veh_id)
+    imei_cache.invalidate(imei)
 
     # If a Device exists with this IMEI, link it to the vehicle but do not create or delete devices.
     from .models import Device
@@ -106,7 +119,75 @@ def sapi_v1_write(request):
     # delegate to handlers
     try:
         result = sapi_handlers.handle_write(auth, ptype, data, request)
+    except sapi_handlers.AuthError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=e.status)
     except Exception as e:
         return JsonResponse({'ok': False, 'error': str(e)}, status=500)
 
-    return JsonResponse({'ok': True, 'result': result})
\ No newline at end of file
+    return JsonResponse({'ok': True, 'result': result})
+
+
+def _iter_v2_items(request):
+    """Yield message dicts from a v2 request body without reading it whole.
+
+    NDJSON (one object per line) by default, msgpack when the Content-Type
+    says so; `Content-Encoding: gzip` is decoded on the fly. Lines that are
+    not valid JSON are yielded as None so they are reported by index.
+    """
+    stream = request
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        stream = gzip.GzipFile(fileobj=request, mode='rb')
+
+    if request.content_type in ('application/msgpack', 'application/x-msgpack'):
+        if not MSGPACK_AVAILABLE:
+            raise ValueError('msgpack is not installed')
+        yield from msgpack.Unpacker(stream, raw=False)
+        return
+
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+@csrf_exempt
+def sapi_v2_write(request):
+    """Bulk write endpoint for gateways that batch many fixes.
+
+    POST body: NDJSON (or msgpack) stream of GT06-style message dicts, optionally
+    gzip-encoded. Auth via `X-Sapi-Auth` header or `auth` query parameter
+    (401 without one, 403 with an unknown one); protocol via `type` query
+    parameter (default gt06). A body that stops decoding partway gets a 400
+    with the results so far and the index of the first item not read
+    (`result.stopped_at`); the items before it are stored.
+    """
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+
+    auth = request.headers.get('X-Sapi-Auth') or request.GET.get('auth')
+    ptype = request.GET.get('type') or 'gt06'
+
+    try:
+        result = sapi_handlers.handle_bulk_write(auth, ptype, _iter_v2_items(request))
+    except sapi_handlers.AuthError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=e.status)
+    except Exception as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=500)
+
+    if 'stopped_at' in result:
+        # undecodable body (bad gzip/msgpack stream); the items before it were stored
+        index, message = result['stopped_at']
+        return JsonResponse({'ok': False, 'error': f'invalid body at item {index}: {message}',
+                             'result': result}, status=400)
+    return JsonResponse({'ok': True, 'result': result})
+
+
+def prometheus_metrics(request):
+    """Ingest metrics of this worker process in the Prometheus text format."""
+    if not metrics.authorized(request.headers.get('Authorization')):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
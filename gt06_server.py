@@ -3,11 +3,15 @@
 COMPLETE WORKING GT06 GPS Server for Bangladesh
 Coordinates verified with SMS: Lat:N23.867976,Lon:E90.390219
 """
+import asyncio
+import atexit
 import socket
+import struct
 import threading
-import json
+import time
 import os
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
 import logging
     
 
@@ -30,30 +34,67 @@ if BASE_DIR not in sys.path:
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
 django.setup()
 
-from vehicles.models import Vehicle, VehicleLocation
+from django.conf import settings
+from devices import metrics
+from devices.alarms import check_location
+from devices.event_log import EventLog, EventRing
+from devices.geofences import check_fix
+from devices.imei_cache import imei_cache
+from devices.ingest_writer import get_writer
+from devices.reverse_geocoder import refresh_place
+from devices.sapi_helpers import writestatus
+
+# -- instrumentation --------------------------------------------------------
+# served on GT06_METRICS_PORT (or --metrics-port); see devices/metrics.py
+CONNECTIONS = metrics.gauge('gt06_connections', 'Open tracker connections')
+CONNECTS = metrics.counter('gt06_connects_total', 'Tracker connections accepted')
+DISCONNECTS = metrics.counter('gt06_disconnects_total', 'Tracker connections closed', ['reason'])
+SESSIONS = metrics.gauge('gt06_sessions', 'Logged-in trackers')
+FRAMES = metrics.counter('gt06_frames_total', 'GT06 frames received', ['protocol'])
+CRC_ERRORS = metrics.counter('gt06_crc_errors_total', 'Frames dropped for a CRC mismatch')
+UNPARSED = metrics.counter('gt06_unparsed_frames_total',
+                           'Frames not decoded (malformed, unknown protocol or nothing to store)', ['protocol'])
+UNFRAMED_BYTES = metrics.counter('gt06_unframed_bytes_total', 'Bytes skipped while looking for a frame start')
+UNSTORED = metrics.counter('gt06_unstored_fixes_total', 'Location fixes that could not be stored', ['reason'])
+HANDLE_SECONDS = metrics.histogram('gt06_handle_seconds', 'Time to decode, store and answer one frame')
+PROTOCOL_LABELS = tuple(f'0x{p:02x}' for p in range(256))
+
+# per-frame and per-connection lines: one in N at INFO, all of them at DEBUG
+log_frame = metrics.LogSampler(log, getattr(settings, 'GT06_LOG_SAMPLE', 10000))
+log_connection = metrics.LogSampler(log, getattr(settings, 'GT06_CONNECTION_LOG_SAMPLE', 100))
+log_unstored = metrics.LogSampler(log, getattr(settings, 'GT06_CONNECTION_LOG_SAMPLE', 100), logging.WARNING)
+log_unframed = metrics.LogSampler(log, getattr(settings, 'GT06_CONNECTION_LOG_SAMPLE', 100), logging.WARNING)
 
 # Storage
-device_imei = {}  # ip -> imei mapping
-DATA_FILE = '/home/neo_track/gps_data.json'
+EVENT_LOG_DIR = getattr(settings, 'GT06_EVENT_LOG_DIR', '/home/neo_track/gps_events')
+event_log = None
+_event_log_lock = threading.Lock()
+
+def open_event_log():
+    """Open the raw event log (and the last-events ring, if enabled) once per process."""
+    global event_log
+    if event_log is None:
+        with _event_log_lock:
+            if event_log is None:
+                os.makedirs(EVENT_LOG_DIR, exist_ok=True)
+                ring = None
+                ring_slots = getattr(settings, 'GT06_EVENT_RING_SLOTS', 1000)
+                if ring_slots:
+                    ring = EventRing(os.path.join(EVENT_LOG_DIR, 'last_events.ring'), slots=ring_slots)
+                event_log = EventLog(
+                    EVENT_LOG_DIR,
+                    segment_bytes=getattr(settings, 'GT06_EVENT_LOG_SEGMENT_BYTES', 64 * 1024 * 1024),
+                    max_segments=getattr(settings, 'GT06_EVENT_LOG_SEGMENTS', 20),
+                    fsync_interval=getattr(settings, 'GT06_EVENT_LOG_FSYNC_INTERVAL', 1.0),
+                    ring=ring,
+                )
+                atexit.register(event_log.close)
+    return event_log
 
 def save_gps_data(data):
-    """Save GPS data to JSON file."""
+    """Append GPS data to the raw event log and store locations."""
     try:
-        all_data = []
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'r') as f:
-                    if os.path.getsize(DATA_FILE) > 0:
-                        all_data = json.load(f)
-            except:
-                all_data = []
-        
-        all_data.append(data)
-        if len(all_data) > 1000:
-            all_data = all_data[-1000:]
-        
-        with open(DATA_FILE, 'w') as f:
-            json.dump(all_data, f, indent=2)
+        open_event_log().append(data)
         
         if data.get('type') == 'location':
             lat = data.get('lat', 0)
@@ -63,309 +104,838 @@ def save_gps_data(data):
             satellites = data.get('satellites', 0)
             timestamp = data.get('time', datetime.now().isoformat())
             
-            log.info(f"? SAVED LOCATION: {lat:.6f}, {lon:.6f}")
+            log.debug("? SAVED LOCATION: %.6f, %.6f", lat, lon)
             
             # Save to Django database
             save_to_database(imei, lat, lon, speed, satellites, timestamp)
+        elif data.get('type') in ('heartbeat', 'status', 'alarm'):
+            save_status(data)
         else:
-            log.info(f"?? SAVED: {data.get('type', 'data')}")
+            log.debug("?? SAVED: %s", data.get('type', 'data'))
         
         return True
     except Exception as e:
-        log.error(f"Save error: {e}")
+        log.error("Save error: %s", e)
         return False
 
+def parse_fix_time(value):
+    """Aware datetime of a packet's `time` string, or None; GT06 fix times are UTC."""
+    try:
+        when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    return when.replace(tzinfo=dt_timezone.utc) if when.tzinfo is None else when
+
 def save_to_database(imei, lat, lon, speed, satellites, timestamp_str):
     """Save GPS location to Django database."""
     try:
-        # Try to find the vehicle by IMEI
-        vehicle = Vehicle.objects.filter(imei=imei).first()
-        
-        if not vehicle:
-            # If not found, try with "unknown" IMEI (your existing logic)
-            vehicle = Vehicle.objects.filter(imei="unknown").first()
+        # packets sent before a login carry no IMEI; they cannot be attributed
+        if not imei or imei == 'unknown':
+            UNSTORED.labels('no_login').inc()
+            log_unstored("? Database: location without a logged-in IMEI, not stored")
+            return False
+
+        # Find the vehicle by IMEI (cached, no query in steady state)
+        entry = imei_cache.lookup(imei)
+        vehicle = entry.vehicle if entry else None
         
         if vehicle:
-            # Parse timestamp string to datetime object
-            try:
-                if 'T' in timestamp_str:
-                    time_obj = datetime.strptime(timestamp_str, "%Y-%m-%dT%H:%M:%S")
-                else:
-                    # Try other formats if needed
-                    time_obj = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-            except:
-                time_obj = datetime.now()
+            time_obj = parse_fix_time(timestamp_str) or datetime.now(dt_timezone.utc)
             
-            # Create VehicleLocation record
-            VehicleLocation.objects.create(
-                vehicle=vehicle,
+            # Queue VehicleLocation record (written in batches)
+            queued = get_writer().add_location(
+                vehicle.veh_id,
                 lat=lat,
                 lon=lon,
                 speed=speed,
                 sat=satellites,
                 time=time_obj
             )
+            check_fix(vehicle, lat, lon, time_obj)
+            check_location(vehicle, lat, lon, speed, time_obj)
+            refresh_place(vehicle, lat, lon)
             
-            log.info(f"? Database: Location saved for vehicle: {vehicle.reg_no} (IMEI: {imei})")
-            return True
+            log.debug("? Database: Location queued for vehicle: %s (IMEI: %s)", vehicle.reg_no, imei)
+            return queued
         else:
-            log.warning(f"? Database: No vehicle found with IMEI: {imei}")
+            UNSTORED.labels('unknown_imei').inc()
+            log_unstored("? Database: No vehicle found with IMEI: %s", imei)
             return False
             
     except Exception as e:
-        log.error(f"Database save error: {e}")
+        log.error("Database save error: %s", e)
         return False
 
-def parse_gt06_packet(data):
-    """Parse GT06 protocol packet."""
-    try:
-        if len(data) < 10:
-            return None
-        
-        # Check start bytes
-        if data[0:2] not in [b'\x78\x78', b'\x79\x79']:
-            return None
-        
-        length = data[2]
-        protocol = data[3]
-        
-        log.info(f"?? Packet: Protocol=0x{protocol:02x}, Length={length}")
-        
-        # Parse based on protocol
-        if protocol == 0x01:  # Login
-            return parse_login_packet(data)
-        elif protocol in [0x12, 0x22, 0x26]:  # GPS location only
-            return parse_location_packet(data, protocol)
-        elif protocol == 0x20:  # LBS packet — DO NOT SAVE
-            log.info("📡 LBS packet ignored (0x20)")
-            return None
-        elif protocol == 0x13:  # Heartbeat
-            return {"type": "heartbeat", "time": datetime.now().isoformat()}
-        elif protocol == 0x16:  # Alarm
-            return parse_alarm_packet(data)
-        elif protocol == 0x24:  # Status
-            return {"type": "status", "protocol": "0x24", "time": datetime.now().isoformat()}
-        elif protocol == 0x20:  # Additional data or LBS location
-            return parse_protocol_20_packet(data)
-        else:
-            log.warning(f"?? Unknown protocol: 0x{protocol:02x}")
-            return None
-            
-    except Exception as e:
-        log.error(f"Parse error: {e}")
-        return None
+def save_status(packet):
+    """Apply a decoded heartbeat/status/alarm packet to its vehicle.
 
-def parse_login_packet(data):
-    """Parse login packet (protocol 0x01)."""
-    try:
-        if len(data) < 18:
-            return None
-        
-        # IMEI is bytes 4-11 (8 bytes BCD)
-        imei_bytes = data[4:12]
-        
-        # Convert BCD to string
-        imei = ""
-        for b in imei_bytes:
-            imei += f"{b:02d}"
-        
-        imei = imei.lstrip('0')
-        
-        log.info(f"?? LOGIN - IMEI: {imei}")
-        
-        return {
-            "imei": imei,
-            "type": "login",
-            "time": datetime.now().isoformat(),
-            "protocol": "0x01"
-        }
-        
-    except Exception as e:
-        log.error(f"Login parse error: {e}")
-        return None
+    Alarm packets carrying a GPS fix also store the location. The vehicle
+    columns are updated through `writestatus` (batched, and evaluated by the
+    alarm rules first); nothing here queries the database in steady state.
+    """
+    imei = packet.get('imei')
+    entry = imei_cache.lookup(imei) if imei and imei != 'unknown' else None
+    vehicle = entry.vehicle if entry else None
+    if vehicle is None:
+        log.debug("No vehicle for %s packet from IMEI %s", packet.get('type'), imei)
+        return False
 
-def parse_location_packet(data, protocol):
-    """Parse GPS location packet - VERIFIED with SMS coordinates."""
-    try:
-        # Protocol 0x22 has offset 4, others might differ
-        # if protocol == 0x22:
-        #     offset = 4
-        #     if len(data) < offset + 25:
-        #         return None
-        # else:
-        #     offset = 0
-        #     if len(data) < 40:
-        #         return None
-
-        offset = 4
-        if len(data) < offset + 20:
-            return None
-        
-        # Parse date/time (YY MM DD HH MM SS)
-        year = 2000 + data[offset]
-        month = data[offset + 1]
-        day = data[offset + 2]
-        hour = data[offset + 3]
-        minute = data[offset + 4]
-        second = data[offset + 5]
-        
-        # GPS info
-        gps_byte = data[offset + 6]
-        gps_fix = (gps_byte & 0x80) != 0
-        satellites = gps_byte & 0x0F
-        if not gps_fix:
-            log.warning("📡 No GPS fix — packet ignored")
+    fix_time = None
+    if packet.get('gps_fix'):
+        save_to_database(imei, packet['lat'], packet['lon'], packet['speed'],
+                         packet['satellites'], packet['time'])
+        fix_time = parse_fix_time(packet['time'])
+
+    mdata = {
+        'battery': packet.get('voltage_level'),
+        'blevel': packet.get('battery_percent'),
+        'ignition': packet.get('ignition'),
+        'gps': packet.get('gps_tracking'),
+        # vehicle.slevel is 1-5, the tracker reports 0-4
+        'gsm': packet['gsm_level'] + 1 if packet.get('gsm_level') is not None else None,
+        'charging': packet.get('charging'),
+        'alarm': packet.get('alarm'),
+        'alarm_code': packet.get('alarm_code'),
+        'lat': packet.get('lat'),
+        'lon': packet.get('lon'),
+        'speed': packet.get('speed'),
+        'time': fix_time,
+    }
+    if mdata['charging'] is None:
+        del mdata['charging']
+    return writestatus(vehicle, mdata)
+
+START_SHORT = b'\x78\x78'  # 1-byte length field
+START_LONG = b'\x79\x79'   # 2-byte length field
+STOP_BITS = b'\x0D\x0A'
+MAX_FRAME_SIZE = 1024
+
+class GT06Framer:
+    """Split one connection's TCP byte stream into GT06 frames.
+
+    Bytes are received into a reusable per-connection buffer and complete
+    frames are yielded as memoryview slices of it, so coalesced packets are
+    all delivered and split packets wait for their remaining bytes. Yielded
+    views are only valid until the next receive.
+    """
+
+    def __init__(self, size=4096):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unconsumed byte
+        self._end = 0    # end of received data
+        self.dropped_bytes = 0
+
+    def _make_room(self, wanted):
+        pending = self._end - self._start
+        if self._start:
+            # move the partial frame to the front (same-size slice assignment,
+            # allowed while views are exported)
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < wanted:
+            # views may still reference the old buffer, so allocate a new one
+            # instead of resizing in place
+            buf = bytearray(max(len(self._buf) * 2, pending + wanted))
+            buf[:pending] = self._buf[:pending]
+            self._buf, self._view = buf, memoryview(buf)
+
+    def writable(self, wanted=1024):
+        """Return a writable view for `sock.recv_into()`; call `commit()` after."""
+        self._make_room(wanted)
+        return self._view[self._end:]
+
+    def commit(self, nbytes):
+        self._end += nbytes
+
+    def feed(self, data):
+        """Append received `data` (for transports that hand over bytes)."""
+        self.writable(len(data))[:len(data)] = data
+        self.commit(len(data))
+
+    def frames(self):
+        """Yield every complete frame currently buffered."""
+        buf = self._buf
+        while True:
+            start, end = self._start, self._end
+            if end - start < 5:
+                return
+            size = self._size_at(start)
+            if not size or size > MAX_FRAME_SIZE:
+                self._resync(start + 1)
+                continue
+            if end - start < size:
+                # a stray 0x78/0x79 makes the next byte read as a (long) length;
+                # don't wait for that frame when a whole one already follows it
+                nxt = self._whole_frame_after(start + 1)
+                if nxt is None:
+                    return  # wait for the rest of the frame
+                self._resync(nxt)
+                continue
+            if buf[start + size - 2] != 0x0D or buf[start + size - 1] != 0x0A:
+                self._resync(start + 1)
+                continue
+            self._start = start + size
+            yield self._view[start:start + size]
+
+    def _size_at(self, pos):
+        """Size declared by a frame header at `pos`: 0 if there is none, None if not all received."""
+        buf = self._buf
+        if self._end - pos < 4:
             return None
-        
-        # Coordinates
-        lat_raw = int.from_bytes(data[offset + 7:offset + 11], 'big')
-        lon_raw = int.from_bytes(data[offset + 11:offset + 15], 'big')
-        
-        # Speed and course
-        speed = int.from_bytes(data[offset + 15:offset + 17], 'big')
-        course_raw = int.from_bytes(data[offset + 17:offset + 19], 'big')
-        course = course_raw / 10.0
-        
-        # ? CORRECT COORDINATE CALCULATION
-        # Verified with SMS: Lat:N23.867976 = lat_raw/1800000
-        DIVISOR = 1800000.0
-        
-        latitude = lat_raw / DIVISOR
-        longitude = lon_raw / DIVISOR
-        
-        timestamp = f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{second:02d}"
-        
-        # Validate for Bangladesh
-        if 20 < latitude < 27 and 88 < longitude < 93:
-            log.info(f"?? GPS Bangladesh: {latitude:.6f}N, {longitude:.6f}E")
-        else:
-            log.warning(f"?? Unexpected coordinates: {latitude:.6f}, {longitude:.6f}")
-        return {
-            "imei": "unknown",
-            "lat": latitude,
-            "lon": longitude,
-            "speed": speed,
-            "course": course,
-            "satellites": satellites,
-            "gps_fix": gps_fix,
-            "time": timestamp,
-            "type": "location",
-            "protocol": f"0x{protocol:02x}",
-            "verified": True
-        }
-        
-    except Exception as e:
-        log.error(f"Location parse error: {e}")
+        first = buf[pos]
+        if first != buf[pos + 1]:
+            return 0
+        if first == 0x78:
+            return buf[pos + 2] + 5
+        if first == 0x79:
+            return (buf[pos + 2] << 8 | buf[pos + 3]) + 6
+        return 0
+
+    def _whole_frame_after(self, pos):
+        """Start of the first complete frame with a valid CRC at or after `pos`, or None."""
+        buf, end = self._buf, self._end
+        while True:
+            hits = [i for i in (buf.find(START_SHORT, pos, end), buf.find(START_LONG, pos, end)) if i >= 0]
+            if not hits:
+                return None
+            i = min(hits)
+            size = self._size_at(i)
+            if (size and i + size <= end and buf[i + size - 2] == 0x0D and buf[i + size - 1] == 0x0A
+                    and frame_crc_ok(self._view[i:i + size])):
+                return i
+            pos = i + 1
+
+    def _resync(self, pos):
+        """Drop bytes up to the next start marker at or after `pos`."""
+        hits = [i for i in (self._buf.find(START_SHORT, pos, self._end),
+                            self._buf.find(START_LONG, pos, self._end)) if i >= 0]
+        # keep a trailing half marker, the other half may still arrive
+        nxt = min(hits) if hits else max(pos, self._end - 1)
+        self.dropped_bytes += nxt - self._start
+        UNFRAMED_BYTES.inc(nxt - self._start)
+        log_unframed("?? Dropped %d unframed bytes", nxt - self._start)
+        self._start = nxt
+
+def frame_protocol(data):
+    """Return the protocol number of a GT06 frame."""
+    return data[4] if data[0:2] == START_LONG else data[3]
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+# CRC-ITU (CRC-16/X.25: reflected poly 0x1021, init and xorout 0xFFFF)
+CRC_TABLE = _crc_table()
+
+def crc_itu(data):
+    """CRC-ITU of `data` (bytes, bytearray or memoryview)."""
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc ^ 0xFFFF
+
+def frame_serial(data):
+    """Return the 2-byte information serial number of a GT06 frame."""
+    return bytes(data[-6:-4])
+
+def frame_crc_ok(data):
+    """True when the frame's CRC matches (it covers the length byte(s) through the serial)."""
+    return crc_itu(data[2:-4]) == int.from_bytes(data[-4:-2], 'big')
+
+# -- decoding -------------------------------------------------------------
+# Payload layouts, unpacked from the first byte after the protocol number.
+# A 3-byte cell id is read as a byte and a short (hi << 16 | lo).
+GPS = '6BBIIBH'           # date/time, GPS info, lat, lon, speed, course/status
+LBS = 'HBHBH'             # MCC, MNC, LAC, cell id
+CELL = struct.Struct('>HBHB')  # neighbour LAC, cell id, RSSI
+STATUS = struct.Struct('>5B')  # terminal info, voltage, GSM, alarm, language
+GPS_LBS = struct.Struct('>' + GPS + LBS)
+GPS_ALARM = struct.Struct('>' + GPS + 'B')  # + LBS length (which counts itself)
+LBS_MULTI = struct.Struct('>6B' + LBS + 'B')  # date/time, serving cell, RSSI; 6 CELLs follow
+LOGIN = struct.Struct('>8s')
+INFO = struct.Struct('>B')
+COMMAND_REPLY = struct.Struct('>BI')  # length of flag + text, server flag
+
+COORD_DIVISOR = 1800000.0  # verified with SMS: Lat:N23.867976 = lat_raw/1800000
+COURSE_NORTH = 0x0400
+COURSE_WEST = 0x0800
+COURSE_POSITIONED = 0x1000
+
+# protocol -> (layout or None, decode(data, protocol, fields))
+DECODERS = {}
+
+
+def decoder(*protocols, layout=None):
+    """Register `decode(data, protocol, fields)` for `protocols`.
+
+    `fields` is `layout.unpack_from()` of the payload; frames too short for
+    the layout are rejected before the decoder is called.
+    """
+    def register(fn):
+        for protocol in protocols:
+            DECODERS[protocol] = (layout, fn)
+        return fn
+    return register
+
+
+def parse_gt06_packet(data):
+    """Decode one GT06 frame into a dict; None if it is malformed, unknown or not stored."""
+    if len(data) < 10:
         return None
-    
-def parse_protocol_20_packet(data):
-    """Parse protocol 0x20 packet (often LBS location or additional data)."""
-    try:
-        if len(data) < 10:
-            return None
-        
-        log.info(f"?? Protocol 0x20 packet received, length: {len(data)}")
-        
-        # Protocol 0x20 often contains LBS (cell tower) location data
-        # You can parse it or just acknowledge it
-        return {
-            "type": "protocol_20",
-            "time": datetime.now().isoformat(),
-            "protocol": "0x20",
-            "raw_length": len(data)
-        }
-        
-    except Exception as e:
-        log.error(f"Protocol 0x20 parse error: {e}")
+    start = data[0:2]
+    if start == START_LONG:
+        # drop one start byte so the protocol and payload sit at the same
+        # offsets as in 0x7878 frames (zero-copy on memoryviews)
+        data = data[1:]
+    elif start != START_SHORT:
         return None
-    
-def parse_alarm_packet(data):
-    """Parse alarm packet (protocol 0x16)."""
+    protocol = data[3]
+    entry = DECODERS.get(protocol)
+    if entry is None:
+        log.warning("?? Unknown protocol: 0x%02x", protocol)
+        return None
+    layout, decode = entry
+    fields = None
+    if layout is not None:
+        # payload, then serial (2), CRC (2) and stop bits (2)
+        if len(data) < 4 + layout.size + 6:
+            log.debug("Short 0x%02x frame (%d bytes)", protocol, len(data))
+            return None
+        fields = layout.unpack_from(data, 4)
     try:
-        alarm_type = data[4] if len(data) > 4 else 0
-        log.info(f"?? ALARM: Type=0x{alarm_type:02x}")
-        
-        return {
-            "type": "alarm",
-            "alarm_code": alarm_type,
-            "time": datetime.now().isoformat(),
-            "protocol": "0x16"
-        }
-        
-    except Exception as e:
-        log.error(f"Alarm parse error: {e}")
+        return decode(data, protocol, fields)
+    except Exception:
+        log.exception("Parse error in 0x%02x frame", protocol)
+        return None
+
+
+def _timestamp(year, month, day, hour, minute, second):
+    return '%04d-%02d-%02dT%02d:%02d:%02d' % (2000 + year, month, day, hour, minute, second)
+
+
+def _gps(fields):
+    """Position dict from the first 11 fields of a `GPS` layout."""
+    course_status = fields[10]
+    lat = fields[7] / COORD_DIVISOR
+    lon = fields[8] / COORD_DIVISOR
+    if not course_status & COURSE_NORTH:
+        lat = -lat
+    if course_status & COURSE_WEST:
+        lon = -lon
+    return {
+        "lat": lat,
+        "lon": lon,
+        "speed": fields[9],
+        "course": course_status & 0x03FF,
+        "satellites": fields[6] & 0x0F,
+        "gps_fix": bool(course_status & COURSE_POSITIONED),
+        "time": _timestamp(*fields[:6]),
+    }
+
+
+def _cell(mcc, mnc, lac, ci_hi, ci_lo):
+    return {"mcc": mcc, "mnc": mnc, "lac": lac, "cell_id": ci_hi << 16 | ci_lo}
+
+
+@decoder(0x01, layout=LOGIN)
+def parse_login_packet(data, protocol, fields):
+    """Login (0x01): the IMEI as 8 BCD bytes (a leading 0 and 15 digits)."""
+    imei = fields[0].hex()
+    if len(imei) == 16 and imei[0] == '0':
+        imei = imei[1:]
+    log.debug("?? LOGIN - IMEI: %s", imei)
+    return {"imei": imei, "type": "login", "time": datetime.now().isoformat(), "protocol": "0x01"}
+
+
+@decoder(0x12, 0x22, layout=GPS_LBS)
+def parse_location_packet(data, protocol, fields):
+    """GPS + LBS location (0x12 GT06, 0x22 GT06N/Concox with ACC and upload mode)."""
+    packet = _gps(fields)
+    if not packet["gps_fix"]:
+        log.debug("?? No GPS fix in 0x%02x, not stored", protocol)
+        return None
+    packet.update(_cell(*fields[11:16]), imei="unknown", type="location", protocol=f"0x{protocol:02x}")
+    extra = 4 + GPS_LBS.size
+    if protocol == 0x22 and len(data) >= extra + 3 + 6:
+        packet["ignition"] = bool(data[extra])
+        packet["upload_mode"] = data[extra + 1]
+        packet["realtime"] = not data[extra + 2]
+    return packet
+
+
+@decoder(0x13, layout=STATUS)
+def parse_heartbeat_packet(data, protocol, fields):
+    """Heartbeat / status information (0x13)."""
+    return dict(decode_status(fields), type="heartbeat", protocol="0x13", time=datetime.now().isoformat())
+
+
+@decoder(0x24, layout=STATUS)
+def parse_status_packet(data, protocol, fields):
+    """Status (0x24), same payload as the heartbeat."""
+    return dict(decode_status(fields), type="status", protocol="0x24", time=datetime.now().isoformat())
+
+
+@decoder(0x16, 0x26, layout=GPS_ALARM)
+def parse_alarm_packet(data, protocol, fields):
+    """Alarm (0x16 GT06, 0x26 Concox): GPS fix, LBS cell and status block."""
+    packet = _gps(fields)
+    lbs_len = fields[11] or 9
+    offset = 4 + GPS_ALARM.size - 1  # the LBS length byte
+    if lbs_len >= 9:
+        packet.update(_cell(*struct.unpack_from('>' + LBS, data, offset + 1)))
+    if len(data) >= offset + lbs_len + STATUS.size + 6:
+        packet.update(decode_status(STATUS.unpack_from(data, offset + lbs_len)))
+    packet.update(type="alarm", protocol=f"0x{protocol:02x}")
+    if packet.get("alarm"):
+        log.info("?? ALARM: %s (0x%02x)", packet["alarm"], packet["alarm_code"] or 0)
+    return packet
+
+
+def _cells(data, fields):
+    """Serving cell plus the non-empty neighbour cells of an `LBS_MULTI` payload."""
+    serving = _cell(*fields[6:11])
+    serving["rssi"] = fields[11]
+    cells = [serving]
+    offset = 4 + LBS_MULTI.size
+    for _ in range(6):
+        if len(data) < offset + CELL.size + 6:
+            break
+        lac, ci_hi, ci_lo, rssi = CELL.unpack_from(data, offset)
+        offset += CELL.size
+        if lac or ci_hi or ci_lo:
+            cells.append({"mcc": serving["mcc"], "mnc": serving["mnc"], "lac": lac,
+                          "cell_id": ci_hi << 16 | ci_lo, "rssi": rssi})
+    return cells, offset
+
+
+@decoder(0x28, layout=LBS_MULTI)
+def parse_lbs_packet(data, protocol, fields):
+    """Multi-cell LBS (0x28): no GPS position, only the cells the tracker sees."""
+    cells, _ = _cells(data, fields)
+    return {"type": "lbs", "cells": cells, "time": _timestamp(*fields[:6]), "protocol": "0x28"}
+
+
+@decoder(0x2C, layout=LBS_MULTI)
+def parse_wifi_packet(data, protocol, fields):
+    """WiFi (0x2C): the LBS cells, timing advance, then (MAC, strength) per access point."""
+    cells, offset = _cells(data, fields)
+    offset += 1  # timing advance
+    aps = []
+    if len(data) > offset + 6:
+        count = data[offset]
+        offset += 1
+        for _ in range(count):
+            if len(data) < offset + 7 + 6:
+                break
+            mac = bytes(data[offset:offset + 6]).hex(':')
+            aps.append({"mac": mac, "strength": data[offset + 6]})
+            offset += 7
+    return {"type": "wifi", "cells": cells, "wifi": aps, "time": _timestamp(*fields[:6]), "protocol": "0x2c"}
+
+
+@decoder(0x20)
+def parse_protocol_20_packet(data, protocol, fields):
+    """Protocol 0x20 (LBS / additional data): acknowledged and logged, not stored."""
+    log.debug("?? Protocol 0x20 packet received, length: %d", len(data))
+    return {"type": "protocol_20", "time": datetime.now().isoformat(), "protocol": "0x20",
+            "raw_length": len(data)}
+
+
+@decoder(0x8A)
+def parse_time_request(data, protocol, fields):
+    """Time calibration request (0x8A); answered by `build_response()` with the UTC time."""
+    return {"type": "time_request", "time": datetime.now().isoformat(), "protocol": "0x8a"}
+
+
+@decoder(0x94, layout=INFO)
+def parse_info_packet(data, protocol, fields):
+    """Information transmission (0x94): external voltage, status text, door, ICCID, ..."""
+    sub = fields[0]
+    content = bytes(data[5:-6])
+    packet = {"type": "info", "info_type": sub, "time": datetime.now().isoformat(), "protocol": "0x94"}
+    if sub == 0x00 and len(content) >= 2:
+        packet["external_voltage"] = int.from_bytes(content[:2], 'big') / 100.0
+    elif sub == 0x04:
+        packet["text"] = content.decode('ascii', 'replace')
+    elif sub == 0x05 and content:
+        packet["door"] = bool(content[0] & 0x01)
+    elif sub == 0x0A and len(content) >= 26:
+        packet.update(imei=content[:8].hex().lstrip('0'), imsi=content[8:16].hex().lstrip('0'),
+                      iccid=content[16:26].hex())
+    else:
+        packet["raw"] = content.hex()
+    return packet
+
+
+@decoder(0x15, layout=COMMAND_REPLY)
+def parse_command_reply(data, protocol, fields):
+    """Reply to an online command (0x80)."""
+    length = max(fields[0] - 4, 0)  # the length byte counts the 4-byte server flag
+    text = bytes(data[9:9 + length]).decode('ascii', 'replace')
+    log.info("?? COMMAND REPLY: %s", text)
+    return {"type": "command_reply", "text": text, "time": datetime.now().isoformat(), "protocol": "0x15"}
+
+
+# terminal information byte, bits 3-5
+TERMINAL_ALARMS = {0b100: 'sos', 0b011: 'low_battery', 0b010: 'power_cut', 0b001: 'shock'}
+# alarm/language word, high byte
+ALARM_CODES = {
+    0x01: 'sos', 0x02: 'power_cut', 0x03: 'shock', 0x04: 'fence_in', 0x05: 'fence_out',
+    0x06: 'overspeed', 0x09: 'displacement', 0x0E: 'low_battery', 0x13: 'tamper',
+}
+# voltage level 0-6 as a rough battery percentage
+VOLTAGE_PERCENT = (0, 5, 15, 30, 50, 75, 100)
+
+
+def decode_status(fields):
+    """Decode a `STATUS` block: terminal info, voltage level, GSM level, alarm/language.
+
+    This block ends heartbeat (0x13), status (0x24) and alarm (0x16/0x26)
+    packets.
+    """
+    info, voltage, gsm, alarm_code, language = fields
+    # an explicit alarm code wins over the terminal-info alarm bits
+    alarm = ALARM_CODES.get(alarm_code) or TERMINAL_ALARMS.get((info >> 3) & 0x07)
+    if alarm_code and alarm is None:
+        alarm = f"alarm_0x{alarm_code:02x}"
+    return {
+        "armed": bool(info & 0x01),
+        "ignition": bool(info & 0x02),
+        "charging": bool(info & 0x04),
+        "gps_tracking": bool(info & 0x40),
+        "fuel_cut": bool(info & 0x80),
+        "voltage_level": voltage,
+        "battery_percent": VOLTAGE_PERCENT[voltage] if voltage < len(VOLTAGE_PERCENT) else None,
+        "gsm_level": min(gsm, 4),
+        "alarm": alarm,
+        "alarm_code": alarm_code,
+        "language": language,
+    }
+
+ACK_PROTOCOLS = (0x01, 0x12, 0x13, 0x16, 0x20, 0x22, 0x24, 0x26)
+VERIFY_CRC = getattr(settings, 'GT06_VERIFY_CRC', True)
+# protocol -> build(serial) for responses other than the plain acknowledgement
+RESPONDERS = {}
+
+def build_acknowledgment(protocol, serial=b'\x00\x00'):
+    """Return the response frame for `protocol`, or None if it is not acknowledged.
+
+    The response echoes the protocol number and the 2-byte information
+    serial number of the frame being acknowledged, followed by its CRC-ITU;
+    trackers resend frames whose response does not match.
+    """
+    if protocol not in ACK_PROTOCOLS:
         return None
+    body = bytes((0x05, protocol)) + serial
+    return START_SHORT + body + crc_itu(body).to_bytes(2, 'big') + STOP_BITS
+
+def _time_response(serial):
+    """Response to a time request (0x8A): the current UTC date and time."""
+    now = datetime.now(dt_timezone.utc)
+    body = bytes((0x0B, 0x8A, now.year - 2000, now.month, now.day, now.hour, now.minute, now.second)) + serial
+    return START_SHORT + body + crc_itu(body).to_bytes(2, 'big') + STOP_BITS
+
+RESPONDERS[0x8A] = _time_response
+
+def build_response(protocol, serial=b'\x00\x00'):
+    """Return the reply frame for a received `protocol` frame, or None."""
+    build = RESPONDERS.get(protocol)
+    if build is not None:
+        return build(serial)
+    return build_acknowledgment(protocol, serial)
 
-def send_acknowledgment(sock, protocol):
+def send_acknowledgment(sock, protocol, serial=b'\x00\x00'):
     """Send appropriate ACK."""
     try:
-        if protocol in [0x01, 0x12, 0x13, 0x16, 0x20, 0x22, 0x24, 0x26]:
-            ack = b'\x78\x78\x05\x01\x00\x00\x00\x00\x0D\x0A'
-        else:
-            ack = b'OK\n'
-        
-        sock.send(ack)
-        log.info(f"?? ACK sent for protocol 0x{protocol:02x}")
+        ack = build_response(protocol, serial)
+        if ack:
+            sock.send(ack)
+        log.debug("?? ACK sent for protocol 0x%02x", protocol)
         
     except Exception as e:
-        log.error(f"ACK error: {e}")
+        log.error("ACK error: %s", e)
+
+class DeviceSession:
+    """State of one tracker connection, owned by its thread or coroutine.
+
+    `send` writes raw bytes to this connection and is safe to call from any
+    thread, which is what downlink commands use.
+    """
+    __slots__ = ('ip', 'port', 'imei', 'veh_id', 'framer', 'send', 'last_serial',
+                 'command_serial', 'frames', 'crc_errors', 'connected_at', 'last_seen')
+
+    def __init__(self, ip, port, send=None):
+        self.ip = ip
+        self.port = port
+        self.imei = None
+        self.veh_id = None
+        self.framer = GT06Framer()
+        self.send = send
+        self.last_serial = None
+        self.command_serial = 0
+        self.frames = 0
+        self.crc_errors = 0
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+
+    def __repr__(self):
+        return f"<DeviceSession {self.imei or '?'} {self.ip}:{self.port}>"
+
+
+class SessionRegistry:
+    """Logged-in sessions by IMEI; one live session per tracker."""
+
+    def __init__(self):
+        self._by_imei = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_imei)
+
+    def bind(self, session, imei):
+        """Register `session` for `imei`, replacing an older (stale) connection."""
+        with self._lock:
+            if session.imei and session.imei != imei and self._by_imei.get(session.imei) is session:
+                del self._by_imei[session.imei]
+            previous = self._by_imei.get(imei)
+            self._by_imei[imei] = session
+        session.imei = imei
+        if previous is not None and previous is not session:
+            log_connection("?? %s reconnected from %s:%s, replacing %s:%s",
+                           imei, session.ip, session.port, previous.ip, previous.port)
+        return previous
+
+    def unbind(self, session):
+        """Forget `session` unless its IMEI has already logged in on a newer connection."""
+        with self._lock:
+            if session.imei and self._by_imei.get(session.imei) is session:
+                del self._by_imei[session.imei]
+
+    def get(self, imei):
+        return self._by_imei.get(imei)
+
+    def send_command(self, imei, command):
+        """Send a text command (protocol 0x80) to a connected tracker.
+
+        Returns False if the tracker is not connected here. The tracker
+        answers with a 0x15 packet that is logged as a command reply.
+        """
+        session = self.get(imei)
+        if session is None or session.send is None:
+            return False
+        session.command_serial = (session.command_serial + 1) & 0xFFFF
+        session.send(build_command(command, session.command_serial))
+        return True
+
+
+sessions = SessionRegistry()
+
+
+@metrics.collector
+def _collect_metrics():
+    SESSIONS.set(len(sessions))
+
+
+def build_command(command, serial, server_flag=0):
+    """Frame a protocol 0x80 online command."""
+    text = command.encode('ascii') if isinstance(command, str) else bytes(command)
+    content = bytes((4 + len(text),)) + server_flag.to_bytes(4, 'big') + text
+    body = bytes((len(content) + 5, 0x80)) + content + serial.to_bytes(2, 'big')
+    return START_SHORT + body + crc_itu(body).to_bytes(2, 'big') + STOP_BITS
 
-def handle_client_connection(sock, addr):
+
+def read_packet(data, session):
+    """Check and parse one frame from `session` without touching the database.
+
+    Return `(packet, ack)`: the parsed packet (None if the frame is dropped or
+    not understood) and the reply bytes (or None).
+    """
+    protocol = frame_protocol(data)
+    FRAMES.labels(PROTOCOL_LABELS[protocol]).inc()
+    session.frames += 1
+    session.last_seen = time.monotonic()
+    if VERIFY_CRC and not frame_crc_ok(data):
+        # not acknowledged, so the tracker sends the frame again
+        CRC_ERRORS.inc()
+        session.crc_errors += 1
+        log.warning("? CRC mismatch in 0x%02x frame from %r, dropped", protocol, session)
+        return None, None
+    session.last_serial = frame_serial(data)
+
+    packet = parse_gt06_packet(data)
+
+    if packet:
+        if packet.get('type') == 'login' and packet.get('imei'):
+            sessions.bind(session, packet['imei'])
+        elif session.imei:
+            # location, status and alarm packets carry no IMEI of their own
+            packet['imei'] = session.imei
+    else:
+        UNPARSED.labels(PROTOCOL_LABELS[protocol]).inc()
+        log.debug("? Unparsed 0x%02x frame from %r", protocol, session)
+
+    # well-formed frames of known protocols are acknowledged even when not
+    # stored (e.g. no GPS fix) so the tracker does not resend them
+    ack = build_response(protocol, session.last_serial)
+    if ack:
+        log.debug("?? ACK for protocol 0x%02x", protocol)
+    return packet, ack
+
+def store_packet(packet, session):
+    """Resolve a login's vehicle and save `packet` (uses the Django ORM)."""
+    if packet.get('type') == 'login' and packet.get('imei'):
+        try:
+            entry = imei_cache.lookup(packet['imei'])
+        except Exception:
+            # the login is still acknowledged; fixes look the IMEI up again
+            log.exception("? IMEI lookup failed for %s, treating it as unknown for now", packet['imei'])
+            entry = None
+        session.veh_id = entry.veh_id if entry else None
+        log_connection("? Registered: %s:%s -> %s", session.ip, session.port, packet['imei'])
+
+    save_gps_data(packet)
+    log_frame("?? %r: %s", session, packet)
+
+def handle_packet(data, session):
+    """Parse and store one frame from `session`; return the reply bytes (or None)."""
+    started = time.perf_counter()
+    packet, ack = read_packet(data, session)
+    if packet:
+        store_packet(packet, session)
+    HANDLE_SECONDS.observe(time.perf_counter() - started)
+    return ack
+
+def handle_client_connection(sock, addr, idle_timeout=None):
     """Handle device connection."""
     ip, port = addr
-    log.info(f"?? CONNECTED: {ip}:{port}")
+    CONNECTS.inc()
+    CONNECTIONS.inc()
+    log_connection("?? CONNECTED: %s:%s", ip, port)
+    reason = 'closed'
+    if idle_timeout:
+        sock.settimeout(idle_timeout)
+    send_lock = threading.Lock()
+
+    def send(data):
+        # replies (this thread) and downlink commands (other threads) share the socket
+        with send_lock:
+            sock.sendall(data)
+
+    session = DeviceSession(ip, port, send)
+    framer = session.framer
     
     try:
         while True:
-            data = sock.recv(1024)
-            if not data:
+            n = sock.recv_into(framer.writable())
+            if not n:
                 break
-            
-            # Parse packet
-            packet = parse_gt06_packet(data)
-            
-            if packet:
-                # Store IMEI from login
-                if packet.get('type') == 'login' and packet.get('imei'):
-                    device_imei[ip] = packet['imei']
-                    log.info(f"? Registered: {ip} -> {packet['imei']}")
-                
-                # Add IMEI to location packets
-                if packet.get('type') == 'location' and ip in device_imei:
-                    packet['imei'] = device_imei[ip]
-                
-                # Save data
-                save_gps_data(packet)
-                
-                # Send ACK
-                protocol = data[3] if len(data) > 3 else 0
-                send_acknowledgment(sock, protocol)
-                
-            else:
-                # Unknown data
-                log.warning(f"? Unknown data from {ip}")
-                sock.send(b'OK\n')
+            framer.commit(n)
+
+            for frame in framer.frames():
+                reply = handle_packet(frame, session)
+                if reply:
+                    send(reply)
                 
+    except socket.timeout:
+        reason = 'idle'
+        log_connection("?? Idle timeout: %s", ip)
     except ConnectionResetError:
-        log.info(f"?? Connection reset by {ip}")
-    except Exception as e:
-        log.error(f"? Error: {e}")
+        reason = 'reset'
+        log_connection("?? Connection reset by %s", ip)
+    except Exception:
+        reason = 'error'
+        log.exception("? Error on connection from %s:%s", ip, port)
     finally:
-        if ip in device_imei:
-            del device_imei[ip]
+        sessions.unbind(session)
         sock.close()
-        log.info(f"?? DISCONNECTED: {ip}")
+        CONNECTIONS.dec()
+        DISCONNECTS.labels(reason).inc()
+        log_connection("?? DISCONNECTED: %s", ip)
+
+async def handle_client_connection_async(reader, writer, idle_timeout=None):
+    """Handle device connection as a coroutine on the server event loop.
+
+    Frames are checked, parsed and acknowledged on the loop; storing them
+    (which touches the Django ORM) runs on the loop's bounded executor so a
+    slow database neither delays the ACKs nor blocks other trackers.
+    """
+    ip, port = writer.get_extra_info('peername')[:2]
+    loop = asyncio.get_running_loop()
+    CONNECTS.inc()
+    CONNECTIONS.inc()
+    log_connection("?? CONNECTED: %s:%s", ip, port)
+    reason = 'closed'
+    session = DeviceSession(ip, port, lambda data: loop.call_soon_threadsafe(writer.write, data))
+    framer = session.framer
+
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(reader.read(1024), idle_timeout)
+            except asyncio.TimeoutError:
+                reason = 'idle'
+                log_connection("?? Idle timeout: %s", ip)
+                break
+            if not data:
+                break
+            framer.feed(data)
+
+            for frame in framer.frames():
+                started = time.perf_counter()
+                packet, reply = read_packet(frame, session)
+                if reply:
+                    writer.write(reply)
+                if packet:
+                    # one frame at a time, so a tracker's fixes are stored in order
+                    await loop.run_in_executor(None, store_packet, packet, session)
+                HANDLE_SECONDS.observe(time.perf_counter() - started)
+            await writer.drain()
+
+    except ConnectionResetError:
+        reason = 'reset'
+        log_connection("?? Connection reset by %s", ip)
+    except Exception:
+        reason = 'error'
+        log.exception("? Error on connection from %s:%s", ip, port)
+    finally:
+        sessions.unbind(session)
+        writer.close()
+        CONNECTIONS.dec()
+        DISCONNECTS.labels(reason).inc()
+        log_connection("?? DISCONNECTED: %s", ip)
+
+def _raise_nofile_limit(wanted):
+    """Raise the soft open-files limit towards `wanted` (capped by the hard limit)."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        if soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            log.info("?? Open files limit raised: %s -> %s", soft, target)
+    except Exception as e:
+        log.warning("?? Could not raise open files limit: %s", e)
+
+def start_gps_server(host='0.0.0.0', port=6789, backlog=None, idle_timeout=None):
+    """Start GPS server (one thread per connection)."""
+    backlog = backlog or getattr(settings, 'GT06_LISTEN_BACKLOG', 1024)
+    idle_timeout = idle_timeout or getattr(settings, 'GT06_IDLE_TIMEOUT', None)
 
-def start_gps_server(host='0.0.0.0', port=6789):
-    """Start GPS server."""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     
     try:
         server.bind((host, port))
-        server.listen(5)
-        log.info(f"?? GPS Server started on {host}:{port}")
-        log.info(f"?? Data file: {DATA_FILE}")
+        server.listen(backlog)
+        log.info("?? GPS Server started on %s:%s", host, port)
+        log.info("?? Event log: %s", EVENT_LOG_DIR)
         log.info("?? Coordinates verified with SMS: Lat:N23.867976,Lon:E90.390219")
         log.info("?? Waiting for device connections...")
         
@@ -373,23 +943,112 @@ def start_gps_server(host='0.0.0.0', port=6789):
             client_sock, client_addr = server.accept()
             client_thread = threading.Thread(
                 target=handle_client_connection,
-                args=(client_sock, client_addr)
+                args=(client_sock, client_addr, idle_timeout)
             )
             client_thread.daemon = True
             client_thread.start()
             
     except KeyboardInterrupt:
         log.info("?? Server stopping...")
-    except Exception as e:
-        log.error(f"? Server error: {e}")
+    except Exception:
+        log.exception("? Server error")
     finally:
         server.close()
 
+async def serve_async(host, port, backlog, idle_timeout, max_connections, db_workers):
+    """Run the asyncio GPS server until cancelled."""
+    loop = asyncio.get_running_loop()
+    # bounded pool for the blocking ORM work done by handle_packet
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix='gt06-db'))
+
+    active = set()
+
+    async def on_connect(reader, writer):
+        if len(active) >= max_connections:
+            peer = writer.get_extra_info('peername')
+            DISCONNECTS.labels('rejected').inc()
+            log_connection("?? Connection limit (%d) reached, rejecting %s", max_connections, peer)
+            writer.close()
+            return
+        task = asyncio.current_task()
+        active.add(task)
+        try:
+            await handle_client_connection_async(reader, writer, idle_timeout)
+        finally:
+            active.discard(task)
+
+    server = await asyncio.start_server(
+        on_connect, host, port,
+        backlog=backlog,
+        reuse_address=True,
+        limit=4096,  # small per-connection read buffer; GT06 frames are < 1 KB
+    )
+    log.info("?? Async GPS Server started on %s:%s (backlog=%s, max_connections=%s, idle_timeout=%s)",
+             host, port, backlog, max_connections, idle_timeout)
+    log.info("?? Event log: %s", EVENT_LOG_DIR)
+    log.info("?? Waiting for device connections...")
+    async with server:
+        await server.serve_forever()
+
+def start_gps_server_async(host='0.0.0.0', port=6789, backlog=None, idle_timeout=None,
+                           max_connections=None, db_workers=None):
+    """Start GPS server with all connections multiplexed on one asyncio loop."""
+    backlog = backlog or getattr(settings, 'GT06_LISTEN_BACKLOG', 1024)
+    idle_timeout = idle_timeout or getattr(settings, 'GT06_IDLE_TIMEOUT', None)
+    max_connections = max_connections or getattr(settings, 'GT06_MAX_CONNECTIONS', 25000)
+    db_workers = db_workers or getattr(settings, 'GT06_DB_WORKERS', 8)
+
+    _raise_nofile_limit(max_connections + 256)
+    try:
+        asyncio.run(serve_async(host, port, backlog, idle_timeout, max_connections, db_workers))
+    except KeyboardInterrupt:
+        log.info("?? Server stopping...")
+    except Exception:
+        log.exception("? Server error")
+
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='GT06 GPS server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=6789)
+    parser.add_argument('--mode', choices=['thread', 'asyncio'],
+                        default=getattr(settings, 'GT06_SERVER_MODE', 'thread'),
+                        help='thread: one thread per tracker; asyncio: single event loop')
+    parser.add_argument('--backlog', type=int, help='listen() backlog')
+    parser.add_argument('--idle-timeout', type=float, help='seconds of silence before a tracker is dropped')
+    parser.add_argument('--max-connections', type=int, help='asyncio mode: concurrent tracker limit')
+    parser.add_argument('--db-workers', type=int, help='asyncio mode: threads for database writes')
+    parser.add_argument('--last', type=int, metavar='N', help='print the last N logged events and exit')
+    parser.add_argument('--metrics-port', type=int, default=getattr(settings, 'GT06_METRICS_PORT', 0),
+                        help='serve /metrics on this port (0: off)')
+    args = parser.parse_args()
+
+    if args.last:
+        ring_path = os.path.join(EVENT_LOG_DIR, 'last_events.ring')
+        try:
+            ring = EventRing.open_readonly(ring_path)
+        except FileNotFoundError:
+            sys.exit(f"No event ring at {ring_path} (is GT06_EVENT_RING_SLOTS set on the server?)")
+        except (OSError, ValueError) as e:
+            sys.exit(f"Cannot read event ring: {e}")
+        for line in ring.last(args.last):
+            print(line.decode(errors='replace'))
+        sys.exit(0)
+
     print("\n" + "="*60)
     print("GT06 GPS SERVER - BANGLADESH")
     print("Coordinates verified with SMS data")
-    print(f"Port: 6789 | Data: {DATA_FILE}")
+    print(f"Port: {args.port} | Mode: {args.mode} | Events: {EVENT_LOG_DIR}")
     print("="*60 + "\n")
-    
-    start_gps_server()
\ No newline at end of file
+
+    # before any connection thread can race to open it
+    open_event_log()
+
+    if args.metrics_port:
+        metrics.serve(args.host, args.metrics_port)
+
+    if args.mode == 'asyncio':
+        start_gps_server_async(args.host, args.port, args.backlog, args.idle_timeout,
+                               args.max_connections, args.db_workers)
+    else:
+        start_gps_server(args.host, args.port, args.backlog, args.idle_timeout)
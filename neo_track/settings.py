@@ -141,3 +141,101 @@ SAPI_AUTH_KEYS = ["SAUTH"]
 ELASTICSEARCH_DSN = ""  # set to e.g. 'http://localhost:9200' to enable ES writes
 SAPI_WS_PUSH_URL = ""  # optional HTTP endpoint to POST cast objects to (external WS bridge)
 REDIS_URL = ""  # optional redis:// URL to publish cast messages
+
+# GT06 TCP server (gt06_server.py)
+GT06_SERVER_MODE = "thread"  # 'thread' (one thread per tracker) or 'asyncio' (single event loop)
+GT06_LISTEN_BACKLOG = 1024
+GT06_IDLE_TIMEOUT = 600  # seconds without data before a tracker connection is dropped
+GT06_MAX_CONNECTIONS = 25000  # asyncio mode only
+GT06_DB_WORKERS = 8  # asyncio mode: threads running the blocking ORM writes
+GT06_VERIFY_CRC = True  # drop (and do not acknowledge) frames with a bad CRC-ITU
+
+# Write-behind persistence for ingest (devices/ingest_writer.py)
+INGEST_WRITE_BEHIND = True  # False: write each fix synchronously
+INGEST_BATCH_SIZE = 500  # flush after this many queued items...
+INGEST_FLUSH_INTERVAL = 1.0  # ...or after this many seconds
+INGEST_MAX_PENDING = 50000  # queue bound; producers wait, then drop
+INGEST_PUT_TIMEOUT = 0.5  # seconds a producer waits on a full queue
+INGEST_USE_COPY = False  # PostgreSQL + psycopg 3: insert history with COPY
+
+# IMEI -> vehicle/device resolution cache (devices/imei_cache.py)
+IMEI_CACHE_SIZE = 20000
+IMEI_CACHE_TTL = 300  # seconds; bounds staleness across processes
+IMEI_CACHE_NEGATIVE_TTL = 60  # seconds an unknown IMEI stays cached
+
+# GT06 raw event log (devices/event_log.py)
+GT06_EVENT_LOG_DIR = "/home/neo_track/gps_events"
+GT06_EVENT_LOG_SEGMENT_BYTES = 64 * 1024 * 1024
+GT06_EVENT_LOG_SEGMENTS = 20  # rotated segments kept on disk
+GT06_EVENT_LOG_FSYNC_INTERVAL = 1.0  # seconds between group-commit fsyncs
+GT06_EVENT_RING_SLOTS = 1000  # mmap'd "last N events" ring; 0 disables it
+
+# Cast publisher (devices/sapi_broadcaster.py)
+SAPI_SOCKETIO_URL = ""  # Socket.IO bridge; default http://127.0.0.1:6791
+SAPI_CAST_QUEUE_SIZE = 10000  # casts buffered while the bridge is slow/unreachable
+SAPI_CAST_BATCH_SIZE = 200  # max casts per emitted batch
+SAPI_CAST_BACKEND = "socketio"  # 'socketio', 'redis' (uses REDIS_URL; run many bridge workers) or 'inprocess'
+SAPI_CAST_CHANNEL = "sapi:casts"  # redis pub/sub channel shared by publishers and bridge workers
+
+# Last known position per vehicle (vehicles/latest_positions.py)
+LATEST_POSITION_MIRROR = "memory"  # 'redis': share the mirror with web workers via REDIS_URL
+LATEST_POSITION_KEY = "vehicles:latest"  # redis hash of veh_id -> position JSON
+VEHICLE_INACTIVE_AFTER = 3600  # seconds without a fix before a vehicle counts as inactive
+VEHICLE_OVERSPEED_KMH = 80
+
+# Track simplification (vehicles/track.py)
+TRACK_DEFAULT_HOURS = 24  # window shown when no start/end is given
+TRACK_DEFAULT_ZOOM = 14  # map zoom the first render is simplified for
+TRACK_MAX_RAW_POINTS = 20000  # time-bucket cap before Douglas-Peucker
+TRACK_MAX_POINTS = 2000  # cap on points sent to the browser
+
+# Trip / odometer engine (vehicles/trips.py, manage.py update_odometers)
+ODOMETER_SOURCE = "computed"  # 'device': keep the odometer the tracker reports instead
+ODOMETER_MAX_LOOKBACK_DAYS = 7  # update_odometers never reads further back for a vehicle; 0: no limit
+TRIP_MAX_SPEED_KMH = 200  # fixes implying a faster jump are dropped as GPS noise
+TRIP_STOP_SPEED_KMH = 3  # at or below this a segment counts as stationary
+TRIP_MIN_MOVE_M = 50  # displacement needed to count as moving without a reported speed
+TRIP_MIN_STOP_SECONDS = 180  # shorter stationary runs are not reported as stops
+TRIP_MAX_GAP_SECONDS = 600  # time across longer gaps is neither moving nor stopped
+ROLLUP_LOOKBACK_DAYS = 1  # days before today that the rollup catch-up job rebuilds
+
+# Geofences (devices/geofences.py)
+GEOFENCE_ENABLED = True  # check every ingested fix against the client's fences
+GEOFENCE_CELL_DEG = 0.05  # grid cell size of the in-memory fence index
+GEOFENCE_REFRESH_INTERVAL = 60  # seconds between polls for fences changed by other processes
+GEOFENCE_STORE_EVENTS = True  # also queue GeofenceEvent rows on the ingest writer
+
+# Offline reverse geocoding (devices/reverse_geocoder.py, manage.py geocode_vehicles)
+GEOCODER_PLACES_FILE = ""  # GeoNames dump (*.txt) or name,lat,lon[,area] CSV; empty disables it
+GEOCODER_MAX_DISTANCE_M = 5000  # farther from every place the text stays empty
+GEOCODER_CACHE_SIZE = 50000  # quantized coordinates kept in the LRU
+GEOCODER_CACHE_PRECISION = 3  # decimals the cache key is rounded to (~110 m)
+GEOCODER_REFRESH_DISTANCE_M = 250  # re-geocode a vehicle only after it moved this far
+
+# Alarm rules (devices/alarms.py)
+ALARMS_ENABLED = True  # raise VehicleAlarm events from tracker alarms, ignition and overspeed
+ALARM_DEDUP_SECONDS = 300  # the same alarm of a vehicle is raised at most once per window
+
+# Elasticsearch bulk indexing (devices/es_indexer.py, manage.py setup_elasticsearch)
+ES_REQUEST_TIMEOUT = 10  # seconds per bulk request
+ES_BULK_SIZE = 500  # documents per bulk request...
+ES_FLUSH_INTERVAL = 2.0  # ...or after this many seconds
+ES_MAX_PENDING = 20000  # queue bound; further documents are dropped
+ES_MAX_RETRIES = 3  # retries of a failed request or of 429/5xx documents
+ES_RETRY_BACKOFF = 1.0  # seconds before the first retry, doubled for each next one
+ES_DOWN_SECONDS = 30  # after a batch exhausts its retries, dead-letter without trying for this long
+ES_DEAD_LETTER_FILE = "/home/neo_track/es_dead_letter.jsonl"  # empty: drop what cannot be indexed
+ES_DEAD_LETTER_MAX_BYTES = 256 * 1024 * 1024
+ES_INSTALL_TEMPLATES = True  # put the index templates before the first bulk request
+ES_REFRESH_INTERVAL = "30s"  # index refresh interval set by the templates
+ES_NUMBER_OF_REPLICAS = 1
+
+# Columnar location history (vehicles/history_store.py, manage.py history_store)
+HISTORY_BACKEND = "db"  # 'columnar': history only in HISTORY_STORE_DIR; 'both': also keep VehicleLocation rows
+HISTORY_STORE_DIR = ""  # e.g. "/home/neo_track/history"; required unless HISTORY_BACKEND = 'db'
+
+# Metrics (devices/metrics.py): /metrics on Django, the Socket.IO bridge and the GT06 server
+METRICS_TOKEN = ""  # when set, scrapes must send "Authorization: Bearer <token>"
+GT06_METRICS_PORT = 0  # GT06 server /metrics port (also --metrics-port); 0 disables it
+GT06_LOG_SAMPLE = 10000  # log one in N decoded frames at INFO (0: none, 1: all); DEBUG logs all
+GT06_CONNECTION_LOG_SAMPLE = 100  # same for connect/login/disconnect and unstored-fix lines
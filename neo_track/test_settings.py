@@ -0,0 +1,29 @@
+"""Settings for the test suite (pytest.ini): SQLite and no external services."""
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# Each test controls writes through its own IngestWriter; the process-wide
+# one writes synchronously so nothing is left in a queue between tests.
+INGEST_WRITE_BEHIND = False
+
+# casts stay in this process; there is no Socket.IO bridge to connect to
+SAPI_CAST_BACKEND = 'inprocess'
+
+GT06_EVENT_LOG_DIR = tempfile.mkdtemp(prefix='neotrack-test-events-')
+GT06_EVENT_RING_SLOTS = 16
+
+ELASTICSEARCH_DSN = ''
+ES_DEAD_LETTER_FILE = ''
+HISTORY_BACKEND = 'db'
+LATEST_POSITION_MIRROR = 'memory'
+GEOCODER_PLACES_FILE = ''
+GEOFENCE_REFRESH_INTERVAL = None
+METRICS_TOKEN = ''
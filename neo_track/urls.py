@@ -17,8 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 
+from devices.views import prometheus_metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', prometheus_metrics, name='metrics'),
     path("", include("dashboard.urls")),
     path("devices/", include("devices.urls")),
     path("vehicles/", include("vehicles.urls")),
@@ -0,0 +1,125 @@
+"""Throughput benchmark for the cast bus: casts/s vs number of bridge workers.
+
+Usage:
+  python scripts/bench_cast_bus.py --backend inprocess --workers 1 2 4 8
+  python scripts/bench_cast_bus.py --backend redis --redis-url redis://127.0.0.1:6379/0
+
+Each worker subscribes to the bus and JSON-encodes every cast it receives
+(roughly what a Socket.IO emit costs). Redis workers are separate processes,
+like real bridge workers; in-process workers are threads. The publisher
+sends `--casts` casts in batches of `--batch`, and the run ends when every
+worker has received all of them.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from devices.cast_bus import InProcessCastBus, RedisCastBus  # noqa: E402
+
+
+def make_cast(i):
+    return {
+        'type': 'location',
+        'imei': f'35933907501{i % 10000:04d}',
+        'vehicle': i % 5000,
+        'data': {'lat': 23.8 + (i % 100) * 1e-4, 'lon': 90.4, 'speed': 42.0, 'satCnt': 9},
+        'status': 'moving',
+    }
+
+
+def _counting_handler(total, done):
+    received = [0]
+
+    def handler(casts):
+        for cast in casts:
+            json.dumps(cast)
+        received[0] += len(casts)
+        if received[0] >= total:
+            done()
+    return handler
+
+
+def _redis_worker(url, channel, total, ready, results):
+    bus = RedisCastBus(url, channel)
+    finished = threading.Event()
+    sub = bus.subscribe(_counting_handler(total, finished.set))
+    ready.put(True)
+    finished.wait()
+    results.put(time.time())  # wall clock: comparable across processes
+    sub.close()
+
+
+def run(backend, workers, casts, batch, url, channel):
+    payload = [make_cast(i) for i in range(batch)]
+    batches = max(casts // batch, 1)
+    total = batches * batch
+
+    if backend == 'redis':
+        bus = RedisCastBus(url, channel)
+        ctx = mp.get_context('spawn')
+        ready, results = ctx.Queue(), ctx.Queue()
+        procs = [ctx.Process(target=_redis_worker, args=(url, channel, total, ready, results))
+                 for _ in range(workers)]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.get()
+        time.sleep(0.2)  # let the subscriptions settle
+        start = time.time()
+        for _ in range(batches):
+            bus.publish_many(payload)
+        published = time.time()
+        end = max(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+    else:
+        bus = InProcessCastBus(max_queue=batches + 1)
+        remaining = threading.Semaphore(0)
+        subs = [bus.subscribe(_counting_handler(total, remaining.release)) for _ in range(workers)]
+        start = time.perf_counter()
+        for _ in range(batches):
+            bus.publish_many(payload)
+        published = time.perf_counter()
+        for _ in range(workers):
+            remaining.acquire()
+        end = time.perf_counter()
+        for sub in subs:
+            sub.close()
+
+    elapsed = end - start
+    return {
+        'workers': workers,
+        'casts': total,
+        'publish_per_s': total / (published - start),
+        'delivered_per_s': total * workers / elapsed,
+        'seconds': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['inprocess', 'redis'], default='inprocess')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--casts', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--redis-url', default=os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'))
+    parser.add_argument('--channel', default='sapi:casts:bench')
+    args = parser.parse_args()
+
+    print(f'backend={args.backend} casts={args.casts} batch={args.batch}')
+    print(f"{'workers':>8} {'publish/s':>12} {'delivered/s':>12} {'seconds':>8}")
+    for n in args.workers:
+        r = run(args.backend, n, args.casts, args.batch, args.redis_url, args.channel)
+        print(f"{r['workers']:>8} {r['publish_per_s']:>12,.0f} {r['delivered_per_s']:>12,.0f} {r['seconds']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
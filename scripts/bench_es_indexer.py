@@ -0,0 +1,157 @@
+"""Benchmark the bulk indexer (devices/es_indexer.py) against a stub Elasticsearch.
+
+Usage:
+  python scripts/bench_es_indexer.py --docs 20000
+  python scripts/bench_es_indexer.py --docs 5000 --reject 0.05 --latency 0.002
+  python scripts/bench_es_indexer.py --docs 2000 --down --dead-letter /tmp/es_dead.jsonl
+
+Starts a local HTTP server that answers like Elasticsearch (`_bulk`,
+`_doc`, `_index_template`), then sends `--docs` location documents:
+
+- one `index()` call per document, as `writelocation` used to;
+- through `BulkIndexer`.
+
+`--reject` makes the stub answer that fraction of bulk items with 429 (retried
+by the indexer); `--latency` adds a delay per request, like a remote
+cluster; `--down` makes every request fail with 503, so documents end up
+in `--dead-letter`. Nothing is stored.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from elasticsearch import Elasticsearch  # noqa: E402
+
+from devices.es_indexer import LOCATIONS_INDEX, BulkIndexer  # noqa: E402
+
+
+class StubState:
+    def __init__(self, reject=0.0, latency=0.0, down=False, seed=1):
+        self.reject = reject
+        self.latency = latency
+        self.down = down
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.docs = 0
+        self.templates = set()
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            with state.lock:
+                state.requests += 1
+            if state.latency:
+                time.sleep(state.latency)
+            if state.down:
+                return self._reply(503, {'error': 'stub cluster down', 'status': 503})
+            path = self.path.split('?')[0]
+            if path.startswith('/_index_template/'):
+                state.templates.add(path.rsplit('/', 1)[1])
+                return self._reply(200, {'acknowledged': True})
+            if path.endswith('/_bulk'):
+                lines = [line for line in body.split(b'\n') if line]
+                items, errors = [], False
+                for action in lines[0::2]:
+                    index = json.loads(action)['index'].get('_index')
+                    with state.lock:
+                        rejected = state.rng.random() < state.reject
+                        if not rejected:
+                            state.docs += 1
+                    if rejected:
+                        errors = True
+                        items.append({'index': {'_index': index, 'status': 429,
+                                                'error': {'type': 'es_rejected_execution_exception'}}})
+                    else:
+                        items.append({'index': {'_index': index, 'status': 201, 'result': 'created'}})
+                return self._reply(200, {'took': 1, 'errors': errors, 'items': items})
+            if '/_doc' in path:
+                with state.lock:
+                    state.docs += 1
+                return self._reply(201, {'_index': path.split('/')[1], 'result': 'created'})
+            return self._reply(200, {'version': {'number': '9.0.0'}, 'tagline': 'You Know, for Search'})
+
+        do_GET = do_POST = do_PUT = _handle
+
+    return Handler
+
+
+def docs(n):
+    for i in range(n):
+        lat, lon = 23.8 + (i % 1000) * 1e-4, 90.4 + (i % 997) * 1e-4
+        yield {'veh_id': i % 5000, 'imei': f'35500000{i % 5000:07d}', 'location': {'lat': lat, 'lon': lon},
+               'lat': lat, 'lon': lon, 'speed': 42.0, 'time': '2026-10-18T08:30:15+00:00'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--single', type=int, default=2000, help='documents sent one request each (0: skip)')
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--reject', type=float, default=0.0, help='fraction of bulk items answered with 429')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every stub request')
+    parser.add_argument('--down', action='store_true', help='answer every request with 503')
+    parser.add_argument('--dead-letter', default='')
+    args = parser.parse_args()
+
+    state = StubState(args.reject, args.latency, args.down)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = Elasticsearch(f'http://127.0.0.1:{server.server_port}', max_retries=0, request_timeout=10)
+
+    if args.single and not args.down:
+        started = time.perf_counter()
+        for doc in docs(args.single):
+            client.index(index=LOCATIONS_INDEX, document=doc)
+        elapsed = time.perf_counter() - started
+        print(f'single: {args.single} docs, {args.single / elapsed:,.0f} docs/s')
+
+    indexer = BulkIndexer(client_factory=lambda: client, batch_size=args.batch, flush_interval=0.2,
+                          max_pending=args.docs + 1, max_retries=3, backoff=0.05,
+                          dead_letter_file=args.dead_letter, down_seconds=30)
+    state.requests = state.docs = 0
+    started = time.perf_counter()
+    for doc in docs(args.docs):
+        indexer.index(LOCATIONS_INDEX, doc)
+    indexer.flush()
+    elapsed = time.perf_counter() - started
+    stats = indexer.stats
+    print(f'bulk:   {args.docs} docs, {args.docs / elapsed:,.0f} docs/s, {state.requests} requests, '
+          f'{stats["indexed"]} indexed, {stats["dead_lettered"]} dead-lettered, {stats["dropped"]} dropped, '
+          f'templates {sorted(state.templates)}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""In-memory benchmark for the geofence engine (devices/geofences.py).
+
+Usage:
+  python scripts/bench_geofences.py --fences 10000 --vehicles 5000 --fixes 200000
+  python scripts/bench_geofences.py --fences 10000 --clients 100 --linear 2000
+
+Builds `--fences` random circle/polygon fences over an area of about
+`--area` degrees square around Dhaka (split over `--clients` clients), then
+moves `--vehicles` vehicles on random walks through it and times
+`GeofenceEngine.check()` per fix. Nothing is read from or written to the
+database. `--linear N` also times N fixes checked against every fence, the
+cost the grid index avoids.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from devices.geofences import GeofenceEngine, prepare  # noqa: E402
+from vehicles.models import Geofence  # noqa: E402
+
+LAT0, LON0 = 23.8, 90.4
+
+
+def make_fences(n, area, clients, rng):
+    fences = []
+    for i in range(1, n + 1):
+        lat = LAT0 + rng.uniform(-area / 2, area / 2)
+        lon = LON0 + rng.uniform(-area / 2, area / 2)
+        radius = rng.uniform(100, 2000)
+        client_id = rng.randrange(clients) + 1 if clients else None
+        if i % 2:
+            fences.append(Geofence(pk=i, client_id=client_id, name=f'c{i}', kind=Geofence.Kind.CIRCLE,
+                                   center_lat=lat, center_lon=lon, radius_m=radius))
+        else:
+            k = rng.randint(4, 12)
+            r = radius / 111320.0
+            points = [[lat + r * math.sin(2 * math.pi * j / k) * rng.uniform(0.5, 1.0),
+                       lon + r * math.cos(2 * math.pi * j / k) * rng.uniform(0.5, 1.0)] for j in range(k)]
+            fences.append(Geofence(pk=i, client_id=client_id, name=f'p{i}', kind=Geofence.Kind.POLYGON,
+                                   points=points))
+    return fences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fences', type=int, default=10000)
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--fixes', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=0, help='spread fences over N clients (0: shared)')
+    parser.add_argument('--area', type=float, default=1.0, help='side of the square area in degrees')
+    parser.add_argument('--cell', type=float, default=0.05, help='grid cell size in degrees')
+    parser.add_argument('--linear', type=int, default=0, help='also time N fixes with a linear scan')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fences = make_fences(args.fences, args.area, args.clients, rng)
+    engine = GeofenceEngine(cell_deg=args.cell, refresh_interval=None, seed_state=False)
+    started = time.perf_counter()
+    for f in fences:
+        engine.set_fence(f)
+    print(f'indexed {len(engine)} fences in {time.perf_counter() - started:.2f}s '
+          f'(cell {args.cell} deg)')
+
+    half = args.area / 2
+    pos = [(LAT0 + rng.uniform(-half, half), LON0 + rng.uniform(-half, half),
+            rng.randrange(args.clients) + 1 if args.clients else None) for _ in range(args.vehicles)]
+    fixes = []
+    for n in range(args.fixes):
+        v = n % args.vehicles
+        lat, lon, client_id = pos[v]
+        lat = min(max(lat + rng.gauss(0, 0.002), LAT0 - half), LAT0 + half)
+        lon = min(max(lon + rng.gauss(0, 0.002), LON0 - half), LON0 + half)
+        pos[v] = (lat, lon, client_id)
+        fixes.append((v, client_id, lat, lon))
+
+    events = 0
+    started = time.perf_counter()
+    for v, client_id, lat, lon in fixes:
+        entered, exited = engine.check(v, client_id, lat, lon)
+        events += len(entered) + len(exited)
+    elapsed = time.perf_counter() - started
+    print(f'grid:   {len(fixes)} fixes, {len(fixes) / elapsed:,.0f} fixes/s, '
+          f'{elapsed / len(fixes) * 1e6:.1f} us/fix, '
+          f'{engine.stats["candidates"] / len(fixes):.1f} candidates/fix, {events} events')
+
+    if args.linear:
+        prepared = [prepare(f)[0] for f in fences]
+        sample = fixes[:args.linear]
+        started = time.perf_counter()
+        for _, client_id, lat, lon in sample:
+            [f.id for f in prepared
+             if (f.client_id is None or f.client_id == client_id) and f.contains(lat, lon)]
+        elapsed = time.perf_counter() - started
+        print(f'linear: {len(sample)} fixes, {len(sample) / elapsed:,.0f} fixes/s, '
+              f'{elapsed / len(sample) * 1e6:.1f} us/fix')
+
+
+if __name__ == '__main__':
+    main()
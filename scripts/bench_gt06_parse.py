@@ -0,0 +1,110 @@
+"""Single-core micro-benchmark of GT06 frame decoding.
+
+Usage:
+  python scripts/bench_gt06_parse.py
+  python scripts/bench_gt06_parse.py --module /tmp/gt06_server_old.py --frames 200000
+
+Decodes a fixed mix of frames (mostly 0x22/0x12 locations and 0x13
+heartbeats, plus logins, alarms, LBS, WiFi, information and time
+requests) with `--module`'s CRC check, `parse_gt06_packet()` and response
+builder, and prints packets/s. Nothing is stored. To compare with an older
+revision:
+
+  git show <rev>:gt06_server.py > /tmp/gt06_server_old.py
+  python scripts/bench_gt06_parse.py --module /tmp/gt06_server_old.py
+
+Logging is set to `--log-level` (WARNING by default, i.e. per-packet
+messages disabled, as in production).
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('gt06_bench_target', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _crc(data):
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    return crc ^ 0xFFFF
+
+
+def frame(protocol, content, serial):
+    body = bytes((len(content) + 5, protocol)) + content + serial.to_bytes(2, 'big')
+    return b'\x78\x78' + body + _crc(body).to_bytes(2, 'big') + b'\r\n'
+
+
+def sample_frames():
+    now = datetime(2026, 10, 18, 8, 30, 15)
+    dt = bytes((now.year - 2000, now.month, now.day, now.hour, now.minute, now.second))
+    lat, lon = int(23.867976 * 1800000), int(90.390219 * 1800000)
+    gps = dt + bytes((0xC9,)) + lat.to_bytes(4, 'big') + lon.to_bytes(4, 'big') + bytes((42,)) \
+        + (0x1400 | 123).to_bytes(2, 'big')
+    lbs = (470).to_bytes(2, 'big') + bytes((1,)) + (0x1D2A).to_bytes(2, 'big') + (0x00C0FE).to_bytes(3, 'big')
+    cells = lbs + bytes((60,)) + b''.join((0x1D2A + i).to_bytes(2, 'big') + (0x100 + i).to_bytes(3, 'big')
+                                          + bytes((50 - i,)) for i in range(6))
+    status = bytes((0x46, 5, 4, 0x00, 0x02))
+    return [
+        (60, frame(0x22, gps + lbs + bytes((1, 0, 1)), 1)),
+        (15, frame(0x12, gps + lbs, 2)),
+        (15, frame(0x13, status, 3)),
+        (2, frame(0x01, bytes.fromhex('0355000000000001'), 4)),
+        (2, frame(0x16, gps + bytes((9,)) + lbs + status, 5)),
+        (2, frame(0x28, dt + cells + bytes((1, 0, 2)), 6)),
+        (2, frame(0x2C, dt + cells + bytes((1, 2)) + bytes.fromhex('a0b1c2d3e4f5') + bytes((70,))
+                  + bytes.fromhex('001122334455') + bytes((80,)), 7)),
+        (1, frame(0x94, bytes((0x00,)) + (1250).to_bytes(2, 'big'), 8)),
+        (1, frame(0x8A, b'', 9)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default=os.path.join(BASE_DIR, 'gt06_server.py'))
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    mod = load_module(args.module)
+    logging.getLogger().setLevel(args.log_level)
+    mod.log.setLevel(args.log_level)
+    crc_ok = getattr(mod, 'frame_crc_ok', None)
+    respond = getattr(mod, 'build_response', None) or mod.build_acknowledgment
+
+    mix = []
+    for weight, f in sample_frames():
+        mix += [f] * weight
+    frames = (mix * (args.frames // len(mix) + 1))[:args.frames]
+    decoded = 0
+    started = time.perf_counter()
+    for f in frames:
+        view = memoryview(f)
+        if crc_ok is not None and not crc_ok(view):
+            continue
+        if mod.parse_gt06_packet(view) is not None:
+            decoded += 1
+        respond(view[3], bytes(view[-6:-4]))
+    elapsed = time.perf_counter() - started
+    print(f'{args.module}: {len(frames)} frames in {elapsed:.2f}s, {len(frames) / elapsed:,.0f} packets/s, '
+          f'{decoded} decoded')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Benchmark the columnar history store (vehicles/history_store.py).
+
+Usage:
+  python scripts/bench_history_store.py --vehicles 20 --days 7 --interval 10
+  python scripts/bench_history_store.py --db-vehicle 42 --db-start 2026-10-01 --db-days 7
+
+Writes `--vehicles` random-walk tracks of `--days` days (one fix every
+`--interval` seconds) into a temporary store, compacts it and prints bytes
+per fix (raw and compacted) and the time to read one vehicle's week and
+one day back as arrays. Reads are checked against what was written.
+
+`--db-vehicle` also times the same kind of read from `VehicleLocation` for
+an existing vehicle and window (`values_list` + float conversion, as the
+track and trip code did), and on PostgreSQL prints the table's bytes per
+row including indexes. Nothing is written to the database.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from vehicles.history_store import HistoryStore  # noqa: E402
+from vehicles.models import VehicleLocation  # noqa: E402
+
+
+def tracks(vehicles, days, interval, start, rng):
+    n = days * 86400 // interval
+    for veh_id in range(1, vehicles + 1):
+        t = start.timestamp() + np.arange(n) * interval
+        lat = 23.8 + np.cumsum(rng.normal(0, 2e-4, n))
+        lon = 90.4 + np.cumsum(rng.normal(0, 2e-4, n))
+        speed = np.clip(rng.normal(30, 15, n), 0, None).round(1)
+        sat = rng.integers(4, 13, n)
+        yield veh_id, t, lat, lon, speed, sat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=20)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--interval', type=int, default=10, help='seconds between fixes')
+    parser.add_argument('--db-vehicle', type=int)
+    parser.add_argument('--db-start', help='YYYY-MM-DD')
+    parser.add_argument('--db-days', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    start = datetime(2026, 10, 1, tzinfo=dt_timezone.utc)
+    path = tempfile.mkdtemp(prefix='history-bench-')
+    try:
+        store = HistoryStore(path)
+        written = {}
+        points = 0
+        started = time.perf_counter()
+        for veh_id, t, lat, lon, speed, sat in tracks(args.vehicles, args.days, args.interval, start, rng):
+            times = [datetime.fromtimestamp(x, dt_timezone.utc) for x in t]
+            rows = list(zip([veh_id] * len(t), lat.tolist(), lon.tolist(), speed.tolist(), sat.tolist(), times))
+            for i in range(0, len(rows), 500):  # ingest-writer sized batches
+                store.append(rows[i:i + 500])
+            written[veh_id] = (t, lat, lon, speed)
+            points += len(t)
+        elapsed = time.perf_counter() - started
+        raw = store.size()['raw']
+        print(f'append:  {points} fixes, {points / elapsed:,.0f} fixes/s, {raw / points:.1f} bytes/fix raw')
+
+        started = time.perf_counter()
+        totals = store.compact(before=(start + timedelta(days=args.days + 1)).date())
+        elapsed = time.perf_counter() - started
+        chunk = store.size()['chunk']
+        print(f'compact: {totals["days"]} vehicle-days in {elapsed:.2f}s, {chunk / points:.2f} bytes/fix '
+              f'({raw / chunk:.1f}x smaller than raw)')
+
+        end = start + timedelta(days=args.days)
+        for label, a, b in (('week', start, end), ('day', start + timedelta(days=1), start + timedelta(days=2))):
+            reps = 20
+            started = time.perf_counter()
+            for _ in range(reps):
+                s = store.read(1, a, b)
+            elapsed = (time.perf_counter() - started) / reps
+            print(f'read {label}: {len(s.t)} fixes in {elapsed * 1000:.1f} ms, {len(s.t) / elapsed:,.0f} fixes/s')
+
+        t, lat, lon, speed = written[1]
+        s = store.read(1)
+        assert np.array_equal(s.t, t.astype(np.int64)), 'times differ'
+        assert np.abs(s.lat - lat).max() < 1e-6 and np.abs(s.lon - lon).max() < 1e-6, 'coordinates differ'
+        assert np.abs(s.speed - speed).max() < 0.051, 'speeds differ'
+        print('round trip: ok (1e-6 deg, 0.1 km/h)')
+    finally:
+        shutil.rmtree(path)
+
+    if args.db_vehicle:
+        db_start = datetime.fromisoformat(args.db_start).replace(tzinfo=dt_timezone.utc) if args.db_start else start
+        db_end = db_start + timedelta(days=args.db_days)
+        started = time.perf_counter()
+        rows = [(t.timestamp(), float(la), float(lo), float(sp or 0)) for la, lo, sp, t in
+                VehicleLocation.objects.filter(vehicle_id=args.db_vehicle, time__gte=db_start, time__lt=db_end)
+                .order_by('time').values_list('lat', 'lon', 'speed', 'time').iterator(chunk_size=5000)]
+        elapsed = time.perf_counter() - started
+        print(f'db read: {len(rows)} fixes in {elapsed * 1000:.1f} ms, '
+              f'{len(rows) / max(elapsed, 1e-9):,.0f} fixes/s')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cur:
+                table = VehicleLocation._meta.db_table
+                # summed over partitions when the table is partitioned (partition_locations)
+                cur.execute('SELECT sum(pg_total_relation_size(relid)), sum(pg_relation_size(relid)) '
+                            'FROM pg_partition_tree(%s)', [table])
+                total, heap = cur.fetchone()
+                cur.execute('SELECT count(*) FROM ' + connection.ops.quote_name(table))
+                (count,) = cur.fetchone()
+            if count:
+                print(f'db size: {count} rows, {heap / count:.0f} bytes/row heap, '
+                      f'{total / count:.0f} bytes/row with indexes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Query benchmark for VehicleLocation history on PostgreSQL.
+
+Usage:
+  python scripts/bench_locations.py --confirm --rows 1000000 --vehicles 1000
+  python scripts/bench_locations.py --confirm --rows 100000000 --vehicles 20000 --keep
+
+Inserts `--rows` synthetic fixes (one per vehicle every `--interval` seconds,
+ending now) for `--vehicles` benchmark vehicles with generate_series, runs
+ANALYZE and then times the two hot queries:
+
+  latest fix   vehicle.locations.order_by('-time').first()
+  one day      vehicle.locations.filter(time__range=day)
+
+with the EXPLAIN ANALYZE plan of each. The rows are written into the
+configured database, so `--confirm` is required; they are deleted again
+unless `--keep` is given. Run `manage.py partition_locations` before or
+after loading to compare a plain and a partitioned table.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from vehicles.models import Vehicle, VehicleLocation  # noqa: E402
+
+IMEI_PREFIX = 'BENCH'
+
+
+def load(vehicles, rows, interval):
+    Vehicle.objects.bulk_create([
+        Vehicle(user_id=0, imei=f'{IMEI_PREFIX}{i:010d}', reg_no=f'BENCH-{i}', type='car')
+        for i in range(vehicles)
+    ], ignore_conflicts=True)
+    veh_ids = list(Vehicle.objects.filter(imei__startswith=IMEI_PREFIX)
+                   .order_by('veh_id').values_list('veh_id', flat=True)[:vehicles])
+    per_vehicle = max(rows // len(veh_ids), 1)
+    table = connection.ops.quote_name(VehicleLocation._meta.db_table)
+    start = time.perf_counter()
+    with connection.cursor() as cur:
+        # one statement per vehicle keeps each transaction (and its WAL) bounded
+        for n, veh_id in enumerate(veh_ids, 1):
+            cur.execute(f"""
+                INSERT INTO {table} (vehicle_id, lat, lon, speed, sat, "time", created_at)
+                SELECT %s, 23.7 + random() * 0.2, 90.3 + random() * 0.2,
+                       (random() * 80)::int, 4 + (random() * 8)::int,
+                       now() - make_interval(secs => s * %s), now()
+                FROM generate_series(%s, 1, -1) AS s
+            """, [veh_id, interval, per_vehicle])
+            if n % 100 == 0:
+                print(f'  {n * per_vehicle:,} rows', file=sys.stderr)
+        cur.execute(f'ANALYZE {table}')
+    elapsed = time.perf_counter() - start
+    print(f'loaded {per_vehicle * len(veh_ids):,} rows for {len(veh_ids)} vehicles '
+          f'in {elapsed:.1f}s ({per_vehicle * len(veh_ids) / elapsed:,.0f} rows/s)')
+    return veh_ids, per_vehicle
+
+
+def explain(qs):
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cur:
+        cur.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+        return '\n'.join('    ' + r[0] for r in cur.fetchall())
+
+
+def timed(label, make_qs, veh_ids, samples):
+    times = []
+    for veh_id in random.sample(veh_ids, min(samples, len(veh_ids))):
+        qs = make_qs(veh_id)
+        t0 = time.perf_counter()
+        list(qs)
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    p95 = times[int(len(times) * 0.95) - 1] if len(times) >= 20 else times[-1]
+    print(f'{label:12} median {statistics.median(times):8.2f} ms   p95 {p95:8.2f} ms   n={len(times)}')
+    print(explain(make_qs(veh_ids[0])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--confirm', action='store_true',
+                        help='Really write benchmark rows into the configured database')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--interval', type=int, default=10, help='Seconds between fixes')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--skip-load', action='store_true', help='Reuse rows from an earlier --keep run')
+    parser.add_argument('--keep', action='store_true', help='Do not delete the benchmark rows')
+    args = parser.parse_args()
+
+    if connection.vendor != 'postgresql':
+        sys.exit('this benchmark needs PostgreSQL')
+    if not args.confirm:
+        sys.exit(f'this writes {args.rows:,} rows into {connection.settings_dict["NAME"]}; '
+                 f'pass --confirm to go ahead')
+
+    if args.skip_load:
+        veh_ids = list(Vehicle.objects.filter(imei__startswith=IMEI_PREFIX)
+                       .values_list('veh_id', flat=True))
+        per_vehicle = args.rows // max(len(veh_ids), 1)
+    else:
+        veh_ids, per_vehicle = load(args.vehicles, args.rows, args.interval)
+    if not veh_ids:
+        sys.exit('no benchmark vehicles')
+
+    now = timezone.now()
+    span = timedelta(seconds=per_vehicle * args.interval)
+    day_start = now - min(span, timedelta(days=7)) / 2
+
+    timed('latest fix', lambda v: VehicleLocation.objects.filter(vehicle_id=v).order_by('-time')[:1],
+          veh_ids, args.samples)
+    timed('one day', lambda v: VehicleLocation.objects.filter(
+        vehicle_id=v, time__gte=day_start, time__lt=day_start + timedelta(days=1)).order_by('time'),
+        veh_ids, args.samples)
+
+    if not args.keep:
+        t0 = time.perf_counter()
+        VehicleLocation.objects.filter(vehicle_id__in=veh_ids)._raw_delete(connection.alias)
+        Vehicle.objects.filter(veh_id__in=veh_ids).delete()
+        print(f'cleaned up in {time.perf_counter() - t0:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
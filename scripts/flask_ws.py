@@ -6,18 +6,28 @@ Usage:
 
 The server listens for SocketIO event `get_gps` with payload `{'imei': '...'}`
 and emits `gps_info` with the query result.
+
+Live `cast` events are only sent to browsers that asked for them with a
+`subscribe` event (by vehicle, client or map bounding box, or `all`).
+
+`/metrics` serves this worker's metrics (browser connections, casts
+delivered and their lag since `publish_cast()`) in the Prometheus format.
 """
 import os
 import logging
+import time
 
-from flask import Flask
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
 
 # configure Django settings so we can import project models/helpers
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
 import django
 django.setup()
 
+from devices import metrics
+from devices.cast_bus import get_cast_bus
+from devices.geo_index import GridIndex
 from devices.sapi_helpers import get_gps_info_by_imei
 
 logging.basicConfig(level=logging.INFO)
@@ -27,12 +37,23 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'change-me'
 socketio = SocketIO(app, cors_allowed_origins='*')
 
+WS_CLIENTS = metrics.gauge('ws_clients', 'Socket.IO connections (browsers and publishers) on this bridge worker')
+WS_CASTS = metrics.counter('ws_casts_total', 'Casts handled by this bridge worker', ['result'])
+CAST_LAG = metrics.histogram('cast_lag_seconds', 'Time from publish_cast() to emit by the bridge')
+
 
 @app.route('/')
 def index():
     return 'Flask SocketIO GPS bridge'
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.authorized(request.headers.get('Authorization')):
+        return Response(status=401)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @socketio.on('get_gps')
 def handle_get_gps(payload):
     imei = None
@@ -59,26 +80,183 @@ def handle_get_gps(payload):
         emit('gps_info', {'ok': False, 'error': str(e)})
 
 
+# viewport subscriptions: sid -> map bounding box
+viewports = GridIndex(cell_deg=0.25)
+
+
+def _cast_position(cast):
+    data = cast.get('data') if isinstance(cast, dict) else None
+    try:
+        return float(data['lat']), float(data['lon'])
+    except Exception:
+        return None
+
+
+def vehicle_room(veh_id):
+    return f'veh:{int(veh_id)}'
+
+
+def client_room(client_id):
+    return f'client:{int(client_id)}'
+
+
+def subscription_rooms(payload):
+    """Rooms named by a subscribe/unsubscribe payload; ValueError/TypeError on bad ids."""
+    rooms = [vehicle_room(v) for v in payload.get('vehicles') or []]
+    rooms += [client_room(c) for c in payload.get('clients') or []]
+    if payload.get('all'):
+        rooms.append('fleet')
+    return rooms
+
+
+def cast_recipients(cast):
+    """Return the rooms/sids on this worker that should receive `cast`.
+
+    Browsers join `veh:<veh_id>`, `client:<admin_id>` or `fleet` rooms, or
+    register a map bounding box looked up through the grid index.
+    """
+    rooms = {'fleet'}
+    try:
+        if cast.get('vehicle') is not None:
+            rooms.add(vehicle_room(cast['vehicle']))
+        if cast.get('client') is not None:
+            rooms.add(client_room(cast['client']))
+    except (TypeError, ValueError):
+        pass
+    pos = _cast_position(cast)
+    if pos is not None and len(viewports):
+        rooms.update(viewports.query_point(*pos))
+    return rooms
+
+
+def deliver_cast(cast):
+    """Emit `cast` to the matching browser clients connected to this worker."""
+    if not isinstance(cast, dict):
+        return
+    try:
+        # a client in several matching rooms still gets the cast once
+        socketio.emit('cast', cast, to=sorted(cast_recipients(cast)))
+    except Exception:
+        WS_CASTS.labels('error').inc()
+        logger.exception('failed to broadcast cast')
+        return
+    WS_CASTS.labels('emitted').inc()
+    ts = cast.get('ts')
+    if isinstance(ts, (int, float)):
+        CAST_LAG.observe(max(time.time() - ts, 0))
+
+
+@socketio.on('subscribe')
+def handle_subscribe(payload):
+    """Subscribe this browser to casts.
+
+    payload keys (all optional): `vehicles` (veh ids), `clients` (admin ids),
+    `bbox` ([lat1, lon1, lat2, lon2]; replaces the previous box) and `all`
+    (every cast of the fleet).
+    """
+    if not isinstance(payload, dict):
+        emit('subscribed', {'ok': False, 'error': 'invalid payload'})
+        return
+    try:
+        for room in subscription_rooms(payload):
+            join_room(room)
+        if payload.get('bbox'):
+            viewports.insert(request.sid, payload['bbox'])
+    except (TypeError, ValueError) as e:
+        emit('subscribed', {'ok': False, 'error': str(e)})
+        return
+    emit('subscribed', {'ok': True})
+
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(payload):
+    """Undo `subscribe`; same payload keys (`bbox: true` drops the viewport)."""
+    if not isinstance(payload, dict):
+        return
+    try:
+        rooms = subscription_rooms(payload)
+    except (TypeError, ValueError):
+        return
+    for room in rooms:
+        leave_room(room)
+    if payload.get('bbox'):
+        viewports.remove(request.sid)
+
+
+@socketio.on('connect')
+def handle_connect(*args):
+    WS_CLIENTS.inc()
+
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    WS_CLIENTS.dec()
+    viewports.remove(request.sid)
+
+
 @socketio.on('cast')
 def handle_incoming_cast(cast):
     """Accept `cast` objects from upstream publishers and broadcast to clients.
 
     This allows Django (or other services) to emit casts by connecting as a
     Socket.IO client and emitting `cast` events — the server will re-broadcast
-    to all connected browser clients.
+    to all connected browser clients. With a cast bus configured the cast is
+    published there instead, so every bridge worker delivers it.
     """
-    try:
-        # re-broadcast to all connected clients
-        socketio.emit('cast', cast, broadcast=True)
-    except Exception:
-        logger.exception('failed to broadcast cast')
+    bus = get_cast_bus()
+    if bus is not None:
+        bus.publish_many([cast])
+    else:
+        deliver_cast(cast)
+
+
+@socketio.on('cast_batch')
+def handle_incoming_cast_batch(casts):
+    """Accept a list of casts from a batching publisher (see `sapi_broadcaster`).
+
+    Browsers still receive one `cast` event per item.
+    """
+    if not isinstance(casts, list):
+        return
+    bus = get_cast_bus()
+    if bus is not None:
+        bus.publish_many(casts)
+    else:
+        for cast in casts:
+            deliver_cast(cast)
+
+
+_subscription = None
+
+
+def start_cast_subscription():
+    """Subscribe this worker to the cast bus (no-op for the 'socketio' backend)."""
+    global _subscription
+    bus = get_cast_bus()
+    if bus is None or _subscription is not None:
+        return None
+
+    def on_casts(casts):
+        for cast in casts:
+            deliver_cast(cast)
+
+    _subscription = bus.subscribe(on_casts)
+    logger.info('bridge subscribed to cast bus %s', type(bus).__name__)
+    return _subscription
 
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Flask-SocketIO GPS bridge')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=6791)
+    args = parser.parse_args()
+
     # eventlet recommended for Flask-SocketIO; ensure it's installed
     try:
         import eventlet
         eventlet.monkey_patch()
     except Exception:
         pass
-    socketio.run(app, host='0.0.0.0', port=6791)
+    start_cast_subscription()
+    socketio.run(app, host=args.host, port=args.port)
@@ -0,0 +1,460 @@
+"""Load generator for the GT06 server and the sapi_v1_write endpoint.
+
+Usage:
+  python scripts/load_gt06.py --trackers 500 --rate 0.2 --duration 60
+  python scripts/load_gt06.py --trackers 200 --replay gps_data.json --duration 30
+  python scripts/load_gt06.py --confirm --create-vehicles --db --trackers 1000 --rate 1 --duration 60
+  python scripts/load_gt06.py --target sapi --url http://127.0.0.1:8000/devices/sapi_v1_write/ \\
+      --trackers 100 --batch 20 --duration 30
+
+GT06 (`--target gt06`, the default) opens `--trackers` TCP sessions to
+`--host:--port`. Each session logs in with its own IMEI (`--imei-prefix` +
+number), then streams 0x22 locations at `--rate` per second, a 0x13
+heartbeat every `--heartbeat` seconds and, for `--alarm-ratio` of the
+fixes, a 0x16 SOS alarm instead. Every frame carries a serial number, and
+the reply echoing it gives the ACK latency.
+
+`--replay FILE` makes each session send a recording in a loop instead of
+synthetic fixes. FILE is the GT06 event log (NDJSON, see
+GT06_EVENT_LOG_DIR) or a JSON array like `gps_data.json`. Logins are
+replaced by the session's own login. Location, heartbeat/status and alarm
+events are re-encoded as frames, and events with a `hex` field are sent
+byte for byte. With `--speedup X` the recorded gaps are kept, divided by
+X; otherwise events go out at `--rate`.
+
+`--target sapi` posts batches of `--batch` location messages to a
+sapi_v1_write URL from `--trackers` threads instead.
+
+Reported: packets sent and accepted (ACKed or answered with ok) per
+second, ACK latency percentiles, frames that were never answered and, with
+`--db`, the `VehicleLocation` rows the load vehicles got and how many
+accepted fixes are missing from them. `--db` and `--create-vehicles` use
+the Django settings (DJANGO_SETTINGS_MODULE). `--create-vehicles` adds one
+vehicle per IMEI and needs `--confirm`. `--cleanup` deletes those vehicles
+and their history.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neo_track.settings')
+
+LAT0, LON0 = 23.8, 90.4
+ACK_MIN_LENGTH = 10
+
+
+# -- frames ---------------------------------------------------------------
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc_itu(data):
+    crc = 0xFFFF
+    for b in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ b) & 0xFF]
+    return crc ^ 0xFFFF
+
+
+def frame(protocol, content, serial):
+    body = bytes((len(content) + 5, protocol)) + content + (serial & 0xFFFF).to_bytes(2, 'big')
+    return b'\x78\x78' + body + crc_itu(body).to_bytes(2, 'big') + b'\r\n'
+
+
+def _datetime(t):
+    t = datetime.fromtimestamp(t, dt_timezone.utc)
+    return bytes((t.year - 2000, t.month, t.day, t.hour, t.minute, t.second))
+
+
+def _gps(t, lat, lon, speed, course, sats=9):
+    status = 0x1000 | (0x0400 if lat >= 0 else 0) | (0x0800 if lon < 0 else 0) | (int(course) & 0x3FF)
+    return (_datetime(t) + bytes((0xC0 | min(sats, 15),))
+            + round(abs(lat) * 1800000).to_bytes(4, 'big') + round(abs(lon) * 1800000).to_bytes(4, 'big')
+            + bytes((min(int(speed), 255),)) + status.to_bytes(2, 'big'))
+
+
+LBS = (470).to_bytes(2, 'big') + bytes((1,)) + (0x1D2A).to_bytes(2, 'big') + (0x00C0FE).to_bytes(3, 'big')
+
+
+def login_frame(imei, serial):
+    return frame(0x01, bytes.fromhex(('0' + imei)[-16:].rjust(16, '0')), serial)
+
+
+def location_frame(serial, t, lat, lon, speed, course, ignition=True):
+    return frame(0x22, _gps(t, lat, lon, speed, course) + LBS + bytes((int(ignition), 0, 0)), serial)
+
+
+def heartbeat_frame(serial, ignition=True, voltage=5, gsm=4, alarm=0):
+    return frame(0x13, bytes((0x40 | (0x02 if ignition else 0), voltage, gsm, alarm, 0x02)), serial)
+
+
+def alarm_frame(serial, t, lat, lon, speed, course, alarm=0x01):
+    status = bytes((0x40 | 0x02, 5, 4, alarm, 0x02))
+    return frame(0x16, _gps(t, lat, lon, speed, course) + bytes((9,)) + LBS + status, serial)
+
+
+def event_frame(event, serial):
+    """Frame for a recorded event dict (event log / gps_data.json), or None."""
+    kind = event.get('type')
+    if event.get('hex'):
+        return bytes.fromhex(event['hex'])
+    t = _event_time(event)
+    if kind == 'location' and event.get('lat') is not None:
+        return location_frame(serial, t, float(event['lat']), float(event['lon']),
+                              float(event.get('speed') or 0), float(event.get('course') or 0),
+                              event.get('ignition', True))
+    if kind in ('heartbeat', 'status'):
+        return heartbeat_frame(serial, bool(event.get('ignition', True)), event.get('voltage_level', 5),
+                               event.get('gsm_level', 4), event.get('alarm_code') or 0)
+    if kind == 'alarm' and event.get('lat') is not None:
+        return alarm_frame(serial, t, float(event['lat']), float(event['lon']), float(event.get('speed') or 0),
+                           float(event.get('course') or 0), event.get('alarm_code') or 0x01)
+    return None
+
+
+def _event_time(event):
+    try:
+        t = datetime.fromisoformat(str(event.get('time')).replace('Z', '+00:00'))
+    except ValueError:
+        return time.time()
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=dt_timezone.utc)
+    return t.timestamp()
+
+
+def read_recording(path):
+    """Recorded events (logins dropped), oldest first."""
+    with open(path, encoding='utf-8') as fh:
+        text = fh.read()
+    if text.lstrip().startswith('['):
+        events = json.loads(text)
+    else:
+        events = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [e for e in events if isinstance(e, dict) and e.get('type') != 'login']
+
+
+def frame_serial(data):
+    return int.from_bytes(data[-6:-4], 'big')
+
+
+# -- GT06 sessions --------------------------------------------------------
+
+class Results:
+    def __init__(self):
+        self.sent = Counter()
+        self.acked = 0
+        self.acked_locations = 0
+        self.latencies = []
+        self.connect_errors = 0
+        self.disconnects = 0
+        self.logins = 0
+
+
+class Tracker:
+    """One simulated tracker: a TCP session sending frames and timing the replies."""
+
+    def __init__(self, imei, args, results, recording=None, rng=None):
+        self.imei = imei
+        self.args = args
+        self.results = results
+        self.recording = recording
+        self.rng = rng or random.Random()
+        self.serial = self.rng.randrange(1, 0xFFFF)
+        self.pending = {}  # serial -> (send time, kind)
+        self.lat = LAT0 + self.rng.uniform(-0.1, 0.1)
+        self.lon = LON0 + self.rng.uniform(-0.1, 0.1)
+        self.course = self.rng.uniform(0, 360)
+
+    def next_serial(self):
+        self.serial = self.serial % 0xFFFF + 1
+        return self.serial
+
+    async def send(self, writer, data, kind):
+        if kind != 'raw':  # recorded frames carry someone else's serial
+            self.pending[frame_serial(data)] = (time.perf_counter(), kind)
+        writer.write(data)
+        self.results.sent[kind] += 1
+        await writer.drain()
+
+    async def read_acks(self, reader):
+        buf = b''
+        while True:
+            chunk = await reader.read(4096)
+            if not chunk:
+                return
+            buf += chunk
+            while len(buf) >= ACK_MIN_LENGTH:
+                start = buf.find(b'\x78\x78')
+                if start < 0:
+                    buf = b''
+                    break
+                if len(buf) < start + 3 or len(buf) < start + buf[start + 2] + 5:
+                    buf = buf[start:]
+                    break
+                end = start + buf[start + 2] + 5
+                reply, buf = buf[start:end], buf[end:]
+                sent = self.pending.pop(frame_serial(reply), None)
+                if sent is not None:
+                    self.results.acked += 1
+                    self.results.latencies.append(time.perf_counter() - sent[0])
+                    if sent[1] in ('location', 'alarm'):
+                        self.results.acked_locations += 1
+                    elif sent[1] == 'login':
+                        self.results.logins += 1
+
+    def synthetic(self):
+        """Endless (delay, kind, frame builder) steps of moving fixes, heartbeats and alarms."""
+        args = self.args
+        interval = 1.0 / args.rate
+        next_heartbeat = args.heartbeat
+        elapsed = 0.0
+        while True:
+            yield interval, None, None
+            elapsed += interval
+            self.course = (self.course + self.rng.gauss(0, 15)) % 360
+            speed = max(self.rng.gauss(35, 10), 0)
+            step = speed / 3600 * interval / 111.32
+            self.lat += step * self.rng.uniform(0.5, 1) * (1 if self.course < 180 else -1)
+            self.lon += step * self.rng.uniform(0.5, 1) * (1 if 90 < self.course < 270 else -1)
+            now = time.time()
+            if args.alarm_ratio and self.rng.random() < args.alarm_ratio:
+                yield 0, 'alarm', alarm_frame(self.next_serial(), now, self.lat, self.lon, speed, self.course)
+            else:
+                yield 0, 'location', location_frame(self.next_serial(), now, self.lat, self.lon, speed, self.course)
+            if args.heartbeat and elapsed >= next_heartbeat:
+                next_heartbeat += args.heartbeat
+                yield 0, 'heartbeat', heartbeat_frame(self.next_serial())
+
+    def replayed(self):
+        """Endless steps replaying the recording, re-encoded with this tracker's serials."""
+        args = self.args
+        while True:
+            prev = None
+            for event in self.recording:
+                t = _event_time(event)
+                if args.speedup:
+                    delay = 0.0 if prev is None else max(t - prev, 0) / args.speedup
+                else:
+                    delay = 1.0 / args.rate
+                prev = t
+                data = event_frame(event, self.next_serial())
+                if data is None:
+                    continue
+                yield delay, None, None
+                yield 0, 'raw' if event.get('hex') else event.get('type'), data
+
+    async def run(self, deadline):
+        try:
+            reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+        except OSError:
+            self.results.connect_errors += 1
+            return
+        acks = asyncio.ensure_future(self.read_acks(reader))
+        try:
+            await self.send(writer, login_frame(self.imei, self.next_serial()), 'login')
+            # spread the first fixes over one interval
+            await asyncio.sleep(min(self.rng.uniform(0, 1.0 / self.args.rate), self.args.duration))
+            steps = self.replayed() if self.recording else self.synthetic()
+            for delay, kind, data in steps:
+                if time.monotonic() >= deadline:
+                    break
+                if delay:
+                    await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+                elif data is not None:
+                    await self.send(writer, data, kind)
+            # wait for the last replies
+            drain_until = time.monotonic() + self.args.drain
+            while self.pending and time.monotonic() < drain_until and not acks.done():
+                await asyncio.sleep(0.05)
+        except (ConnectionError, OSError):
+            self.results.disconnects += 1
+        finally:
+            acks.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+
+async def run_gt06(imeis, args, results, recording):
+    deadline = time.monotonic() + args.duration
+    trackers = [Tracker(imei, args, results, recording, random.Random(i)) for i, imei in enumerate(imeis)]
+    tasks = []
+    for tracker in trackers:
+        tasks.append(asyncio.ensure_future(tracker.run(deadline)))
+        if args.connect_rate:
+            await asyncio.sleep(1.0 / args.connect_rate)
+    await asyncio.gather(*tasks)
+    return sum(len(t.pending) for t in trackers)
+
+
+# -- sapi_v1_write --------------------------------------------------------
+
+def run_sapi(imeis, args, results):
+    deadline = time.monotonic() + args.duration
+    lock = threading.Lock()
+    errors = Counter()
+
+    def worker(imei, rng):
+        lat, lon = LAT0 + rng.uniform(-0.1, 0.1), LON0 + rng.uniform(-0.1, 0.1)
+        interval = args.batch / args.rate
+        while time.monotonic() < deadline:
+            items = []
+            for _ in range(args.batch):
+                lat += rng.gauss(0, 1e-4)
+                lon += rng.gauss(0, 1e-4)
+                items.append({'imei': imei, 'event': 'location', 'lat': lat, 'lon': lon,
+                              'speed': round(max(rng.gauss(35, 10), 0), 1), 'satCnt': 9,
+                              'fixTimestamp': datetime.now(dt_timezone.utc).isoformat()})
+            body = urllib.parse.urlencode({'auth': args.auth, 'type': 'gt06', 'data': json.dumps(items)}).encode()
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(args.url, data=body, timeout=30) as resp:
+                    reply = json.loads(resp.read())
+                ok = sum(1 for r in reply.get('result', ()) if r.get('ok'))
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+                ok = 0
+            latency = time.perf_counter() - started
+            with lock:
+                results.sent['location'] += len(items)
+                results.acked += ok
+                results.acked_locations += ok
+                results.latencies.append(latency)
+            time.sleep(max(interval - latency, 0))
+
+    threads = [threading.Thread(target=worker, args=(imei, random.Random(i)), daemon=True)
+               for i, imei in enumerate(imeis)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(errors.values())
+
+
+# -- database -------------------------------------------------------------
+
+def _django():
+    import django
+    django.setup()
+    from vehicles.models import Vehicle, VehicleLocation
+    return Vehicle, VehicleLocation
+
+
+def create_vehicles(imeis):
+    Vehicle, _ = _django()
+    Vehicle.objects.bulk_create([Vehicle(user_id=0, imei=imei, reg_no=f'LOAD-{imei}', type='car')
+                                 for imei in imeis], ignore_conflicts=True, batch_size=1000)
+
+
+def cleanup(prefix):
+    Vehicle, _ = _django()
+    deleted, _ = Vehicle.objects.filter(imei__startswith=prefix, reg_no__startswith='LOAD-').delete()
+    print(f'deleted {deleted} rows (vehicles and their history)')
+
+
+def count_rows(imeis, since):
+    _, VehicleLocation = _django()
+    return VehicleLocation.objects.filter(vehicle__imei__in=imeis, created_at__gte=since).count()
+
+
+# -- main -----------------------------------------------------------------
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['gt06', 'sapi'], default='gt06')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6789)
+    parser.add_argument('--url', default='http://127.0.0.1:8000/devices/sapi_v1_write/')
+    parser.add_argument('--auth', default='SAUTH')
+    parser.add_argument('--trackers', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=0.1, help='fixes per second per tracker')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--heartbeat', type=float, default=60, help='seconds between heartbeats (0: none)')
+    parser.add_argument('--alarm-ratio', type=float, default=0.0, help='fraction of fixes sent as SOS alarms')
+    parser.add_argument('--connect-rate', type=float, default=200, help='new connections per second (0: all at once)')
+    parser.add_argument('--drain', type=float, default=5, help='seconds to wait for outstanding ACKs')
+    parser.add_argument('--replay', metavar='FILE', help='event log NDJSON or gps_data.json-style array')
+    parser.add_argument('--speedup', type=float, default=0, help='replay with the recorded gaps divided by this')
+    parser.add_argument('--batch', type=int, default=20, help='sapi: messages per request')
+    parser.add_argument('--imei-prefix', default='3599990')
+    parser.add_argument('--db', action='store_true', help='count the VehicleLocation rows written')
+    parser.add_argument('--settle', type=float, default=5, help='seconds to wait for write-behind before counting')
+    parser.add_argument('--create-vehicles', action='store_true', help='add a vehicle per IMEI first')
+    parser.add_argument('--cleanup', action='store_true', help='delete the load vehicles and their history, then exit')
+    parser.add_argument('--confirm', action='store_true', help='allow writing to the configured database')
+    args = parser.parse_args()
+
+    if (args.create_vehicles or args.cleanup) and not args.confirm:
+        parser.error('--create-vehicles/--cleanup write to the configured database; add --confirm')
+    if args.cleanup:
+        cleanup(args.imei_prefix)
+        return
+
+    imeis = [f'{args.imei_prefix}{i:0{15 - len(args.imei_prefix)}d}' for i in range(1, args.trackers + 1)]
+    if args.create_vehicles:
+        create_vehicles(imeis)
+    recording = read_recording(args.replay) if args.replay else None
+    since = datetime.now(dt_timezone.utc)
+
+    results = Results()
+    started = time.perf_counter()
+    if args.target == 'sapi':
+        failed = run_sapi(imeis, args, results)
+        unanswered_label = 'failed requests'
+    else:
+        failed = asyncio.run(run_gt06(imeis, args, results, recording))
+        unanswered_label = 'unacked frames'
+    elapsed = time.perf_counter() - started
+
+    sent = sum(results.sent.values())
+    lat_ms = [x * 1000 for x in results.latencies]
+    print(f'{args.target}: {args.trackers} trackers, {elapsed:.1f}s, sent {sent} '
+          f'({", ".join(f"{k} {v}" for k, v in sorted(results.sent.items()))})')
+    if args.target == 'gt06':
+        print(f'  logins acked {results.logins}, connect errors {results.connect_errors}, '
+              f'disconnects {results.disconnects}')
+    print(f'  accepted {results.acked} ({results.acked / elapsed:,.0f} packets/s), {unanswered_label} {failed}')
+    if lat_ms:
+        print(f'  latency ms: p50 {percentile(lat_ms, 50):.1f}  p90 {percentile(lat_ms, 90):.1f}  '
+              f'p99 {percentile(lat_ms, 99):.1f}  max {max(lat_ms):.1f}  mean {statistics.fmean(lat_ms):.1f}')
+    if args.db:
+        time.sleep(args.settle)
+        rows = count_rows(imeis, since)
+        print(f'  db: {rows} location rows ({rows / elapsed:,.0f} rows/s), '
+              f'{max(results.acked_locations - rows, 0)} accepted fixes not stored')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,28 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+# BRIN keeps fleet-wide time-range scans of the append-ordered history cheap;
+# it cannot be declared on the model without breaking SQLite
+LOCATION_TIME_BRIN = 'vehloc_time_brin'
+
+
+def create_postgres_indexes(sender, using='default', **kwargs):
+    """post_migrate: add the PostgreSQL-only indexes of the history table."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    from .models import VehicleLocation
+    table = connection.ops.quote_name(VehicleLocation._meta.db_table)
+    with connection.cursor() as cur:
+        cur.execute(f'CREATE INDEX IF NOT EXISTS {LOCATION_TIME_BRIN} ON {table} '
+                    f'USING brin ("time") WITH (autosummarize = on)')
 
 
 class VehiclesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vehicles'
+
+    def ready(self):
+        post_migrate.connect(create_postgres_indexes, sender=self,
+                             dispatch_uid='vehicles_postgres_indexes')
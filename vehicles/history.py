@@ -0,0 +1,188 @@
+"""Keyset-paginated history reads and streaming exports.
+
+Pages are ordered by (time, id) and continue from an opaque cursor that
+encodes the last row's (time, id). Each page is one range scan on the
+(vehicle, time, id) index, however deep into the history it is; there is
+no OFFSET.
+
+Exports (`export_rows()` + `render_csv` / `render_ndjson` / `render_gpx`)
+stream rows from `.iterator(chunk_size=...)` into a
+`StreamingHttpResponse`, so memory stays flat however long the range is.
+
+With the columnar backend (`history_store`) both read the store instead;
+its fixes have no row id.
+"""
+import base64
+import csv
+import json
+from datetime import datetime, timezone as dt_timezone
+from xml.sax.saxutils import escape
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from . import history_store
+from .models import VehicleLocation
+
+HISTORY_FIELDS = ('id', 'time', 'lat', 'lon', 'speed', 'sat')
+MAX_PAGE_SIZE = 5000
+EXPORT_CHUNK_SIZE = 5000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(time, row_id):
+    raw = f'{time.isoformat()}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(time, id) from `encode_cursor()` output; raises `InvalidCursor`."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        t, row_id = raw.rsplit('|', 1)
+        t = parse_datetime(t)
+        if t is None:
+            raise ValueError
+        return t, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor('invalid cursor')
+
+
+def _history(veh_id, start=None, end=None):
+    qs = VehicleLocation.objects.filter(vehicle_id=veh_id, time__isnull=False)
+    if start is not None:
+        qs = qs.filter(time__gte=start)
+    if end is not None:
+        qs = qs.filter(time__lt=end)
+    return qs
+
+
+def history_page(veh_id, start=None, end=None, cursor=None, limit=1000):
+    """One page of fixes as dicts, oldest first, plus the cursor for the next page (or None)."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if history_store.columnar_reads():
+        return _store_page(veh_id, start, end, cursor, limit)
+    qs = _history(veh_id, start, end)
+    if cursor:
+        t, row_id = decode_cursor(cursor)
+        # (time, id) > (t, row_id); the time__gte bound keeps it an index range scan
+        qs = qs.filter(time__gte=t).filter(Q(time__gt=t) | Q(id__gt=row_id))
+    rows = list(qs.order_by('time', 'id').values(*HISTORY_FIELDS)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]['time'], rows[-1]['id']) if more else None
+    return [_plain(r) for r in rows], next_cursor
+
+
+def _plain(row):
+    row['time'] = row['time'].isoformat()
+    row['lat'] = float(row['lat'])
+    row['lon'] = float(row['lon'])
+    row['speed'] = float(row['speed']) if row['speed'] is not None else None
+    return row
+
+
+def _store_page(veh_id, start, end, cursor, limit):
+    """`history_page()` over the columnar store.
+
+    Fixes there have no id; the cursor holds the last time and how many
+    fixes with exactly that time were already returned, and rows get id None.
+    """
+    skip = 0
+    if cursor:
+        t, skip = decode_cursor(cursor)
+        start = t if start is None or t > start else start
+    s = history_store.read_series(veh_id, start, end)
+    if cursor:
+        # fixes at the cursor's second that the previous page already returned
+        skip = min(skip, int((s.t == t.timestamp()).sum())) if len(s.t) and s.t[0] == t.timestamp() else 0
+    stop = skip + limit
+    rows = [_store_row(s, i) for i in range(skip, min(stop, len(s.t)))]
+    next_cursor = None
+    if stop < len(s.t):
+        last_t = s.t[stop - 1]
+        # count the already returned fixes sharing the last time, including the previous pages'
+        same = int((s.t[:stop] == last_t).sum())
+        next_cursor = encode_cursor(datetime.fromtimestamp(last_t, dt_timezone.utc), same)
+    return rows, next_cursor
+
+
+def _store_row(s, i):
+    return {'id': None, 'time': datetime.fromtimestamp(s.t[i], dt_timezone.utc).isoformat(),
+            'lat': round(float(s.lat[i]), 6), 'lon': round(float(s.lon[i]), 6), 'speed': float(s.speed[i]),
+            'sat': int(s.sat[i])}
+
+
+def _store_rows(veh_id, start, end):
+    s = history_store.read_series(veh_id, start, end)
+    tz = dt_timezone.utc
+    for a in range(0, len(s.t), EXPORT_CHUNK_SIZE):
+        b = a + EXPORT_CHUNK_SIZE
+        for t, lat, lon, speed, sat in zip(s.t[a:b].tolist(), s.lat[a:b].round(6).tolist(),
+                                           s.lon[a:b].round(6).tolist(), s.speed[a:b].tolist(),
+                                           s.sat[a:b].tolist()):
+            yield None, datetime.fromtimestamp(t, tz), lat, lon, speed, sat
+
+
+def export_rows(veh_id, start=None, end=None):
+    """Stream (id, time, lat, lon, speed, sat) tuples, oldest first."""
+    if history_store.columnar_reads():
+        return _store_rows(veh_id, start, end)
+    return (_history(veh_id, start, end)
+            .order_by('time', 'id')
+            .values_list(*HISTORY_FIELDS)
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def batched(lines, size=500):
+    """Join generated lines into larger chunks; one tiny chunk per row is slow to stream."""
+    buf = []
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= size:
+            yield ''.join(buf)
+            buf = []
+    if buf:
+        yield ''.join(buf)
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows, name=''):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HISTORY_FIELDS)
+    for row_id, t, lat, lon, speed, sat in rows:
+        yield writer.writerow((row_id, t.isoformat(), lat, lon, '' if speed is None else speed,
+                               '' if sat is None else sat))
+
+
+def render_ndjson(rows, name=''):
+    for row_id, t, lat, lon, speed, sat in rows:
+        yield json.dumps({'id': row_id, 'time': t.isoformat(), 'lat': float(lat), 'lon': float(lon),
+                          'speed': None if speed is None else float(speed), 'sat': sat}) + '\n'
+
+
+def render_gpx(rows, name=''):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="neo_track" xmlns="http://www.topografix.com/GPX/1/1">\n'
+           f'<trk><name>{escape(str(name))}</name><trkseg>\n')
+    for _, t, lat, lon, speed, _ in rows:
+        time = t.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        ext = f'<extensions><speed>{speed}</speed></extensions>' if speed is not None else ''
+        yield f'<trkpt lat="{lat}" lon="{lon}"><time>{time}</time>{ext}</trkpt>\n'
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (render_csv, 'text/csv'),
+    'ndjson': (render_ndjson, 'application/x-ndjson'),
+    'gpx': (render_gpx, 'application/gpx+xml'),
+}
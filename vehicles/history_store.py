@@ -0,0 +1,373 @@
+"""Columnar, file-based location history: an alternative to `VehicleLocation` rows.
+
+With `HISTORY_BACKEND = 'columnar'` (or `'both'`, which keeps writing the
+table too) the ingest writer appends fixes here, and the track, history,
+export and trip/rollup code reads them from here. History is kept in
+`HISTORY_STORE_DIR` as one set of files per vehicle and UTC day:
+
+- ``<veh_id>/<YYYYMMDD>.raw``: fixes appended as they arrive, fixed 16-byte
+  records (int32 second of the day, int32 lat/lon in microdegrees, int16
+  speed in 0.1 km/h, int16 satellites), read with `np.memmap`;
+- ``<veh_id>/<YYYYMMDD>.vtc``: a compacted chunk. The same columns sorted
+  by time, each stored as zigzag varints of the deltas between consecutive
+  values, so a moving vehicle costs a few bytes per fix instead of a
+  ~100-byte row plus index entries. Chunks are memory mapped and decoded
+  with vectorized NumPy.
+
+`manage.py history_store --compact` turns finished days' ``.raw`` files
+into chunks (late fixes for a compacted day are merged on the next run);
+`--import-db` copies existing `VehicleLocation` rows in.
+
+Coordinates are kept to 1e-6 degrees (about 11 cm) and speed to 0.1 km/h.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    NUMPY_AVAILABLE = False
+
+DAY = 86400
+COORD_SCALE = 1e6  # microdegrees
+SPEED_SCALE = 10  # 0.1 km/h
+RAW_SUFFIX = '.raw'
+CHUNK_SUFFIX = '.vtc'
+CHUNK_MAGIC = b'NTH1'
+CHUNK_HEADER = struct.Struct('<4sHHI')  # magic, version, column count, row count
+COLUMN_LENGTH = struct.Struct('<I')
+COLUMNS = ('t', 'lat', 'lon', 'speed', 'sat')
+
+if NUMPY_AVAILABLE:
+    RAW_DTYPE = np.dtype([('t', '<i4'), ('lat', '<i4'), ('lon', '<i4'), ('speed', '<i2'), ('sat', '<i2')])
+
+# t: epoch seconds (float64); lat/lon: degrees; speed: km/h; sat: count
+Series = namedtuple('Series', 'veh_id t lat lon speed sat')
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError('the columnar history store needs numpy (pip install numpy)')
+
+
+# -- codec ----------------------------------------------------------------
+
+def varint_encode(values):
+    """Encode non-negative integers as LEB128 varints (vectorized)."""
+    v = np.asarray(values)
+    if v.dtype != np.uint64:
+        v = v.astype(np.int64).view(np.uint64)
+    if not len(v):
+        return b''
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += v >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        m = nbytes > k
+        byte = (v[m] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        out[starts[m] + k] = byte.astype(np.uint8) | np.where(nbytes[m] > k + 1, 0x80, 0).astype(np.uint8)
+    return out.tobytes()
+
+
+def varint_decode(buf, count):
+    """Decode `count` varints from a bytes-like object (vectorized); returns uint64."""
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if not count:
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(b < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError('truncated varint column')
+    b = b[:ends[-1] + 1]
+    if len(b) == count:
+        return b.astype(np.uint64)
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shift = np.arange(len(b), dtype=np.int64) - np.repeat(starts, ends - starts + 1)
+    parts = (b & 0x7F).astype(np.uint64) << (7 * shift).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def delta_encode(values):
+    """Zigzag varints of the first value and the deltas that follow."""
+    v = np.asarray(values, dtype=np.int64)
+    d = np.diff(v, prepend=np.int64(0))
+    return varint_encode((d << 1) ^ (d >> 63))
+
+
+def delta_decode(buf, count):
+    z = varint_decode(buf, count).astype(np.int64)
+    return np.cumsum((z >> 1) ^ -(z & 1))
+
+
+def encode_chunk(rec):
+    """Chunk bytes for a structured `RAW_DTYPE` array (sorted by time here)."""
+    rec = rec[np.argsort(rec['t'], kind='stable')]
+    parts = [CHUNK_HEADER.pack(CHUNK_MAGIC, 1, len(COLUMNS), len(rec))]
+    for name in COLUMNS:
+        col = delta_encode(rec[name])
+        parts.append(COLUMN_LENGTH.pack(len(col)))
+        parts.append(col)
+    return b''.join(parts)
+
+
+def decode_chunk(buf):
+    """Structured `RAW_DTYPE` array from `encode_chunk()` output."""
+    magic, version, ncols, count = CHUNK_HEADER.unpack_from(buf, 0)
+    if magic != CHUNK_MAGIC or version != 1 or ncols != len(COLUMNS):
+        raise ValueError('not a history chunk')
+    rec = np.empty(count, dtype=RAW_DTYPE)
+    offset = CHUNK_HEADER.size
+    view = memoryview(buf)
+    for name in COLUMNS:
+        (length,) = COLUMN_LENGTH.unpack_from(buf, offset)
+        offset += COLUMN_LENGTH.size
+        rec[name] = delta_decode(view[offset:offset + length], count)
+        offset += length
+    return rec
+
+
+# -- store ----------------------------------------------------------------
+
+def _aware(t):
+    return timezone.make_aware(t) if timezone.is_naive(t) else t
+
+
+def _day_name(day):
+    return day.strftime('%Y%m%d')
+
+
+class HistoryStore:
+    """Per-vehicle, per-day raw and compacted chunk files under `path`."""
+
+    def __init__(self, path):
+        _require_numpy()
+        self.path = path
+        self.stats = {'appended': 0, 'chunks_read': 0, 'raw_read': 0, 'compacted_days': 0}
+
+    def _dir(self, veh_id):
+        return os.path.join(self.path, str(int(veh_id)))
+
+    def _file(self, veh_id, day, suffix):
+        return os.path.join(self._dir(veh_id), _day_name(day) + suffix)
+
+    # -- writes --------------------------------------------------------
+
+    def append(self, rows):
+        """Append (veh_id, lat, lon, speed, sat, time) rows; rows without a time are skipped."""
+        groups = defaultdict(list)
+        for veh_id, lat, lon, speed, sat, t in rows:
+            if t is None or lat is None or lon is None:
+                continue
+            ts = int(_aware(t).timestamp())
+            groups[(veh_id, ts // DAY)].append(
+                (ts % DAY, round(float(lat) * COORD_SCALE), round(float(lon) * COORD_SCALE),
+                 min(round(float(speed or 0) * SPEED_SCALE), 32767), min(int(sat or 0), 32767)))
+        for (veh_id, day_no), recs in groups.items():
+            data = np.array(recs, dtype=RAW_DTYPE).tobytes()
+            path = self._file(veh_id, date(1970, 1, 1) + timedelta(days=day_no), RAW_SUFFIX)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # one write per vehicle-day: whole records even with several writers
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            self.stats['appended'] += len(recs)
+        return sum(len(r) for r in groups.values())
+
+    # -- reads ---------------------------------------------------------
+
+    def _read_raw(self, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        n = size // RAW_DTYPE.itemsize  # ignore a record still being appended
+        if not n:
+            return None
+        self.stats['raw_read'] += 1
+        return np.memmap(path, dtype=RAW_DTYPE, mode='r', shape=(n,))
+
+    def _read_chunk(self, path):
+        try:
+            with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                self.stats['chunks_read'] += 1
+                return decode_chunk(buf)
+        except (OSError, ValueError):
+            return None
+
+    def read_day(self, veh_id, day):
+        """Structured array of one vehicle-day (chunk + raw), sorted by time."""
+        parts = [p for p in (self._read_chunk(self._file(veh_id, day, CHUNK_SUFFIX)),
+                             self._read_raw(self._file(veh_id, day, RAW_SUFFIX))) if p is not None]
+        if not parts:
+            return np.empty(0, dtype=RAW_DTYPE)
+        rec = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        if len(rec) > 1 and (np.diff(rec['t']) < 0).any():
+            rec = rec[np.argsort(rec['t'], kind='stable')]
+        return rec
+
+    def days(self, veh_id):
+        """Dates with history for `veh_id`, oldest first."""
+        try:
+            names = os.listdir(self._dir(veh_id))
+        except OSError:
+            return []
+        out = set()
+        for name in names:
+            stem, suffix = os.path.splitext(name)
+            if suffix in (RAW_SUFFIX, CHUNK_SUFFIX) and len(stem) == 8 and stem.isdigit():
+                out.add(date(int(stem[:4]), int(stem[4:6]), int(stem[6:])))
+        return sorted(out)
+
+    def vehicles(self):
+        try:
+            return sorted(int(n) for n in os.listdir(self.path) if n.isdigit())
+        except OSError:
+            return []
+
+    def read(self, veh_id, start=None, end=None):
+        """`Series` of the fixes with start <= time < end, oldest first."""
+        t0 = _aware(start).timestamp() if start is not None else None
+        t1 = _aware(end).timestamp() if end is not None else None
+        first = datetime.fromtimestamp(t0, dt_timezone.utc).date() if t0 is not None else None
+        last = datetime.fromtimestamp(t1, dt_timezone.utc).date() if t1 is not None else None
+        ts, recs = [], []
+        for day in self.days(veh_id):
+            if (first is not None and day < first) or (last is not None and day > last):
+                continue
+            rec = self.read_day(veh_id, day)
+            if not len(rec):
+                continue
+            t = rec['t'].astype(np.float64) + (day - date(1970, 1, 1)).days * DAY
+            mask = None
+            if t0 is not None and t[0] < t0:
+                mask = t >= t0
+            if t1 is not None and t[-1] >= t1:
+                mask = (t < t1) if mask is None else mask & (t < t1)
+            if mask is not None:
+                t, rec = t[mask], rec[mask]
+            ts.append(t)
+            recs.append(rec)
+        if not recs:
+            empty = np.empty(0)
+            return Series(veh_id, empty, empty, empty, empty, np.empty(0, dtype=np.int64))
+        rec = np.concatenate(recs)
+        return Series(veh_id, np.concatenate(ts), rec['lat'] / COORD_SCALE, rec['lon'] / COORD_SCALE,
+                      rec['speed'] / SPEED_SCALE, rec['sat'].astype(np.int64))
+
+    def last_time(self, veh_id):
+        """Time of the newest fix of `veh_id` (aware, UTC), or None."""
+        for day in reversed(self.days(veh_id)):
+            rec = self.read_day(veh_id, day)
+            if len(rec):
+                return datetime.fromtimestamp(
+                    (day - date(1970, 1, 1)).days * DAY + int(rec['t'].max()), dt_timezone.utc)
+        return None
+
+    # -- maintenance ---------------------------------------------------
+
+    def compact(self, before=None, veh_ids=None):
+        """Merge the ``.raw`` files of UTC days before `before` (default: today) into chunks.
+
+        Returns {'days', 'points'}. The raw file is renamed before it is
+        read, so fixes appended meanwhile go to a new one and are merged by
+        a later run.
+        """
+        before = before or timezone.now().astimezone(dt_timezone.utc).date()
+        totals = {'days': 0, 'points': 0}
+        for veh_id in (veh_ids if veh_ids is not None else self.vehicles()):
+            for day in self.days(veh_id):
+                if day >= before:
+                    continue
+                raw = self._file(veh_id, day, RAW_SUFFIX)
+                if not os.path.exists(raw):
+                    continue
+                totals['points'] += self._compact_day(veh_id, day, raw)
+                totals['days'] += 1
+        self.stats['compacted_days'] += totals['days']
+        return totals
+
+    def _compact_day(self, veh_id, day, raw):
+        chunk = self._file(veh_id, day, CHUNK_SUFFIX)
+        compacting = raw + '.compacting'
+        os.replace(raw, compacting)
+        parts = [p for p in (self._read_chunk(chunk), self._read_raw(compacting)) if p is not None]
+        rec = np.concatenate([np.asarray(p) for p in parts]) if parts else np.empty(0, dtype=RAW_DTYPE)
+        tmp = chunk + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(encode_chunk(rec))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, chunk)
+        os.remove(compacting)
+        return len(rec)
+
+    def size(self, veh_id=None):
+        """Bytes on disk as {'raw', 'chunk'}, for one vehicle or the whole store."""
+        out = {'raw': 0, 'chunk': 0}
+        for v in ([veh_id] if veh_id is not None else self.vehicles()):
+            try:
+                names = os.listdir(self._dir(v))
+            except OSError:
+                continue
+            for name in names:
+                kind = 'raw' if name.endswith(RAW_SUFFIX) else 'chunk' if name.endswith(CHUNK_SUFFIX) else None
+                if kind:
+                    out[kind] += os.path.getsize(os.path.join(self._dir(v), name))
+        return out
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The process-wide `HistoryStore`, or None when `HISTORY_STORE_DIR` is not set."""
+    global _store
+    path = getattr(settings, 'HISTORY_STORE_DIR', '')
+    if not path:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore(path)
+    return _store
+
+
+def backend():
+    """'db', 'columnar' or 'both' (the store must be configured for the last two)."""
+    name = getattr(settings, 'HISTORY_BACKEND', 'db')
+    if name not in ('db', 'columnar', 'both'):
+        raise ValueError(f'unknown HISTORY_BACKEND {name!r}')
+    if name != 'db' and not getattr(settings, 'HISTORY_STORE_DIR', ''):
+        logger.warning('HISTORY_BACKEND=%s needs HISTORY_STORE_DIR; using the database', name)
+        return 'db'
+    return name
+
+
+def columnar_reads():
+    """True when history should be read from the columnar store."""
+    return backend() != 'db'
+
+
+def read_series(veh_id, start=None, end=None):
+    """`Series` of one vehicle from the columnar store."""
+    return get_store().read(veh_id, start, end)
@@ -0,0 +1,203 @@
+"""Last known position per vehicle: table, process mirror and fleet reads.
+
+The ingest writer upserts `VehicleLatestPosition` once per flush (newest fix
+per vehicle only) and then calls `latest_positions.update()`, which keeps:
+
+- an in-process dict, so code running next to ingest (e.g. the GT06
+  server) can read the previous fix without a query;
+- with `LATEST_POSITION_MIRROR = 'redis'`, a Redis hash (`REDIS_URL`,
+  key `LATEST_POSITION_KEY`) shared with the web workers.
+
+`fleet_rows()` is what the current-location and status pages use: compact
+dicts with a handful of vehicle columns plus the position, read in one
+query (or one query plus one HGETALL with the Redis mirror).
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Vehicle, VehicleLatestPosition
+
+logger = logging.getLogger(__name__)
+
+POSITION_FIELDS = ('lat', 'lon', 'speed', 'sat', 'time')
+VEHICLE_FIELDS = ('veh_id', 'imei', 'name', 'reg_no', 'ignition', 'geocode_txt')
+
+
+def _aware(t):
+    # naive times are UTC; comparing them with aware ones would raise
+    return t.replace(tzinfo=dt_timezone.utc) if timezone.is_naive(t) else t
+
+
+def is_newer(a, b):
+    """True when time `a` should replace time `b` (missing times always win)."""
+    return a is None or b is None or _aware(a) >= _aware(b)
+
+
+class LatestPositions:
+    """In-process (and optionally Redis) mirror of `VehicleLatestPosition`."""
+
+    def __init__(self, redis_url=None, key='vehicles:latest'):
+        self.key = key
+        self._local = {}  # veh_id -> position dict
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+
+    @property
+    def shared(self):
+        """True when positions are mirrored to Redis."""
+        return self._redis is not None
+
+    def update(self, rows):
+        """Record fixes given as (veh_id, lat, lon, speed, sat, time) tuples."""
+        changed = {}
+        with self._lock:
+            for veh_id, lat, lon, speed, sat, t in rows:
+                cur = self._local.get(veh_id)
+                if cur is not None and not is_newer(t, cur['time']):
+                    continue
+                pos = {'lat': float(lat), 'lon': float(lon), 'speed': float(speed or 0),
+                       'sat': int(sat or 0), 'time': t}
+                self._local[veh_id] = pos
+                changed[veh_id] = pos
+        if changed and self._redis is not None:
+            try:
+                self._redis.hset(self.key, mapping={
+                    str(v): json.dumps(dict(p, time=p['time'].isoformat() if p['time'] else None))
+                    for v, p in changed.items()
+                })
+            except Exception:
+                logger.exception('updating the latest-position mirror in redis failed')
+
+    def get(self, veh_id):
+        """Position dict last recorded in this process, or None."""
+        return self._local.get(veh_id)
+
+    def positions(self, veh_ids=None):
+        """Return {veh_id: position dict} from the shared store.
+
+        Uses the Redis hash when configured, otherwise the table. The
+        in-process dict is not used here: web workers do not see the
+        ingest process' updates.
+        """
+        if self._redis is not None:
+            try:
+                found = self._positions_from_redis(veh_ids)
+            except Exception:
+                logger.exception('reading latest positions from redis failed, using the table')
+            else:
+                if veh_ids is None:
+                    return found
+                # vehicles not reported since the mirror was (re)filled
+                missing = [v for v in veh_ids if v not in found]
+                if missing:
+                    loaded = self._positions_from_table(missing)
+                    self.update((v, p['lat'], p['lon'], p['speed'], p['sat'], p['time'])
+                                for v, p in loaded.items())
+                    found.update(loaded)
+                return found
+        return self._positions_from_table(veh_ids)
+
+    def _positions_from_table(self, veh_ids):
+        qs = VehicleLatestPosition.objects.all()
+        if veh_ids is not None:
+            qs = qs.filter(vehicle_id__in=veh_ids)
+        return {r.pop('vehicle_id'): _position(r) for r in qs.values('vehicle_id', *POSITION_FIELDS)}
+
+    def _positions_from_redis(self, veh_ids):
+        if veh_ids is None:
+            raw = self._redis.hgetall(self.key)
+        else:
+            raw = dict(zip(map(str, veh_ids), self._redis.hmget(self.key, [str(v) for v in veh_ids])))
+        out = {}
+        for k, v in raw.items():
+            if v is None:
+                continue
+            pos = json.loads(v)
+            pos['time'] = datetime.fromisoformat(pos['time']) if pos['time'] else None
+            out[int(k)] = pos
+        return out
+
+    def reload(self):
+        """Refill the mirror from the table (e.g. after the Redis hash was lost)."""
+        loaded = self._positions_from_table(None)
+        self.update((v, p['lat'], p['lon'], p['speed'], p['sat'], p['time']) for v, p in loaded.items())
+        return len(loaded)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+
+def _position(row):
+    return {'lat': float(row['lat']), 'lon': float(row['lon']), 'speed': float(row['speed'] or 0),
+            'sat': row['sat'] or 0, 'time': row['time']}
+
+
+def _make_store():
+    redis_url = None
+    if getattr(settings, 'LATEST_POSITION_MIRROR', 'memory') == 'redis':
+        redis_url = getattr(settings, 'REDIS_URL', '') or 'redis://127.0.0.1:6379/0'
+    try:
+        return LatestPositions(redis_url, getattr(settings, 'LATEST_POSITION_KEY', 'vehicles:latest'))
+    except ImportError:
+        logger.warning('redis is not installed, keeping latest positions in memory only')
+        return LatestPositions()
+
+
+latest_positions = _make_store()
+
+
+def position_status(pos, ignition=False, now=None):
+    """Classify a vehicle for the status page.
+
+    Returns 'nodata', 'inactive', 'overspeed', 'running', 'idle' or 'stop'.
+    """
+    if pos is None:
+        return 'nodata'
+    now = now or timezone.now()
+    inactive_after = getattr(settings, 'VEHICLE_INACTIVE_AFTER', 3600)
+    if pos['time'] is None or now - pos['time'] > timedelta(seconds=inactive_after):
+        return 'inactive'
+    if pos['speed'] > getattr(settings, 'VEHICLE_OVERSPEED_KMH', 80):
+        return 'overspeed'
+    if pos['speed'] > 0:
+        return 'running'
+    return 'idle' if ignition else 'stop'
+
+
+def fleet_rows(vehicles=None):
+    """Compact rows for fleet pages: `VEHICLE_FIELDS` plus position and status.
+
+    `vehicles` is an optional `Vehicle` queryset to restrict the fleet.
+    Rows without a fix have lat/lon/speed/time set to None and status
+    'nodata'.
+    """
+    qs = (vehicles if vehicles is not None else Vehicle.objects.all()).order_by('veh_id')
+    now = timezone.now()
+    if latest_positions.shared:
+        rows = list(qs.values(*VEHICLE_FIELDS))
+        positions = latest_positions.positions([r['veh_id'] for r in rows]) if rows else {}
+    else:
+        # one LEFT JOIN on the position table's primary key
+        rel = [f'latest_position__{f}' for f in POSITION_FIELDS]
+        rows, positions = [], {}
+        for r in qs.values(*VEHICLE_FIELDS, *rel):
+            if r['latest_position__lat'] is not None:
+                positions[r['veh_id']] = _position({f: r.pop(f'latest_position__{f}') for f in POSITION_FIELDS})
+            else:
+                for f in rel:
+                    r.pop(f)
+            rows.append(r)
+    for r in rows:
+        pos = positions.get(r['veh_id'])
+        r.update(pos or dict.fromkeys(POSITION_FIELDS))
+        r['status'] = position_status(pos, r['ignition'], now)
+    return rows
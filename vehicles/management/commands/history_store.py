@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from vehicles.history_store import get_store
+from vehicles.models import VehicleLocation
+
+
+class Command(BaseCommand):
+    help = ('Maintain the columnar location history (HISTORY_STORE_DIR): compact finished days, '
+            'import VehicleLocation rows, show sizes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--import-db', action='store_true',
+                            help='Copy VehicleLocation rows (--start/--end/--vehicle) into the store')
+        parser.add_argument('--start', help='first day to import (YYYY-MM-DD)')
+        parser.add_argument('--end', help='last day to import (YYYY-MM-DD, inclusive)')
+        parser.add_argument('--vehicle', type=int, action='append', help='only this vehicle (repeatable)')
+        parser.add_argument('--compact', action='store_true',
+                            help='Turn the raw files of days before today (UTC) into compressed chunks')
+        parser.add_argument('--stats', action='store_true', help='Show vehicles, vehicle-days and bytes on disk')
+
+    def handle(self, *args, **options):
+        store = get_store()
+        if store is None:
+            raise CommandError('HISTORY_STORE_DIR is not set')
+        if options['import_db']:
+            self.import_db(store, options)
+        if options['compact']:
+            totals = store.compact(veh_ids=options['vehicle'])
+            self.stdout.write(self.style.SUCCESS(f"compacted {totals['days']} days, {totals['points']} points"))
+        if options['stats'] or not (options['import_db'] or options['compact']):
+            self.stats(store, options['vehicle'])
+
+    def import_db(self, store, options):
+        qs = VehicleLocation.objects.filter(time__isnull=False)
+        for name, lookup in (('start', 'time__gte'), ('end', 'time__lt')):
+            if options[name]:
+                day = parse_date(options[name])
+                if day is None:
+                    raise CommandError(f'--{name} must be YYYY-MM-DD')
+                if name == 'end':
+                    day += timedelta(days=1)
+                qs = qs.filter(**{lookup: timezone.make_aware(datetime.combine(day, datetime.min.time()))})
+        if options['vehicle']:
+            qs = qs.filter(vehicle_id__in=options['vehicle'])
+        rows, total = [], 0
+        for row in (qs.order_by('vehicle_id', 'time')
+                    .values_list('vehicle_id', 'lat', 'lon', 'speed', 'sat', 'time')
+                    .iterator(chunk_size=20000)):
+            rows.append(row)
+            if len(rows) >= 20000:
+                total += store.append(rows)
+                rows = []
+        total += store.append(rows)
+        self.stdout.write(self.style.SUCCESS(f'imported {total} points (run --compact to compress them)'))
+
+    def stats(self, store, veh_ids=None):
+        veh_ids = veh_ids or store.vehicles()
+        size = {'raw': 0, 'chunk': 0}
+        days = 0
+        for veh_id in veh_ids:
+            days += len(store.days(veh_id))
+            for k, v in store.size(veh_id).items():
+                size[k] += v
+        self.stdout.write(f"{len(veh_ids)} vehicles, {days} vehicle-days, "
+                          f"{size['chunk'] / 1e6:.1f} MB compacted, {size['raw'] / 1e6:.1f} MB raw")
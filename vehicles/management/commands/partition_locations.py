@@ -0,0 +1,170 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from vehicles.models import VehicleLocation
+
+
+def month_start(d, add=0):
+    """First day of the month `add` months after the month of `d`."""
+    m = d.year * 12 + d.month - 1 + add
+    return date(m // 12, m % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = ('Manage native PostgreSQL monthly partitioning of VehicleLocation history '
+            '(convert the table, create upcoming partitions, detach old ones)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Turn the existing table into a partitioned one (existing rows '
+                                 'become one "legacy" partition)')
+        parser.add_argument('--create', type=int, metavar='MONTHS', default=None,
+                            help='Create partitions from the current month up to MONTHS ahead')
+        parser.add_argument('--detach-older-than', type=int, metavar='MONTHS', default=None,
+                            help='Detach partitions that end more than MONTHS months ago')
+        parser.add_argument('--drop', action='store_true',
+                            help='With --detach-older-than: drop the detached tables')
+        parser.add_argument('--status', action='store_true', help='List partitions')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('partitioning needs PostgreSQL')
+        self.table = VehicleLocation._meta.db_table
+
+        if options['convert']:
+            self.convert()
+        if options['create'] is not None:
+            self.create_partitions(options['create'])
+        if options['detach_older_than'] is not None:
+            self.detach_partitions(options['detach_older_than'], options['drop'])
+        if options['status'] or not any(
+                (options['convert'], options['create'] is not None,
+                 options['detach_older_than'] is not None)):
+            self.status()
+
+    def q(self, name):
+        return connection.ops.quote_name(name)
+
+    def is_partitioned(self, cur):
+        cur.execute("SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)", [self.table])
+        row = cur.fetchone()
+        if row is None:
+            raise CommandError(f'table {self.table} does not exist')
+        return row[0] == 'p'
+
+    def partitions(self, cur):
+        """Return [(name, lower, upper)] for the range partitions (bounds as text, None for default)."""
+        cur.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname
+        """, [self.table])
+        out = []
+        for name, bound in cur.fetchall():
+            if bound == 'DEFAULT':
+                out.append((name, None, None))
+                continue
+            # FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00')
+            parts = bound.split("'")
+            lower = parts[1] if len(parts) > 3 else 'MINVALUE'
+            upper = parts[-2] if len(parts) > 1 else 'MAXVALUE'
+            out.append((name, lower, upper))
+        return out
+
+    @transaction.atomic
+    def convert(self):
+        t = self.table
+        legacy, default = f'{t}_legacy', f'{t}_default'
+        with connection.cursor() as cur:
+            if self.is_partitioned(cur):
+                self.stdout.write(f'{t} is already partitioned')
+                return
+            # legacy partition holds everything before the first monthly partition
+            cur.execute(f'SELECT max("time") FROM {self.q(t)}')
+            newest = cur.fetchone()[0]
+            boundary = month_start(max(newest.date(), date.today()) if newest else date.today(), 1)
+
+            cur.execute(f'ALTER TABLE {self.q(t)} RENAME TO {self.q(legacy)}')
+            cur.execute(f'CREATE TABLE {self.q(t)} (LIKE {self.q(legacy)} INCLUDING DEFAULTS '
+                        f'INCLUDING CONSTRAINTS) PARTITION BY RANGE ("time")')
+            # ids come from a sequence owned by the parent (identity columns on
+            # partitioned tables need PostgreSQL 17), continuing after the
+            # legacy rows; it survives dropping the legacy partition
+            seq = self.q(f'{t}_part_id_seq')
+            cur.execute(f'CREATE SEQUENCE {seq} OWNED BY {self.q(t)}.id')
+            cur.execute(f'SELECT setval(%s, (SELECT coalesce(max(id), 0) + 1 FROM {self.q(legacy)}), false)',
+                        [f'{t}_part_id_seq'])
+            cur.execute(f"ALTER TABLE {self.q(t)} ALTER COLUMN id SET DEFAULT nextval('{t}_part_id_seq')")
+            cur.execute(f'ALTER TABLE {self.q(t)} ADD FOREIGN KEY (vehicle_id) REFERENCES '
+                        f'{self.q(VehicleLocation._meta.get_field("vehicle").related_model._meta.db_table)} '
+                        f'(veh_id) DEFERRABLE INITIALLY DEFERRED')
+            for idx in VehicleLocation._meta.indexes:
+                cols = ', '.join(self.q(VehicleLocation._meta.get_field(f.lstrip('-')).column)
+                                 for f in idx.fields)
+                cur.execute(f'CREATE INDEX ON {self.q(t)} ({cols})')
+            # the BRIN index is not on the model (see vehicles.apps)
+            cur.execute(f'CREATE INDEX ON {self.q(t)} USING brin ("time") WITH (autosummarize = on)')
+
+            # rows without a time (or dated beyond the boundary) go to the default partition
+            cur.execute(f'CREATE TABLE {self.q(default)} PARTITION OF {self.q(t)} DEFAULT')
+            cur.execute(f'ALTER TABLE {self.q(default)} ADD PRIMARY KEY (id)')
+            cur.execute(f'WITH moved AS (DELETE FROM {self.q(legacy)} '
+                        f'WHERE "time" IS NULL OR "time" >= %s RETURNING *) '
+                        f'INSERT INTO {self.q(default)} SELECT * FROM moved', [boundary])
+            cur.execute(f'ALTER TABLE {self.q(t)} ATTACH PARTITION {self.q(legacy)} '
+                        f'FOR VALUES FROM (MINVALUE) TO (%s)', [boundary])
+        self.stdout.write(self.style.SUCCESS(
+            f'{t} is now partitioned; existing rows are in {legacy} (before {boundary})'))
+        self.create_partitions(0, start=boundary)
+
+    def create_partitions(self, months_ahead, start=None):
+        t = self.table
+        with connection.cursor() as cur:
+            if not self.is_partitioned(cur):
+                raise CommandError(f'{t} is not partitioned; run with --convert first')
+            # never overlap the legacy partition
+            legacy_end = max((u for _, l, u in self.partitions(cur) if l == 'MINVALUE'), default=None)
+            first = start or month_start(date.today())
+            if legacy_end:
+                first = max(first, date.fromisoformat(legacy_end[:10]))
+            last = month_start(date.today(), months_ahead)
+            m = first
+            while m <= last:
+                name = f'{t}_p{m:%Y%m}'
+                cur.execute('SELECT to_regclass(%s)', [name])
+                if cur.fetchone()[0] is None:
+                    with transaction.atomic():
+                        cur.execute(f'CREATE TABLE {self.q(name)} PARTITION OF {self.q(t)} '
+                                    f'FOR VALUES FROM (%s) TO (%s)', [m, month_start(m, 1)])
+                        cur.execute(f'ALTER TABLE {self.q(name)} ADD PRIMARY KEY (id)')
+                    self.stdout.write(self.style.SUCCESS(f'created {name}'))
+                m = month_start(m, 1)
+
+    def detach_partitions(self, months, drop):
+        t = self.table
+        cutoff = month_start(date.today(), -months)
+        with connection.cursor() as cur:
+            if not self.is_partitioned(cur):
+                raise CommandError(f'{t} is not partitioned')
+            for name, lower, upper in self.partitions(cur):
+                if upper is None or upper == 'MAXVALUE' or date.fromisoformat(upper[:10]) > cutoff:
+                    continue
+                with transaction.atomic():
+                    cur.execute(f'ALTER TABLE {self.q(t)} DETACH PARTITION {self.q(name)}')
+                    if drop:
+                        cur.execute(f'DROP TABLE {self.q(name)}')
+                self.stdout.write(self.style.WARNING(
+                    f"{'dropped' if drop else 'detached'} {name} (< {upper[:10]})"))
+
+    def status(self):
+        with connection.cursor() as cur:
+            if not self.is_partitioned(cur):
+                self.stdout.write(f'{self.table} is not partitioned')
+                return
+            for name, lower, upper in self.partitions(cur):
+                cur.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [name])
+                rows = cur.fetchone()[0]
+                bounds = 'DEFAULT' if lower is None else f'{lower[:10]} .. {upper[:10]}'
+                self.stdout.write(f'{name:45} {bounds:26} ~{max(rows, 0)} rows')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from vehicles.latest_positions import latest_positions
+from vehicles.models import Vehicle, VehicleLatestPosition, VehicleLocation
+
+
+class Command(BaseCommand):
+    help = 'Fill VehicleLatestPosition from the newest VehicleLocation of every vehicle'
+
+    def handle(self, *args, **options):
+        loc_table = connection.ops.quote_name(VehicleLocation._meta.db_table)
+        pos_table = connection.ops.quote_name(VehicleLatestPosition._meta.db_table)
+        with connection.cursor() as cur:
+            if connection.vendor == 'postgresql':
+                # one pass over the (vehicle, time) index
+                cur.execute(f'''
+                    INSERT INTO {pos_table} (vehicle_id, lat, lon, speed, sat, "time", updated_at)
+                    SELECT DISTINCT ON (vehicle_id) vehicle_id, lat, lon, coalesce(speed, 0),
+                           coalesce(sat, 0), "time", now()
+                    FROM {loc_table} WHERE "time" IS NOT NULL
+                    ORDER BY vehicle_id, "time" DESC
+                    ON CONFLICT (vehicle_id) DO UPDATE SET lat = excluded.lat, lon = excluded.lon,
+                        speed = excluded.speed, sat = excluded.sat, "time" = excluded."time",
+                        updated_at = excluded.updated_at
+                ''')
+                count = cur.rowcount
+            else:
+                count = 0
+                for veh_id in Vehicle.objects.values_list('veh_id', flat=True):
+                    loc = (VehicleLocation.objects.filter(vehicle_id=veh_id, time__isnull=False)
+                           .order_by('-time').first())
+                    if loc is None:
+                        continue
+                    VehicleLatestPosition.objects.update_or_create(
+                        vehicle_id=veh_id,
+                        defaults={'lat': loc.lat, 'lon': loc.lon, 'speed': loc.speed or 0,
+                                  'sat': loc.sat or 0, 'time': loc.time})
+                    count += 1
+        if latest_positions.shared:
+            latest_positions.reload()
+        self.stdout.write(self.style.SUCCESS(f'{count} latest positions written'))
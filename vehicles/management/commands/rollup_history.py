@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from vehicles.rollups import catch_up, rebuild
+
+
+class Command(BaseCommand):
+    help = ('Rebuild daily/hourly vehicle rollups. Without --from, rebuild today and the last '
+            'ROLLUP_LOOKBACK_DAYS days (the catch-up job)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='first', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='last', help='Last day to rebuild (default: today)')
+        parser.add_argument('--vehicle', type=int, action='append', dest='vehicles', metavar='VEH_ID',
+                            help='Only these vehicles (repeatable)')
+        parser.add_argument('--loop', type=float, metavar='SECONDS',
+                            help='Keep running the catch-up every SECONDS')
+
+    def handle(self, *args, **options):
+        first = parse_date(options['first']) if options['first'] else None
+        last = parse_date(options['last']) if options['last'] else timezone.localdate()
+        if options['first'] and first is None or options['last'] and last is None:
+            raise CommandError('dates must be YYYY-MM-DD')
+        while True:
+            started = time.perf_counter()
+            if first:
+                totals = rebuild(first, last, options['vehicles'])
+            else:
+                totals = catch_up(options['vehicles'])
+            self.stdout.write(
+                f"{totals['days']} days, {totals['daily_rows']} daily and {totals['hourly_rows']} "
+                f"hourly rows in {time.perf_counter() - started:.2f}s")
+            if not options['loop']:
+                break
+            first = None  # a backfill runs once, then the loop only catches up
+            time.sleep(options['loop'])
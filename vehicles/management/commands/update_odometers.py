@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from vehicles.trips import update_odometers
+
+
+class Command(BaseCommand):
+    help = ('Add the distance driven since the last run to Vehicle.odometer and today\'s km '
+            '(Vehicle.tkm), using the vectorized trip engine')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, action='append', dest='vehicles', metavar='VEH_ID',
+                            help='Only these vehicles (repeatable)')
+        parser.add_argument('--since', help='Start for vehicles processed for the first time '
+                                            '(ISO datetime; default: start of today)')
+        parser.add_argument('--loop', type=float, metavar='SECONDS',
+                            help='Keep running, every SECONDS')
+
+    def handle(self, *args, **options):
+        since = parse_datetime(options['since']) if options['since'] else None
+        while True:
+            started = time.perf_counter()
+            totals = update_odometers(veh_ids=options['vehicles'], since=since)
+            self.stdout.write(
+                f"{totals['vehicles']} vehicles, {totals['points']} fixes, {totals['km']:.2f} km, "
+                f"{totals['dropped']} jumps dropped in {time.perf_counter() - started:.2f}s")
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
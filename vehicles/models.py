@@ -110,7 +110,8 @@ class Vehicle(models.Model):
 
 class VehicleLocation(models.Model):
     id = models.AutoField(primary_key=True)
-    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='locations')
+    # db_index=False: the (vehicle, time) index below already serves vehicle lookups
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='locations', db_index=False)
     lat = models.DecimalField(max_digits=12, decimal_places=8)
     lon = models.DecimalField(max_digits=12, decimal_places=8)
     speed = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
@@ -119,7 +120,173 @@ class VehicleLocation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['-time', '-created_at']
+        # no default ordering: it forced a sort on every history query; ask
+        # for order_by('time') / order_by('-time') explicitly instead
+        indexes = [
+            # latest fix, time-range reads and (time, id) keyset pages for one vehicle
+            models.Index(fields=['vehicle', 'time', 'id'], name='vehloc_vehicle_time_id_idx'),
+            # fleet-wide time-range scans use a BRIN index on time, which is
+            # PostgreSQL-only and so created after migrate (see vehicles.apps)
+        ]
 
     def __str__(self):
-        return f"Loc {self.vehicle_id} @ {self.lat},{self.lon} ({self.time})"
\ No newline at end of file
+        return f"Loc {self.vehicle_id} @ {self.lat},{self.lon} ({self.time})"
+
+class VehicleLatestPosition(models.Model):
+    """Last known fix per vehicle, upserted in place by the ingest writer.
+
+    A narrow copy of the newest `VehicleLocation` row so fleet-wide pages
+    read one indexed row per vehicle instead of searching the history.
+    """
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='latest_position')
+    lat = models.DecimalField(max_digits=12, decimal_places=8)
+    lon = models.DecimalField(max_digits=12, decimal_places=8)
+    speed = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    sat = models.IntegerField(default=0)
+    time = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Latest {self.vehicle_id} @ {self.lat},{self.lon} ({self.time})"
+
+
+class VehicleOdometerState(models.Model):
+    """Where the trip/odometer engine stopped for a vehicle (see `vehicles.trips`).
+
+    The last fix that was processed is kept so the next run continues the
+    distance from it instead of re-reading history.
+    """
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='odometer_state')
+    last_time = models.DateTimeField()
+    last_lat = models.FloatField()
+    last_lon = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Odometer state {self.vehicle_id} @ {self.last_time}"
+
+
+class VehicleDailyRollup(models.Model):
+    """Per-vehicle, per-local-day summary of history (see `vehicles.rollups`)."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    distance_km = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    max_speed = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    avg_speed = models.DecimalField(max_digits=6, decimal_places=2, default=0)  # while moving
+    moving_seconds = models.IntegerField(default=0)
+    idle_seconds = models.IntegerField(default=0)
+    stops = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    first_fix = models.DateTimeField(null=True, blank=True)
+    last_fix = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'date'], name='vehdaily_vehicle_date_uniq'),
+        ]
+        indexes = [models.Index(fields=['date'], name='vehdaily_date_idx')]
+
+    def __str__(self):
+        return f"Daily {self.vehicle_id} {self.date}: {self.distance_km} km"
+
+
+class VehicleHourlyRollup(models.Model):
+    """Per-vehicle, per-hour summary of history; `hour` is the start of the hour."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='hourly_rollups')
+    hour = models.DateTimeField()
+    distance_km = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    max_speed = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    avg_speed = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    moving_seconds = models.IntegerField(default=0)
+    idle_seconds = models.IntegerField(default=0)
+    stops = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    first_fix = models.DateTimeField(null=True, blank=True)
+    last_fix = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'hour'], name='vehhourly_vehicle_hour_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Hourly {self.vehicle_id} {self.hour}: {self.distance_km} km"
+
+
+class Geofence(models.Model):
+    """A circle or polygon zone; enter/exit is checked on ingest (see `devices.geofences`).
+
+    A fence with no `client` applies to every vehicle, otherwise only to
+    that client's vehicles. Polygon `points` are [[lat, lon], ...].
+    """
+    class Kind(models.TextChoices):
+        CIRCLE = 'circle', 'Circle'
+        POLYGON = 'polygon', 'Polygon'
+
+    client = models.ForeignKey(Admin, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='geofences')
+    name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=10, choices=Kind.choices, default=Kind.CIRCLE)
+    center_lat = models.FloatField(null=True, blank=True)
+    center_lon = models.FloatField(null=True, blank=True)
+    radius_m = models.FloatField(null=True, blank=True)
+    points = models.JSONField(default=list, blank=True)
+    active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['updated_at'], name='geofence_updated_idx')]
+
+    def __str__(self):
+        return f"{self.name} ({self.kind})"
+
+
+class GeofenceEvent(models.Model):
+    class Event(models.TextChoices):
+        ENTER = 'enter', 'Enter'
+        EXIT = 'exit', 'Exit'
+
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='geofence_events',
+                                db_index=False)
+    # no FK constraint: events are written in ingest batches, and a fence
+    # deleted meanwhile must not fail the whole batch
+    geofence = models.ForeignKey(Geofence, on_delete=models.CASCADE, related_name='events',
+                                 db_constraint=False)
+    event = models.CharField(max_length=5, choices=Event.choices)
+    lat = models.DecimalField(max_digits=12, decimal_places=8)
+    lon = models.DecimalField(max_digits=12, decimal_places=8)
+    time = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['vehicle', 'time'], name='geoevent_vehicle_time_idx')]
+
+    def __str__(self):
+        return f"{self.vehicle_id} {self.event} {self.geofence_id} ({self.time})"
+
+
+class VehicleAlarm(models.Model):
+    """An alarm raised by a tracker (SOS, power cut, ...) or by a rule (see `devices.alarms`)."""
+    class Source(models.TextChoices):
+        DEVICE = 'device', 'Device'
+        RULE = 'rule', 'Rule'
+
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='alarms', db_index=False)
+    kind = models.CharField(max_length=32)
+    source = models.CharField(max_length=6, choices=Source.choices, default=Source.DEVICE)
+    code = models.IntegerField(null=True, blank=True)  # raw tracker alarm code
+    lat = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
+    lon = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
+    speed = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    time = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['vehicle', 'time'], name='vehalarm_vehicle_time_idx')]
+
+    def __str__(self):
+        return f"{self.vehicle_id} {self.kind} ({self.time})"
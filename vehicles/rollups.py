@@ -0,0 +1,182 @@
+"""Daily and hourly per-vehicle rollups of location history.
+
+`rebuild()` recomputes `VehicleDailyRollup` and `VehicleHourlyRollup` rows
+for a range of local days with the trip engine (`vehicles.trips`). It reads
+each day's history once and replaces that range's rows in one transaction,
+so it is safe to re-run. `catch_up()` rebuilds the last
+`ROLLUP_LOOKBACK_DAYS` days plus today; run it periodically with
+`manage.py rollup_history --loop SECONDS` so late fixes are picked up.
+
+Reports read only these rows. A month of a few hundred vehicles is a few
+thousand daily rows instead of millions of fixes.
+"""
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from .models import VehicleDailyRollup, VehicleHourlyRollup
+from .trips import NUMPY_AVAILABLE, _require_numpy, bucket_totals, load_series, segment, vehicle_report
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+def _midnight(day, tz):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()), tz)
+
+
+def _rows(model, veh_id, key, keys, totals, tz):
+    """Model instances for the non-empty buckets of `bucket_totals()` output."""
+    out = []
+    for i, k in enumerate(keys):
+        if not totals['points'][i] and not totals['km'][i]:
+            continue
+        first, last = totals['first_t'][i], totals['last_t'][i]
+        out.append(model(**{
+            'vehicle_id': veh_id,
+            key: k,
+            'distance_km': Decimal(str(round(float(totals['km'][i]), 2))),
+            'max_speed': Decimal(str(round(float(totals['max_speed'][i]), 2))),
+            'avg_speed': Decimal(str(round(float(totals['avg_speed'][i]), 2))),
+            'moving_seconds': int(totals['moving_s'][i]),
+            'idle_seconds': int(totals['idle_s'][i]),
+            'stops': int(totals['stops'][i]),
+            'points': int(totals['points'][i]),
+            'first_fix': None if np.isnan(first) else datetime.fromtimestamp(float(first), tz),
+            'last_fix': None if np.isnan(last) else datetime.fromtimestamp(float(last), tz),
+        }))
+    return out
+
+
+def rebuild(first_day, last_day, veh_ids=None):
+    """Recompute rollups for local days `first_day`..`last_day` (inclusive).
+
+    Returns {'days', 'vehicles', 'daily_rows', 'hourly_rows'}.
+    """
+    _require_numpy()
+    tz = timezone.get_current_timezone()
+    totals = {'days': 0, 'vehicles': 0, 'daily_rows': 0, 'hourly_rows': 0}
+    day = first_day
+    while day <= last_day:
+        start, end = _midnight(day, tz), _midnight(day + timedelta(days=1), tz)
+        # one earlier fix lets the first segment of the day be measured
+        lead = timedelta(seconds=getattr(settings, 'TRIP_MAX_GAP_SECONDS', 600))
+        series = load_series(start - lead, end, veh_ids)
+        day_edges = np.array([start.timestamp(), end.timestamp()])
+        hour_edges = np.arange(start.timestamp(), end.timestamp() + 1, 3600.0)
+        hours = [datetime.fromtimestamp(h, tz) for h in hour_edges[:-1]]
+
+        daily, hourly = [], []
+        for veh_id, (t, lat, lon, speed) in series.items():
+            seg = segment(t, lat, lon, speed)
+            daily += _rows(VehicleDailyRollup, veh_id, 'date', [day], bucket_totals(seg, day_edges), tz)
+            hourly += _rows(VehicleHourlyRollup, veh_id, 'hour', hours, bucket_totals(seg, hour_edges), tz)
+
+        with transaction.atomic():
+            stale_daily = VehicleDailyRollup.objects.filter(date=day)
+            stale_hourly = VehicleHourlyRollup.objects.filter(hour__gte=start, hour__lt=end)
+            if veh_ids is not None:
+                stale_daily = stale_daily.filter(vehicle_id__in=list(veh_ids))
+                stale_hourly = stale_hourly.filter(vehicle_id__in=list(veh_ids))
+            stale_daily.delete()
+            stale_hourly.delete()
+            VehicleDailyRollup.objects.bulk_create(daily, batch_size=1000)
+            VehicleHourlyRollup.objects.bulk_create(hourly, batch_size=1000)
+
+        totals['days'] += 1
+        totals['vehicles'] = max(totals['vehicles'], len(daily))
+        totals['daily_rows'] += len(daily)
+        totals['hourly_rows'] += len(hourly)
+        day += timedelta(days=1)
+    return totals
+
+
+def catch_up(veh_ids=None):
+    """Rebuild today and the previous `ROLLUP_LOOKBACK_DAYS` days."""
+    today = timezone.localdate()
+    lookback = getattr(settings, 'ROLLUP_LOOKBACK_DAYS', 1)
+    return rebuild(today - timedelta(days=lookback), today, veh_ids)
+
+
+def daily_rows(veh_id, first_day, last_day):
+    """Daily rollup rows of one vehicle, oldest first."""
+    return list(VehicleDailyRollup.objects
+                .filter(vehicle_id=veh_id, date__gte=first_day, date__lte=last_day)
+                .order_by('date')
+                .values('date', 'distance_km', 'max_speed', 'avg_speed', 'moving_seconds',
+                        'idle_seconds', 'stops', 'points', 'first_fix', 'last_fix'))
+
+
+def _day_runs(days):
+    """Group sorted dates into [(first, last)] runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def vehicle_summary(veh_id, start, end):
+    """Report of one vehicle between `start` and `end` from its daily rollups.
+
+    Days without a rollup row (not rolled up yet, or no fixes) are computed
+    from history, one query per run of consecutive days, and listed in
+    `history_days`. If that is not possible (numpy missing) they are listed
+    in `uncovered_days` instead and left out of the totals.
+    """
+    tz = timezone.get_current_timezone()
+    first_day, last_day = timezone.localdate(start), timezone.localdate(end - timedelta(seconds=1))
+    rows = daily_rows(veh_id, first_day, last_day)
+    report = {
+        'distance_km': sum(float(r['distance_km']) for r in rows),
+        'moving_s': sum(r['moving_seconds'] for r in rows),
+        'stopped_s': sum(r['idle_seconds'] for r in rows),
+        'stop_count': sum(r['stops'] for r in rows),
+        'max_speed': max((float(r['max_speed']) for r in rows), default=0.0),
+        'days': [{'date': r['date'], 'km': float(r['distance_km']), 'moving_s': r['moving_seconds'],
+                  'max_speed': float(r['max_speed'])} for r in rows],
+        'history_days': [],
+        'uncovered_days': [],
+    }
+    covered = {r['date'] for r in rows}
+    missing = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    missing = [day for day in missing if day not in covered]
+    if missing and not NUMPY_AVAILABLE:
+        report['uncovered_days'] = missing
+        missing = []
+    for first, last in _day_runs(missing):
+        part = vehicle_report(veh_id, max(start, _midnight(first, tz)),
+                              min(end, _midnight(last + timedelta(days=1), tz)))
+        report['distance_km'] += part['distance_km']
+        report['moving_s'] += part['moving_s']
+        report['stopped_s'] += part['stopped_s']
+        report['stop_count'] += len(part['stops'])
+        report['max_speed'] = max(report['max_speed'], part['max_speed'])
+        report['days'] += [dict(v, date=d) for d, v in part['days'].items()]
+        report['history_days'] += sorted(part['days'])
+    report['days'].sort(key=lambda d: d['date'])
+    return report
+
+
+def fleet_summary(first_day, last_day, vehicles=None):
+    """Per-vehicle totals over a day range, straight from the daily rollups."""
+    qs = VehicleDailyRollup.objects.filter(date__gte=first_day, date__lte=last_day)
+    if vehicles is not None:
+        qs = qs.filter(vehicle__in=vehicles)
+    return list(qs.values('vehicle_id', 'vehicle__reg_no', 'vehicle__name')
+                .annotate(distance_km=Sum('distance_km'), max_speed=Max('max_speed'),
+                          moving_seconds=Sum('moving_seconds'), idle_seconds=Sum('idle_seconds'),
+                          stops=Sum('stops'), days=Count('id'),
+                          first_fix=Min('first_fix'), last_fix=Max('last_fix'))
+                .order_by('vehicle__reg_no'))
@@ -0,0 +1,52 @@
+"""Benchmarks of the history codec and track encoding (pytest-benchmark).
+
+See devices/test_benchmarks.py for how to time them.
+"""
+import math
+
+import pytest
+
+from vehicles import history_store
+from vehicles.track import decode_polyline, douglas_peucker, encode_polyline
+
+POINTS = [(23.8 + 0.01 * math.sin(i / 50), 90.4 + i * 1e-4) for i in range(10000)]
+
+needs_numpy = pytest.mark.skipif(not history_store.NUMPY_AVAILABLE, reason='numpy is not installed')
+
+
+@pytest.fixture(scope='module')
+def records():
+    np = history_store.np
+    n = 86400 // 10
+    rec = np.zeros(n, dtype=history_store.RAW_DTYPE)
+    rec['t'] = 1714521600 + np.arange(n) * 10
+    rec['lat'] = [round(lat * history_store.COORD_SCALE) for lat, _ in POINTS[:n]]
+    rec['lon'] = [round(lon * history_store.COORD_SCALE) for _, lon in POINTS[:n]]
+    rec['speed'] = np.arange(n) % 600
+    rec['sat'] = 9
+    return rec
+
+
+@needs_numpy
+def test_encode_chunk(benchmark, records):
+    buf = benchmark(history_store.encode_chunk, records)
+    assert len(buf) < records.nbytes
+
+
+@needs_numpy
+def test_decode_chunk(benchmark, records):
+    buf = history_store.encode_chunk(records)
+    assert len(benchmark(history_store.decode_chunk, buf)) == len(records)
+
+
+def test_encode_polyline(benchmark):
+    assert benchmark(encode_polyline, POINTS)
+
+
+def test_decode_polyline(benchmark):
+    encoded = encode_polyline(POINTS)
+    assert len(benchmark(decode_polyline, encoded)) == len(POINTS)
+
+
+def test_douglas_peucker(benchmark):
+    assert len(benchmark(douglas_peucker, POINTS, 5.0)) < len(POINTS)
@@ -1,3 +1,191 @@
-from django.test import TestCase
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from vehicles import history_store, rollups, trips
+from vehicles.history import InvalidCursor, decode_cursor, encode_cursor, history_page
+from vehicles.latest_positions import is_newer
+from vehicles.models import Vehicle, VehicleDailyRollup, VehicleLocation, VehicleOdometerState
+from vehicles.track import decode_polyline, encode_polyline
+
+T0 = datetime(2024, 5, 1, 6, 0, tzinfo=dt_timezone.utc)
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        t = T0 + timedelta(microseconds=250)
+        self.assertEqual(decode_cursor(encode_cursor(t, 123456789)), (t, 123456789))
+
+    def test_invalid_cursor(self):
+        for cursor in ('', 'not a cursor', encode_cursor(T0, 1)[:-3], 'MjAyNHwx'):
+            with self.assertRaises(InvalidCursor, msg=cursor):
+                decode_cursor(cursor)
+
+    def test_pages_cover_history_once(self):
+        veh = Vehicle.objects.create(user_id=0, imei='359710049095095', reg_no='TEST-1', type='car')
+        # pairs of fixes share a timestamp, so pages break inside a tie
+        VehicleLocation.objects.bulk_create([
+            VehicleLocation(vehicle=veh, lat=23.8, lon=90.4, speed=i, sat=9, time=T0 + timedelta(seconds=i // 2))
+            for i in range(25)
+        ])
+        seen, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = history_page(veh.veh_id, cursor=cursor, limit=4)
+            seen += rows
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 7)
+        self.assertEqual([r['speed'] for r in seen], list(range(25)))
+        self.assertEqual(len({r['id'] for r in seen}), 25)
+
+
+@unittest.skipUnless(trips.NUMPY_AVAILABLE, 'numpy is not installed')
+@override_settings(ODOMETER_MAX_LOOKBACK_DAYS=7)
+class UpdateOdometersTests(TestCase):
+    def vehicle(self, n, last_time):
+        veh = Vehicle.objects.create(user_id=0, imei=f'35971004909500{n}', reg_no=f'TEST-{n}', type='car')
+        VehicleOdometerState.objects.create(vehicle=veh, last_time=last_time, last_lat=23.8, last_lon=90.4)
+        return veh
+
+    def fixes(self, veh, *ages):
+        VehicleLocation.objects.bulk_create([
+            VehicleLocation(vehicle=veh, lat=23.8 + i * 0.001, lon=90.4, speed=40, sat=9, time=T0 - age)
+            for i, age in enumerate(ages)
+        ])
+
+    def test_each_vehicle_resumes_from_its_own_state(self):
+        offline = self.vehicle(1, T0 - timedelta(days=60))
+        online = self.vehicle(2, T0 - timedelta(minutes=10))
+        self.fixes(offline, timedelta(days=30), timedelta(minutes=60), timedelta(minutes=59))
+        self.fixes(online, timedelta(minutes=20), timedelta(minutes=5), timedelta(minutes=4))
+        with mock.patch.object(trips, 'load_series', wraps=trips.load_series) as load:
+            totals = trips.update_odometers(until=T0)
+        # the offline tracker only drags its own (capped) window back, not the fleet's
+        self.assertEqual([c.args[:3] for c in load.call_args_list],
+                         [(T0 - timedelta(days=7), T0, [offline.veh_id]),
+                          (T0 - timedelta(minutes=10), T0, [online.veh_id])])
+        self.assertEqual((totals['vehicles'], totals['points']), (2, 4))
+        state = VehicleOdometerState.objects.get(vehicle=offline)
+        self.assertEqual(state.last_time, T0 - timedelta(minutes=59))
+
+    def test_close_resume_times_share_a_query(self):
+        a = self.vehicle(1, T0 - timedelta(minutes=10))
+        b = self.vehicle(2, T0 - timedelta(minutes=2))
+        self.fixes(a, timedelta(minutes=1))
+        self.fixes(b, timedelta(minutes=1))
+        with mock.patch.object(trips, 'load_series', wraps=trips.load_series) as load:
+            trips.update_odometers(until=T0)
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(sorted(load.call_args.args[2]), [a.veh_id, b.veh_id])
+
+
+@unittest.skipUnless(trips.NUMPY_AVAILABLE, 'numpy is not installed')
+@override_settings(TIME_ZONE='UTC')
+class VehicleSummaryTests(TestCase):
+    def setUp(self):
+        self.veh = Vehicle.objects.create(user_id=0, imei='359710049095095', reg_no='TEST-1', type='car')
+        self.day = T0.date()
+        VehicleDailyRollup.objects.create(vehicle=self.veh, date=self.day, distance_km=Decimal('12.50'),
+                                          max_speed=Decimal('60'), moving_seconds=900, idle_seconds=300,
+                                          stops=2, points=100)
+
+    def test_days_without_rollups_come_from_history(self):
+        # the next day has fixes but no rollup row yet
+        VehicleLocation.objects.bulk_create([
+            VehicleLocation(vehicle=self.veh, lat=23.8 + i * 0.001, lon=90.4, speed=40, sat=9,
+                            time=T0 + timedelta(days=1, minutes=i))
+            for i in range(10)
+        ])
+        end = T0.replace(hour=0) + timedelta(days=3)
+        report = rollups.vehicle_summary(self.veh.veh_id, T0.replace(hour=0), end)
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual([d['date'] for d in report['days']], [self.day, next_day])
+        self.assertEqual(report['history_days'], [next_day])
+        self.assertGreater(report['distance_km'], 12.5)
+        self.assertEqual(report['max_speed'], 60)
+
+    def test_uncovered_days_are_reported_without_numpy(self):
+        with mock.patch.object(rollups, 'NUMPY_AVAILABLE', False):
+            report = rollups.vehicle_summary(self.veh.veh_id, T0.replace(hour=0),
+                                             T0.replace(hour=0) + timedelta(days=2))
+        self.assertEqual(report['uncovered_days'], [self.day + timedelta(days=1)])
+        self.assertEqual(report['distance_km'], 12.5)
+
+
+class IsNewerTests(SimpleTestCase):
+    def test_naive_times_are_compared_as_utc(self):
+        naive = T0.replace(tzinfo=None)
+        self.assertTrue(is_newer(naive + timedelta(seconds=1), T0))
+        self.assertFalse(is_newer(naive, T0 + timedelta(seconds=1)))
+        self.assertTrue(is_newer(T0, naive))
+
+    def test_missing_times_win(self):
+        self.assertTrue(is_newer(None, T0))
+        self.assertTrue(is_newer(T0, None))
+
+
+class PolylineTests(SimpleTestCase):
+    POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+    def test_reference_encoding(self):
+        # the example from Google's encoded polyline documentation
+        self.assertEqual(encode_polyline(self.POINTS), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_round_trip(self):
+        points = [(23.867976, 90.390219), (23.867976, 90.390219), (-33.86882, 151.20929), (0.0, -0.00001)]
+        for precision in (5, 6):
+            decoded = decode_polyline(encode_polyline(points, precision), precision)
+            for (lat, lon), (dlat, dlon) in zip(points, decoded):
+                self.assertAlmostEqual(lat, dlat, places=precision)
+                self.assertAlmostEqual(lon, dlon, places=precision)
+            self.assertEqual(len(decoded), len(points))
+
+    def test_empty(self):
+        self.assertEqual(encode_polyline([]), '')
+        self.assertEqual(decode_polyline(''), [])
+
+
+@unittest.skipUnless(history_store.NUMPY_AVAILABLE, 'numpy is not installed')
+class ColumnarCodecTests(SimpleTestCase):
+    def records(self, n):
+        np = history_store.np
+        rec = np.zeros(n, dtype=history_store.RAW_DTYPE)
+        rec['t'] = 1714543200 + np.arange(n) * 10
+        rec['lat'] = 23800000 + np.arange(n) * 37
+        rec['lon'] = -90400000 - np.arange(n) * 11
+        rec['speed'] = np.arange(n) % 900
+        rec['sat'] = np.arange(n) % 13
+        return rec
+
+    def test_chunk_round_trip_sorts_by_time(self):
+        np = history_store.np
+        rec = self.records(1000)
+        shuffled = rec[np.random.default_rng(1).permutation(len(rec))]
+        decoded = history_store.decode_chunk(history_store.encode_chunk(shuffled))
+        self.assertEqual(decoded.dtype, history_store.RAW_DTYPE)
+        self.assertTrue(np.array_equal(decoded, rec))
+
+    def test_chunk_is_smaller_than_raw(self):
+        rec = self.records(1000)
+        self.assertLess(len(history_store.encode_chunk(rec)), rec.nbytes / 2)
+
+    def test_empty_chunk(self):
+        decoded = history_store.decode_chunk(history_store.encode_chunk(self.records(0)))
+        self.assertEqual(len(decoded), 0)
+
+    def test_varints(self):
+        np = history_store.np
+        values = np.array([0, 1, 127, 128, 16383, 16384, 2 ** 35, 2 ** 63 - 1], dtype=np.uint64)
+        decoded = history_store.varint_decode(history_store.varint_encode(values), len(values))
+        self.assertEqual(decoded.tolist(), values.tolist())
+        deltas = np.array([5, -3, 0, 2 ** 40, -(2 ** 40)], dtype=np.int64)
+        self.assertEqual(history_store.delta_decode(history_store.delta_encode(deltas), 5).tolist(),
+                         deltas.tolist())
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            history_store.decode_chunk(b'XXXX' + bytes(8))
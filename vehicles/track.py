@@ -0,0 +1,208 @@
+"""Track engine: history rows -> simplified, encoded polyline.
+
+`build_track()` streams `(lat, lon, speed, time)` tuples for one vehicle
+and time window straight from the cursor (or reads them as arrays from the
+columnar store, see `history_store`). It thins them in two steps:
+
+1. time buckets, keeping the last fix of each bucket, so a multi-day
+   window never holds more than `TRACK_MAX_RAW_POINTS` points in memory;
+2. Douglas-Peucker with a tolerance of about one screen pixel at the
+   requested map zoom. The tolerance is doubled until at most
+   `TRACK_MAX_POINTS` points remain.
+
+The result is one Google encoded polyline string. Its size depends on the
+shape of the route, not on how many fixes were recorded.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+
+from . import history_store
+from .models import VehicleLocation
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+EARTH_M_PER_DEG = 111320.0
+
+
+def encode_polyline(points, precision=5):
+    """Encode [(lat, lon), ...] with Google's polyline algorithm."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat, ilon = round(lat * factor), round(lon * factor)
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            v = ~(delta << 1) if delta < 0 else delta << 1
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1f)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return ''.join(out)
+
+
+def decode_polyline(s, precision=5):
+    """Inverse of `encode_polyline`."""
+    factor = 10 ** precision
+    points, idx, lat, lon = [], 0, 0, 0
+    while idx < len(s):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(s[idx]) - 63
+                idx += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def zoom_tolerance(zoom, lat=0.0, pixels=1.0):
+    """Metres covered by `pixels` screen pixels at web-map `zoom` and latitude `lat`."""
+    return 156543.03392 * math.cos(math.radians(lat)) / (2 ** zoom) * pixels
+
+
+def douglas_peucker(points, tolerance_m):
+    """Indices of `points` [(lat, lon, ...)] kept by Douglas-Peucker.
+
+    Distances use an equirectangular projection around the first point,
+    which is accurate enough at track scale. Iterative, so long tracks do
+    not hit the recursion limit.
+    """
+    n = len(points)
+    if n < 3:
+        return list(range(n))
+    kx = EARTH_M_PER_DEG * math.cos(math.radians(points[0][0]))
+    xs = [p[1] * kx for p in points]
+    ys = [p[0] * EARTH_M_PER_DEG for p in points]
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    tol2 = tolerance_m * tolerance_m
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1, x2, y2 = xs[first], ys[first], xs[last], ys[last]
+        dx, dy = x2 - x1, y2 - y1
+        seg2 = dx * dx + dy * dy
+        best, best_d2 = -1, tol2
+        for i in range(first + 1, last):
+            px, py = xs[i] - x1, ys[i] - y1
+            if seg2 == 0:
+                d2 = px * px + py * py
+            else:
+                t = max(0.0, min(1.0, (px * dx + py * dy) / seg2))
+                ex, ey = px - t * dx, py - t * dy
+                d2 = ex * ex + ey * ey
+            if d2 > best_d2:
+                best, best_d2 = i, d2
+        if best >= 0:
+            keep[best] = True
+            stack.append((first, best))
+            stack.append((best, last))
+    return [i for i in range(n) if keep[i]]
+
+
+def _db_points(veh_id, start, end, bucket):
+    """(raw count, thinned points) from `VehicleLocation` rows."""
+    rows = (VehicleLocation.objects
+            .filter(vehicle_id=veh_id, time__gte=start, time__lt=end)
+            .order_by('time')
+            .values_list('lat', 'lon', 'speed', 'time')
+            .iterator(chunk_size=5000))
+    # keep the first fix and the last fix of every time bucket
+    raw, points, pending, current = 0, [], None, None
+    for lat, lon, speed, t in rows:
+        raw += 1
+        p = (float(lat), float(lon), float(speed or 0), t)
+        b = int(t.timestamp() // bucket)
+        if not points:
+            points.append(p)
+            current = b
+            continue
+        if b != current and pending is not None:
+            points.append(pending)
+        current, pending = b, p
+    if pending is not None:
+        points.append(pending)
+    return raw, points
+
+
+def _store_points(veh_id, start, end, bucket):
+    """Same as `_db_points()`, vectorized over the columnar store's arrays."""
+    s = history_store.read_series(veh_id, start, end)
+    n = len(s.t)
+    if not n:
+        return 0, []
+    b = (s.t // bucket).astype(np.int64)
+    # last fix of every bucket, plus the very first fix
+    last = np.flatnonzero(np.append(b[1:] != b[:-1], True))
+    idx = np.concatenate(([0], last[last > 0]))
+    tz = dt_timezone.utc
+    return n, [(lat, lon, speed, datetime.fromtimestamp(t, tz)) for lat, lon, speed, t in
+               zip(s.lat[idx].tolist(), s.lon[idx].tolist(), s.speed[idx].tolist(), s.t[idx].tolist())]
+
+
+def build_track(veh_id, start, end, zoom=None):
+    """Simplified track of `veh_id` between `start` and `end`.
+
+    Returns a dict with the encoded `polyline`, `points` (kept) and
+    `raw_points` counts, `bounds` as [min_lat, min_lon, max_lat, max_lon],
+    the `tolerance_m` used, and `first`/`last` fixes as
+    {'lat', 'lon', 'speed', 'time'}.
+    """
+    max_raw = getattr(settings, 'TRACK_MAX_RAW_POINTS', 20000)
+    max_points = getattr(settings, 'TRACK_MAX_POINTS', 2000)
+    span = max((end - start).total_seconds(), 1)
+    bucket = max(span / max_raw, 1.0)
+
+    if history_store.columnar_reads():
+        raw, points = _store_points(veh_id, start, end, bucket)
+    else:
+        raw, points = _db_points(veh_id, start, end, bucket)
+
+    track = {'polyline': '', 'points': 0, 'raw_points': raw, 'bounds': None,
+             'tolerance_m': 0.0, 'first': None, 'last': None}
+    if not points:
+        return track
+
+    if zoom is None:
+        zoom = getattr(settings, 'TRACK_DEFAULT_ZOOM', 14)
+    tolerance = zoom_tolerance(zoom, points[0][0])
+    kept = douglas_peucker(points, tolerance)
+    while len(kept) > max_points:
+        tolerance *= 2
+        kept = douglas_peucker(points, tolerance)
+
+    lats = [points[i][0] for i in kept]
+    lons = [points[i][1] for i in kept]
+    track.update(
+        polyline=encode_polyline((points[i][0], points[i][1]) for i in kept),
+        points=len(kept),
+        bounds=[min(lats), min(lons), max(lats), max(lons)],
+        tolerance_m=round(tolerance, 2),
+        first=_fix(points[0]),
+        last=_fix(points[-1]),
+    )
+    return track
+
+
+def _fix(p):
+    return {'lat': p[0], 'lon': p[1], 'speed': p[2], 'time': p[3].isoformat() if p[3] else None}
+
+
+def default_window(last_time, hours=None):
+    """(start, end) ending just after `last_time`, `TRACK_DEFAULT_HOURS` long."""
+    hours = hours or getattr(settings, 'TRACK_DEFAULT_HOURS', 24)
+    end = last_time + timedelta(seconds=1)
+    return end - timedelta(hours=hours), end
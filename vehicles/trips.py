@@ -0,0 +1,384 @@
+"""Vectorized trip / odometer engine over `VehicleLocation` history.
+
+History is loaded into NumPy arrays (one query for the whole fleet, ordered
+by the (vehicle, time) index) and every step works on whole arrays:
+
+- haversine distance between consecutive fixes;
+- GPS jump filtering: fixes implying more than `TRIP_MAX_SPEED_KMH` from
+  the previous kept fix are dropped;
+- stop/move segmentation: a segment counts as moving when the device speed
+  is above `TRIP_STOP_SPEED_KMH` (or the fix moved more than
+  `TRIP_MIN_MOVE_M` at such an implied speed), and runs of
+  non-moving segments lasting at least `TRIP_MIN_STOP_SECONDS` are stops.
+  Distance is only counted on moving segments, so GPS drift while parked
+  does not add km;
+- per-day km, moving time and max speed, using local-time days.
+
+`analyze()` is the pure function, `vehicle_report()` serves
+`vehicles_report`, and `update_odometers()` is the incremental job behind
+`manage.py update_odometers`. It continues from the last processed fix
+stored in `VehicleOdometerState` (at most `ODOMETER_MAX_LOOKBACK_DAYS`
+back) and updates `Vehicle.odometer` and `Vehicle.tkm`/`tkm_date`.
+
+With the columnar history backend the series come from `history_store`.
+"""
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import history_store
+from .models import Vehicle, VehicleLocation, VehicleOdometerState
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    NUMPY_AVAILABLE = False
+
+EARTH_RADIUS_M = 6371008.8
+# update_odometers(): vehicles resuming within this span share one history query
+RESUME_GROUP_SECONDS = 3600
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError('the trip engine needs numpy (pip install numpy)')
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; works element-wise on arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def filter_jumps(t, lat, lon, max_speed_kmh, passes=3):
+    """Boolean mask of fixes to keep.
+
+    Drops repeated timestamps and fixes reached at an impossible speed. A
+    single bad fix makes both of its segments look fast, but only the
+    incoming one is blamed. Repeating a few passes handles short bursts.
+    """
+    keep = np.ones(len(t), dtype=bool)
+    limit = max_speed_kmh / 3.6
+    for _ in range(passes):
+        idx = np.flatnonzero(keep)
+        if len(idx) < 2:
+            break
+        dt = np.diff(t[idx])
+        d = haversine(lat[idx[:-1]], lon[idx[:-1]], lat[idx[1:]], lon[idx[1:]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bad = (dt <= 0) | (d / dt > limit)
+        if not bad.any():
+            break
+        # after a spike the outgoing segment is bad too; keep its end fix
+        drop = bad.copy()
+        drop[1:] &= ~bad[:-1]
+        keep[idx[1:][drop]] = False
+    return keep
+
+
+def _runs(mask):
+    """(start, end) index pairs of the True runs in `mask` (end exclusive)."""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _day_starts(t0, t1, tz):
+    """Epoch seconds of local midnights covering [t0, t1], plus their dates."""
+    first = datetime.fromtimestamp(t0, tz).date()
+    last = datetime.fromtimestamp(t1, tz).date()
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    starts = [timezone.make_aware(datetime.combine(d, datetime.min.time()), tz).timestamp() for d in days]
+    return np.array(starts), days
+
+
+def segment(t, lat, lon, speed):
+    """Jump-filter one vehicle's fixes and classify the segments between them.
+
+    Arrays must be sorted by time (t in epoch seconds). Returns a dict with
+    the kept `t`, `lat`, `lon`, `speed`, the `dropped` count, and per
+    segment (fix i -> i+1): `d` metres, `dt` seconds, `moving` and `counted`
+    (False across gaps longer than `TRIP_MAX_GAP_SECONDS`) masks and the
+    stop runs as `stop_starts`/`stop_ends` fix indices.
+    """
+    _require_numpy()
+    max_speed = getattr(settings, 'TRIP_MAX_SPEED_KMH', 200)
+    stop_speed = getattr(settings, 'TRIP_STOP_SPEED_KMH', 3)
+    min_stop = getattr(settings, 'TRIP_MIN_STOP_SECONDS', 180)
+    max_gap = getattr(settings, 'TRIP_MAX_GAP_SECONDS', 600)
+    min_move = getattr(settings, 'TRIP_MIN_MOVE_M', 50)
+
+    keep = filter_jumps(t, lat, lon, max_speed) if len(t) else np.ones(0, dtype=bool)
+    t, lat, lon, speed = t[keep], lat[keep], lon[keep], speed[keep]
+    dt = np.diff(t)
+    d = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        implied = d / dt * 3.6
+    # without a reported speed, only trust displacement beyond GPS drift
+    moving = (speed[1:] > stop_speed) | ((implied > stop_speed) & (d > min_move))
+    counted = dt <= max_gap  # time across long gaps is neither moving nor idle
+
+    starts, ends = _runs(~moving)
+    # segments s..e-1 are stationary: fixes s..e
+    long_enough = (t[ends] - t[starts] >= min_stop) if len(starts) else np.zeros(0, dtype=bool)
+    return {'t': t, 'lat': lat, 'lon': lon, 'speed': speed, 'dropped': int((~keep).sum()),
+            'd': d, 'dt': dt, 'moving': moving, 'counted': counted,
+            'stop_starts': starts[long_enough], 'stop_ends': ends[long_enough]}
+
+
+def bucket_totals(seg, edges):
+    """Aggregate a `segment()` result into time buckets [edges[i], edges[i+1]).
+
+    Segments belong to the bucket of their end fix, stops to the bucket they
+    start in. Returns a dict of arrays with one entry per bucket: `km`,
+    `moving_s`, `idle_s`, `max_speed`, `avg_speed` (km/h while moving),
+    `points`, `stops`, `first_t` and `last_t` (NaN for empty buckets).
+    """
+    n = len(edges) - 1
+    t = seg['t']
+
+    def index(times):
+        idx = np.searchsorted(edges, times, side='right') - 1
+        return idx, (idx >= 0) & (idx < n)
+
+    out = {}
+    fix_idx, ok = index(t)
+    out['points'] = np.bincount(fix_idx[ok], minlength=n)
+    out['max_speed'] = np.zeros(n)
+    np.maximum.at(out['max_speed'], fix_idx[ok], seg['speed'][ok])
+    out['first_t'] = np.full(n, np.inf)
+    np.minimum.at(out['first_t'], fix_idx[ok], t[ok])
+    out['last_t'] = np.full(n, -np.inf)
+    np.maximum.at(out['last_t'], fix_idx[ok], t[ok])
+    empty = out['points'] == 0
+    out['first_t'][empty] = np.nan
+    out['last_t'][empty] = np.nan
+
+    seg_idx, ok = index(t[1:])
+    moving, counted, dt = seg['moving'][ok], seg['counted'][ok], seg['dt'][ok]
+    dist = np.where(moving, seg['d'][ok], 0.0)
+    out['km'] = np.bincount(seg_idx[ok], weights=dist, minlength=n) / 1000
+    out['moving_s'] = np.bincount(seg_idx[ok], weights=np.where(moving & counted, dt, 0.0), minlength=n)
+    out['idle_s'] = np.bincount(seg_idx[ok], weights=np.where(~moving & counted, dt, 0.0), minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['avg_speed'] = np.where(out['moving_s'] > 0, out['km'] / (out['moving_s'] / 3600), 0.0)
+
+    stop_idx, ok = index(t[seg['stop_starts']])
+    out['stops'] = np.bincount(stop_idx[ok], minlength=n)
+    return out
+
+
+def analyze(t, lat, lon, speed, tz=None):
+    """Summarize one vehicle's fixes (arrays sorted by time, t in epoch seconds).
+
+    Returns a dict with `distance_km`, `moving_s`, `stopped_s`,
+    `max_speed`, `points`, `dropped` (jump-filtered fixes), `stops` as a
+    list of {'start', 'end', 'lat', 'lon'} dicts, `days` as
+    {date: {'km', 'moving_s', 'max_speed'}}, and `last` as
+    (t, lat, lon) for the last kept fix.
+    """
+    _require_numpy()
+    tz = tz or timezone.get_current_timezone()
+    result = {'distance_km': 0.0, 'moving_s': 0.0, 'stopped_s': 0.0, 'max_speed': 0.0,
+              'points': len(t), 'dropped': 0, 'stops': [], 'days': {}, 'last': None}
+    if len(t) == 0:
+        return result
+    seg = segment(t, lat, lon, speed)
+    t, lat, lon = seg['t'], seg['lat'], seg['lon']
+    result['dropped'] = seg['dropped']
+    result['last'] = (float(t[-1]), float(lat[-1]), float(lon[-1]))
+    result['max_speed'] = float(seg['speed'].max())
+    if len(t) < 2:
+        return result
+
+    counted = seg['counted']
+    result['distance_km'] = float(seg['d'][seg['moving']].sum() / 1000)
+    result['moving_s'] = float(seg['dt'][seg['moving'] & counted].sum())
+    result['stopped_s'] = float(seg['dt'][~seg['moving'] & counted].sum())
+    for s, e in zip(seg['stop_starts'], seg['stop_ends']):
+        result['stops'].append({'start': float(t[s]), 'end': float(t[e]),
+                                'lat': float(lat[s]), 'lon': float(lon[s])})
+
+    day_starts, days = _day_starts(t[0], t[-1] + 86400, tz)
+    totals = bucket_totals(seg, day_starts)
+    for i, day in enumerate(days[:-1]):
+        if totals['points'][i] or totals['km'][i]:
+            result['days'][day] = {'km': float(totals['km'][i]), 'moving_s': float(totals['moving_s'][i]),
+                                   'max_speed': float(totals['max_speed'][i])}
+    return result
+
+
+def load_series(start, end=None, veh_ids=None):
+    """Fixes with start < time <= end, as {veh_id: (t, lat, lon, speed)} arrays.
+
+    One ordered query for all requested vehicles; on PostgreSQL the rows
+    are fetched as plain floats, straight into one array.
+    """
+    _require_numpy()
+    if history_store.columnar_reads():
+        return _store_series(start, end, veh_ids)
+    qs = VehicleLocation.objects.filter(time__gt=start)
+    if end is not None:
+        qs = qs.filter(time__lte=end)
+    if veh_ids is not None:
+        qs = qs.filter(vehicle_id__in=list(veh_ids))
+    qs = qs.order_by('vehicle_id', 'time')
+
+    if connection.vendor == 'postgresql':
+        # same column order as the select below: ORDER BY may refer to positions
+        sql, params = qs.values_list('vehicle_id', 'time', 'lat', 'lon', 'speed').query.sql_with_params()
+        table = connection.ops.quote_name(VehicleLocation._meta.db_table)
+        inner = (f'SELECT {table}.vehicle_id::float8, extract(epoch from {table}."time")::float8, '
+                 f'{table}.lat::float8, {table}.lon::float8, coalesce({table}.speed, 0)::float8 '
+                 + sql[sql.index(' FROM '):])
+        with connection.cursor() as cur:
+            cur.execute(inner, params)
+            chunks = []
+            while True:
+                rows = cur.fetchmany(100000)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.float64))
+        data = np.concatenate(chunks) if chunks else np.empty((0, 5))
+    else:
+        data = np.array([(v, t.timestamp(), float(la), float(lo), float(sp or 0))
+                         for v, la, lo, sp, t in qs.values_list('vehicle_id', 'lat', 'lon', 'speed', 'time')
+                         .iterator(chunk_size=10000)], dtype=np.float64).reshape(-1, 5)
+
+    out = {}
+    if not len(data):
+        return out
+    ids = data[:, 0].astype(np.int64)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1, [len(ids)]))
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        out[int(ids[a])] = (data[a:b, 1], data[a:b, 2], data[a:b, 3], data[a:b, 4])
+    return out
+
+
+def _store_series(start, end=None, veh_ids=None):
+    """`load_series()` from the columnar store."""
+    store = history_store.get_store()
+    t0 = start.timestamp()
+    # the store reads [start, end); widen by a second and apply start < t <= end here
+    until = end + timedelta(seconds=1) if end is not None else None
+    out = {}
+    for veh_id in (veh_ids if veh_ids is not None else store.vehicles()):
+        s = store.read(veh_id, start, until)
+        mask = s.t > t0
+        if end is not None:
+            mask &= s.t <= end.timestamp()
+        if mask.any():
+            out[int(veh_id)] = (s.t[mask], s.lat[mask], s.lon[mask], s.speed[mask])
+    return out
+
+
+def vehicle_report(veh_id, start, end):
+    """Trip summary of one vehicle between `start` and `end` (aware datetimes)."""
+    t, lat, lon, speed = load_series(start, end, [veh_id]).get(veh_id, (np.empty(0),) * 4)
+    result = analyze(t, lat, lon, speed)
+    tz = timezone.get_current_timezone()
+    for stop in result['stops']:
+        stop['start'] = datetime.fromtimestamp(stop['start'], tz)
+        stop['end'] = datetime.fromtimestamp(stop['end'], tz)
+    return result
+
+
+def _resume_groups(resume):
+    """Split {veh_id: resume time} into [(start, veh_ids)] spanning at most RESUME_GROUP_SECONDS each."""
+    groups = []
+    for veh_id, t in sorted(resume.items(), key=lambda item: item[1]):
+        if not groups or (t - groups[-1][0]).total_seconds() > RESUME_GROUP_SECONDS:
+            groups.append((t, []))
+        groups[-1][1].append(veh_id)
+    return groups
+
+
+def update_odometers(until=None, veh_ids=None, since=None):
+    """Add the distance driven since the last run to each vehicle's odometer.
+
+    Vehicles without saved state start at `since` (default: start of
+    today). A vehicle resumes from its own last processed fix, but never
+    from further back than `ODOMETER_MAX_LOOKBACK_DAYS`: after a longer
+    silence the distance is counted from that point on, without joining
+    the old fix. Vehicles with close resume times share one history query.
+    Returns {'vehicles', 'points', 'km', 'dropped'}.
+    """
+    _require_numpy()
+    tz = timezone.get_current_timezone()
+    until = until or timezone.now()
+    today = timezone.localdate(until)
+    since = since or timezone.make_aware(datetime.combine(today, datetime.min.time()), tz)
+
+    vehicles = Vehicle.objects.all()
+    if veh_ids is not None:
+        vehicles = vehicles.filter(veh_id__in=list(veh_ids))
+    vehicles = {v.veh_id: v for v in vehicles.only('veh_id', 'odometer', 'tkm', 'tkm_date')}
+    states = {s.vehicle_id: s for s in VehicleOdometerState.objects.filter(vehicle_id__in=vehicles)}
+
+    lookback = getattr(settings, 'ODOMETER_MAX_LOOKBACK_DAYS', 7)
+    floor = until - timedelta(days=lookback) if lookback else None
+    resume = {veh_id: states[veh_id].last_time if veh_id in states else since for veh_id in vehicles}
+    stale = [veh_id for veh_id in states if floor is not None and states[veh_id].last_time < floor]
+    for veh_id in stale:
+        del states[veh_id]
+        resume[veh_id] = floor
+    if stale:
+        logger.warning('%d vehicles were last processed before %s; their distance before it is not counted',
+                       len(stale), floor.isoformat())
+
+    series = {}
+    for start, ids in _resume_groups(resume):
+        series.update(load_series(start, until, ids))
+
+    use_odometer = getattr(settings, 'ODOMETER_SOURCE', 'computed') == 'computed'
+    totals = {'vehicles': 0, 'points': 0, 'km': 0.0, 'dropped': 0}
+    changed, new_states = [], []
+    for veh_id, (t, lat, lon, speed) in series.items():
+        state = states.get(veh_id)
+        after = resume[veh_id].timestamp()
+        mask = t > after
+        if not mask.any():
+            continue
+        t, lat, lon, speed = t[mask], lat[mask], lon[mask], speed[mask]
+        if state is not None:
+            # continue the distance from the last processed fix
+            t = np.concatenate(([state.last_time.timestamp()], t))
+            lat = np.concatenate(([state.last_lat], lat))
+            lon = np.concatenate(([state.last_lon], lon))
+            speed = np.concatenate(([0.0], speed))
+        result = analyze(t, lat, lon, speed, tz)
+
+        veh = vehicles[veh_id]
+        km = Decimal(str(round(result['distance_km'], 2)))
+        today_km = Decimal(str(round(result['days'].get(today, {}).get('km', 0.0), 2)))
+        if use_odometer:
+            veh.odometer = (veh.odometer or 0) + km
+        veh.tkm = (veh.tkm or 0) + today_km if veh.tkm_date == today else today_km
+        veh.tkm_date = today
+        changed.append(veh)
+
+        # resume after the last fix read (even if it was dropped as a jump),
+        # measuring from the last fix kept
+        _, last_lat, last_lon = result['last']
+        new_states.append(VehicleOdometerState(vehicle_id=veh_id, last_lat=last_lat, last_lon=last_lon,
+                                               last_time=datetime.fromtimestamp(float(t[-1]), tz)))
+        totals['vehicles'] += 1
+        totals['points'] += int(mask.sum())
+        totals['km'] += result['distance_km']
+        totals['dropped'] += result['dropped']
+
+    fields = ['odometer', 'tkm', 'tkm_date'] if use_odometer else ['tkm', 'tkm_date']
+    with transaction.atomic():
+        Vehicle.objects.bulk_update(changed, fields, batch_size=1000)
+        VehicleOdometerState.objects.bulk_create(
+            new_states, update_conflicts=True, unique_fields=['vehicle'],
+            update_fields=['last_time', 'last_lat', 'last_lon', 'updated_at'], batch_size=1000)
+    return totals
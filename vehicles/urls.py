@@ -6,8 +6,11 @@ urlpatterns = [
     path("add_vehicle", views.add_vehicle, name="add_vehicle"),
     path("all_vehicles", views.all_vehicles, name="all_vehicles"),
     path("track/<int:veh_id>", views.track_view, name="vehicles_track"),
+    path("track/<int:veh_id>/polyline", views.track_polyline, name="vehicles_track_polyline"),
     path("location/<int:veh_id>", views.current_view, name="current_view"),
     path("track", views.track_view, name="vehicles_track_all"),
+    path("history/<int:veh_id>", views.history_api, name="vehicles_history"),
+    path("history/<int:veh_id>/export.<str:fmt>", views.history_export, name="vehicles_history_export"),
     path("vehicles_report", views.vehicles_report, name="vehicles_report"),
     path("vehicles_status", views.vehicles_status, name="vehicles_status"),
 ]
\ No newline at end of file
@@ -1,5 +1,14 @@
+from datetime import datetime, timedelta
+
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from .models import Vehicle
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Vehicle, VehicleLocation
+from . import history_store
+from .latest_positions import fleet_rows, latest_positions
+from .track import build_track, default_window
+from .history import EXPORT_FORMATS, InvalidCursor, batched, export_rows, history_page
+from .rollups import fleet_summary, vehicle_summary
 from clients.models import Admin
 from django.utils import timezone
 from django.views.decorators.http import require_GET
@@ -43,58 +52,138 @@ def all_vehicles(request):
     return render(request, 'vehicles/all_vehicles.html', {'vehicles': vehicles})
 
 def vehicles_report(request):
-    vehicles = Vehicle.objects.all()
-    return render(request, 'vehicles/vehicles_report.html', {'vehicles': vehicles})
+    """Per-day report of one vehicle, or fleet totals, from the daily rollups."""
+    vehicles = Vehicle.objects.values('veh_id', 'reg_no').order_by('reg_no')
+    today = timezone.localdate()
+    veh_id = request.GET.get('veh_id')
+    veh_id = int(veh_id) if veh_id and veh_id.isdigit() else None
+    start = _parse_when(request.GET.get('from')) or _parse_when(str(today - timedelta(days=6)))
+    end = _parse_when(request.GET.get('to'), end_of_day=True) or _parse_when(str(today), end_of_day=True)
+    first_day, last_day = timezone.localdate(start), timezone.localdate(end - timedelta(seconds=1))
+    report, fleet, error = None, None, None
+    if veh_id:
+        report = vehicle_summary(veh_id, start, end)
+        if report['uncovered_days']:
+            error = 'Not rolled up yet, left out of the totals: ' + ', '.join(
+                str(day) for day in report['uncovered_days'])
+    else:
+        fleet = fleet_summary(first_day, last_day)
+    return render(request, 'vehicles/vehicles_report.html', {
+        'vehicles': vehicles,
+        'selected_veh_id': veh_id,
+        'date_from': first_day,
+        'date_to': last_day,
+        'report': report,
+        'fleet': fleet,
+        'error': error,
+    })
 
 def vehicles_status(request):
-    vehicles = Vehicle.objects.all()
-    return render(request, 'vehicles/vehicles_status.html', {'vehicles': vehicles})
+    vehicles = fleet_rows()
+    counts = dict.fromkeys(['stop', 'running', 'overspeed', 'idle', 'inactive', 'nodata'], 0)
+    for v in vehicles:
+        counts[v['status']] += 1
+    return render(request, 'vehicles/vehicles_status.html', {'vehicles': vehicles, 'counts': counts})
+
+def _track_window(request, veh_id):
+    """(start, end, zoom) for a track request; defaults to the day before the last fix."""
+    zoom = request.GET.get('zoom')
+    zoom = int(zoom) if zoom and zoom.isdigit() else None
+    start = _parse_when(request.GET.get('start'))
+    end = _parse_when(request.GET.get('end'), end_of_day=True)
+    if start and end:
+        return start, end, zoom
+    last = latest_positions.positions([veh_id]).get(veh_id)
+    last_time = last['time'] if last and last['time'] else None
+    if last_time is None and history_store.columnar_reads():
+        last_time = history_store.get_store().last_time(veh_id) or timezone.now()
+    elif last_time is None:
+        last_time = (VehicleLocation.objects.filter(vehicle_id=veh_id, time__isnull=False)
+                     .order_by('-time').values_list('time', flat=True).first()) or timezone.now()
+    hours = request.GET.get('hours')
+    start, end = default_window(last_time, int(hours) if hours and hours.isdigit() else None)
+    return start, end, zoom
+
+
+def _parse_when(value, end_of_day=False):
+    """Aware datetime from an ISO date or datetime; a bare `end` date includes that day."""
+    if not value:
+        return None
+    try:
+        day = parse_date(value) if len(value) == 10 else None
+        when = None if day else parse_datetime(value)
+    except ValueError:
+        return None
+    if day is not None:
+        when = datetime.combine(day + timedelta(days=1 if end_of_day else 0), datetime.min.time())
+    elif when is None:
+        return None
+    return timezone.make_aware(when) if timezone.is_naive(when) else when
+
 
 @require_GET
 def track_view(request, veh_id: int = None):
     """Vehicle tracking page.
-    If `veh_id` is provided, load recent `VehicleLocation` history and pass as JSON
-    for the template to render a polyline.
+    If `veh_id` is provided, build the simplified track (see `vehicles.track`)
+    for the requested window and pass it as JSON for the template to render.
     """
-    vehicles = Vehicle.objects.all()
+    vehicles = fleet_rows()
     history = []
-    if veh_id:
-        try:
-            v = Vehicle.objects.get(veh_id=veh_id)
-            locs = v.locations.all().order_by('time')[:1000]
-            # build simple list of [lat,lon,time]
-            for l in locs:
-                history.append({'imei': l.vehicle.imei, 'speed': float(l.speed), 'lat': float(l.lat), 'lon': float(l.lon), 'time': l.time.isoformat() if l.time else None})
-        except Vehicle.DoesNotExist:
-            history = []
+    track = None
+    v = next((r for r in vehicles if r['veh_id'] == veh_id), None) if veh_id else None
+    if v is not None:
+        start, end, zoom = _track_window(request, veh_id)
+        track = build_track(veh_id, start, end, zoom)
+        track.update(imei=v['imei'], start=start.isoformat(), end=end.isoformat())
+        if track['last']:
+            # the last fix, for the marker and the sidebar
+            history = [dict(track['last'], imei=v['imei'])]
+
+    return render(request, 'vehicles/vehicles_track.html', {
+        'vehicles': vehicles,
+        'history_json': json.dumps(history),
+        'track_json': json.dumps(track),
+        'selected_veh_id': veh_id,
+    })
+
 
-    return render(request, 'vehicles/vehicles_track.html', {'vehicles': vehicles, 'history_json': json.dumps(history), 'selected_veh_id': veh_id})
+@require_GET
+def track_polyline(request, veh_id: int):
+    """Simplified track as JSON (`?start=&end=&zoom=`), for re-fetching on zoom changes."""
+    if not Vehicle.objects.filter(veh_id=veh_id).exists():
+        return JsonResponse({'error': 'unknown vehicle'}, status=404)
+    start, end, zoom = _track_window(request, veh_id)
+    track = build_track(veh_id, start, end, zoom)
+    track.update(start=start.isoformat(), end=end.isoformat())
+    return JsonResponse(track)
 
 @require_GET
 def current_view(request, veh_id: int = None):
     """Vehicle current location page (latest point only)."""
-    vehicles = Vehicle.objects.all()
+    vehicles = fleet_rows()
     history = []
 
     if veh_id:
-        try:
-            v = Vehicle.objects.get(veh_id=veh_id)
-
-            # ✅ GET ONLY LATEST LOCATION
-            loc = v.locations.order_by('-time').first()
+        v = next((r for r in vehicles if r['veh_id'] == veh_id), None)
+        if v is not None:
+            loc = latest_positions.positions([veh_id]).get(veh_id)
+            if loc is None:
+                # vehicles that have not reported since the position table was added
+                last = (Vehicle(veh_id=veh_id).locations.filter(time__isnull=False)
+                        .order_by('-time').values('lat', 'lon', 'speed', 'time').first())
+                if last:
+                    loc = {'lat': float(last['lat']), 'lon': float(last['lon']),
+                           'speed': float(last['speed'] or 0), 'time': last['time']}
 
             if loc:
                 history = [{
-                    'imei': v.imei,
-                    'speed': float(loc.speed),
-                    'lat': float(loc.lat),
-                    'lon': float(loc.lon),
-                    'time': loc.time.isoformat() if loc.time else None
+                    'imei': v['imei'],
+                    'speed': loc['speed'],
+                    'lat': loc['lat'],
+                    'lon': loc['lon'],
+                    'time': loc['time'].isoformat() if loc['time'] else None
                 }]
 
-        except Vehicle.DoesNotExist:
-            history = []
-
     return render(
         request,
         'vehicles/vehicles_current_location.html',
@@ -103,4 +192,44 @@ def current_view(request, veh_id: int = None):
             'history_json': json.dumps(history),
             'selected_veh_id': veh_id
         }
-    )
\ No newline at end of file
+    )
+
+
+@require_GET
+def history_api(request, veh_id: int):
+    """Keyset-paginated history: `?start=&end=&limit=&cursor=`.
+
+    Returns {'results': [...], 'next': cursor or null}; pass `next` back as
+    `cursor` to get the following page.
+    """
+    if not Vehicle.objects.filter(veh_id=veh_id).exists():
+        return JsonResponse({'error': 'unknown vehicle'}, status=404)
+    limit = request.GET.get('limit', '1000')
+    try:
+        rows, next_cursor = history_page(
+            veh_id,
+            start=_parse_when(request.GET.get('start')),
+            end=_parse_when(request.GET.get('end'), end_of_day=True),
+            cursor=request.GET.get('cursor'),
+            limit=int(limit) if limit.isdigit() else 1000,
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'results': rows, 'next': next_cursor})
+
+
+@require_GET
+def history_export(request, veh_id: int, fmt: str):
+    """Stream a vehicle's history (`?start=&end=`) as CSV, NDJSON or GPX."""
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'unknown format {fmt}'}, status=400)
+    v = Vehicle.objects.filter(veh_id=veh_id).values('reg_no').first()
+    if v is None:
+        return JsonResponse({'error': 'unknown vehicle'}, status=404)
+    render_rows, content_type = EXPORT_FORMATS[fmt]
+    rows = export_rows(veh_id,
+                       start=_parse_when(request.GET.get('start')),
+                       end=_parse_when(request.GET.get('end'), end_of_day=True))
+    response = StreamingHttpResponse(batched(render_rows(rows, name=v['reg_no'])), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="history-{veh_id}.{fmt}"'
+    return response